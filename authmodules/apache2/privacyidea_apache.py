@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+# 2016-10-19 Reuse the HTTP session and the redis connections, cache the
+#            configuration and recently verified credentials in the process
 # 2015-06-04 Cornelius Kölbel  <cornelius.koelbel@netknights.it>
 #            Initial writeup
 #
@@ -41,6 +43,11 @@ import syslog
 import ConfigParser
 import traceback
 import passlib.hash
+import os
+import hmac
+import hashlib
+import threading
+import time
 
 
 OK = True
@@ -51,6 +58,23 @@ DEFAULT_SSLVERIFY = False
 DEFAULT_REDIS = "localhost"
 ROUNDS = 2342
 SALT_SIZE = 10
+# Successfully verified credentials are also kept in the process for some
+# seconds, so that the many requests of a single page do not need to ask
+# the redis database.
+LOCAL_CACHE_SECONDS = 10
+LOCAL_CACHE_SIZE = 1000
+
+# The HTTP session keeps the connections to privacyIDEA open.
+_session = requests.Session()
+# redis connection pools per redis host
+_redis_pools = {}
+# The parsed configuration and the modification time of the config file
+_config_cache = {}
+# The local credentials cache maps the key of a user to the expiration time
+# and a HMAC of the password. The HMAC key only exists in this process.
+_local_cache = {}
+_local_cache_lock = threading.Lock()
+_LOCAL_CACHE_KEY = os.urandom(32)
 
 
 def check_password(environ, username, password):
@@ -58,22 +82,26 @@ def check_password(environ, username, password):
     syslog.syslog(syslog.LOG_DEBUG, "Authentication with {0!s}, {1!s}, {2!s}".format(
         PRIVACYIDEA, REDIS, SSLVERIFY))
     r_value = UNAUTHORIZED
-    rd = redis.Redis(REDIS)
+    key = _generate_key(username, environ)
+    if _check_local_cache(key, password):
+        return OK
+
+    rd = redis.Redis(connection_pool=_get_redis_pool(REDIS))
     seconds = 300  # 5 minutes timeout
 
     # check, if the user already exists in the database.
-    key = _generate_key(username, environ)
     value = rd.get(key)
     if value and passlib.hash.pbkdf2_sha512.verify(password, value):
         # update the timeout
-        rd.setex(key, _generate_digest(password), seconds)
+        rd.setex(key, value, seconds)
+        _add_local_cache(key, password)
         r_value = OK
 
     else:
         # Check against privacyidea
         data = {"user": username,
                 "pass": password}
-        response = requests.post(PRIVACYIDEA + "/validate/check", data=data,
+        response = _session.post(PRIVACYIDEA + "/validate/check", data=data,
                                  verify=SSLVERIFY)
 
         if response.status_code == 200:
@@ -88,6 +116,7 @@ def check_password(environ, username, password):
 
             if json_response.get("result", {}).get("value"):
                 rd.setex(key, _generate_digest(password), seconds)
+                _add_local_cache(key, password)
                 r_value = OK
         else:
             syslog.syslog(syslog.LOG_ERR, "Error connecting to privacyIDEA: "
@@ -97,6 +126,47 @@ def check_password(environ, username, password):
     return r_value
 
 
+def _get_redis_pool(host):
+    """
+    Return the connection pool for the given redis host.
+    """
+    pool = _redis_pools.get(host)
+    if pool is None:
+        pool = redis.ConnectionPool(host=host)
+        _redis_pools[host] = pool
+    return pool
+
+
+def _local_digest(password):
+    if isinstance(password, unicode):
+        password = password.encode("utf-8")
+    return hmac.new(_LOCAL_CACHE_KEY, password, hashlib.sha256).digest()
+
+
+def _check_local_cache(key, password):
+    """
+    Check if the password of the user was verified during the last
+    LOCAL_CACHE_SECONDS.
+    """
+    with _local_cache_lock:
+        entry = _local_cache.get(key)
+    return bool(entry and entry[0] > time.time() and
+                hmac.compare_digest(entry[1], _local_digest(password)))
+
+
+def _add_local_cache(key, password):
+    now = time.time()
+    with _local_cache_lock:
+        if len(_local_cache) >= LOCAL_CACHE_SIZE:
+            for old_key, entry in _local_cache.items():
+                if entry[0] <= now:
+                    del _local_cache[old_key]
+            if len(_local_cache) >= LOCAL_CACHE_SIZE:
+                _local_cache.clear()
+        _local_cache[key] = (now + LOCAL_CACHE_SECONDS,
+                             _local_digest(password))
+
+
 def _generate_digest(password):
     pw_dig = passlib.hash.pbkdf2_sha512.encrypt(password,
                                                 rounds=ROUNDS,
@@ -115,6 +185,7 @@ def _generate_key(username, environ):
 def _get_config():
     """
     Try to read config from the file /etc/privacyidea/apache.conf
+    The file is only read again, if it was modified.
 
     The config values are
         redis = IPAddress:Port
@@ -123,6 +194,13 @@ def _get_config():
     :return: The configuration
     :rtype: dict
     """
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime
+    except OSError:
+        mtime = None
+    if _config_cache.get("stamp") == (CONFIG_FILE, mtime):
+        return _config_cache.get("config")
+
     config_file = ConfigParser.ConfigParser()
     config_file.read(CONFIG_FILE)
     PRIVACYIDEA = DEFAULT_PRIVACYIDEA
@@ -138,4 +216,6 @@ def _get_config():
         syslog.syslog(syslog.LOG_ERR, "{0!s}".format(exx))
     syslog.syslog(syslog.LOG_DEBUG, "Reading configuration {0!s}, {1!s}, {2!s}".format(
         PRIVACYIDEA, REDIS, SSLVERIFY))
+    _config_cache["stamp"] = (CONFIG_FILE, mtime)
+    _config_cache["config"] = (PRIVACYIDEA, REDIS, SSLVERIFY)
     return PRIVACYIDEA, REDIS, SSLVERIFY
@@ -63,6 +63,7 @@ from privacyidea.api.lib.postpolicy import postpolicy, get_webui_settings
 from privacyidea.api.lib.prepolicy import is_remote_user_allowed
 from privacyidea.lib.utils import get_client_ip
 from privacyidea.lib.config import get_from_config, SYSCONF
+from privacyidea.lib.metrics import start_request
 import logging
 
 log = logging.getLogger(__name__)
@@ -76,6 +77,7 @@ def before_request():
     """
     This is executed before the request
     """
+    start_request()
     request.all_data = get_all_params(request.values, request.data)
     privacyidea_server = current_app.config.get("PI_AUDIT_SERVERNAME") or \
                          request.host
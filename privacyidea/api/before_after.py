@@ -59,10 +59,35 @@ from ..lib.error import (privacyIDEAError,
                          AuthError,
                          PolicyError)
 from privacyidea.lib.utils import get_client_ip
+from privacyidea.lib.sqlstats import add_to_audit as add_sql_stats_to_audit
+from privacyidea.lib.metrics import start_request, finish_request
 
 log = logging.getLogger(__name__)
 
 
+@token_blueprint.before_request
+@audit_blueprint.before_request
+@user_blueprint.before_request
+@caconnector_blueprint.before_request
+@system_blueprint.before_request
+@radiusserver_blueprint.before_request
+@resolver_blueprint.before_request
+@machineresolver_blueprint.before_request
+@machine_blueprint.before_request
+@realm_blueprint.before_request
+@defaultrealm_blueprint.before_request
+@policy_blueprint.before_request
+@application_blueprint.before_request
+@smtpserver_blueprint.before_request
+def before_metrics_request():
+    """
+    Remember the start of the request for the metrics. This is registered
+    before the authentication, so that the duration contains the
+    verification of the authorization token.
+    """
+    start_request()
+
+
 @token_blueprint.before_request
 @audit_blueprint.before_request
 @user_blueprint.before_request
@@ -179,10 +204,12 @@ def after_request(response):
     # In certain error cases the before_request was not handled
     # completely so that we do not have an audit_object
     if "audit_object" in g:
+        add_sql_stats_to_audit(g.audit_object)
         g.audit_object.finalize_log()
 
     # No caching!
     response.headers['Cache-Control'] = 'no-cache'
+    finish_request(response)
     return response
 
 
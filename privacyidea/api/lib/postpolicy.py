@@ -155,6 +155,11 @@ def sign_response(request, response):
         response_object = response[0]
     else:
         response_object = response
+    if response_object.is_streamed:
+        # Reading the data of a streamed response (like the token export)
+        # would consume the generator. Streamed responses are no JSON.
+        log.info("We do not sign streamed response data.")
+        return response
     try:
         content = json.loads(response_object.data)
         nonce = request.all_data.get("nonce")
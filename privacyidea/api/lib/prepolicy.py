@@ -387,8 +387,7 @@ def check_max_token_user(request=None, action=None):
                                                      client=g.client_ip)
         if limit_list:
             # we need to check how many tokens the user already has assigned!
-            tokenobject_list = get_tokens(user=user_object)
-            already_assigned_tokens = len(tokenobject_list)
+            already_assigned_tokens = get_tokens(user=user_object, count=True)
             if already_assigned_tokens >= int(max(limit_list)):
                 raise PolicyError(ERROR)
     return True
@@ -426,9 +425,8 @@ def check_max_token_realm(request=None, action=None):
                                                      realm=realm,
                                                      client=g.client_ip)
         if limit_list:
-            # we need to check how many tokens the user already has assigned!
-            tokenobject_list = get_tokens(realm=realm)
-            already_assigned_tokens = len(tokenobject_list)
+            # we need to check how many tokens are already in the realm!
+            already_assigned_tokens = get_tokens(realm=realm, count=True)
             if already_assigned_tokens >= int(max(limit_list)):
                 raise PolicyError(ERROR)
     return True
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #  privacyIDEA is a fork of LinOTP
+#  2016-10-19 Add send_file_stream
+#  2016-10-19 Cache the verified authentication tokens
 #  May 08, 2014 Cornelius Kölbel
 #  License:  AGPLv3
 #  contact:  http://www.privacyidea.org
@@ -32,9 +34,11 @@ import pkg_resources
 import logging
 import json
 import jwt
+from collections import OrderedDict
 from flask import (jsonify,
                    current_app,
-                   Response)
+                   Response,
+                   stream_with_context)
 
 log = logging.getLogger(__name__)
 ENCODING = "utf-8"
@@ -44,6 +48,14 @@ SESSION_KEY_LENGTH = 32
 optional = True
 required = False
 
+# The claims of verified authentication tokens. The web UI sends the same
+# token with each request, so the signature is only verified once. The
+# entries are kept until the token expires.
+_auth_token_cache = OrderedDict()
+_auth_token_cache_lock = threading.Lock()
+# Number of authentication tokens, that are kept in the cache of the process
+AUTH_TOKEN_CACHE_SIZE = 1000
+
 
 def get_version_number():
     """
@@ -210,6 +222,62 @@ def send_csv_result(obj, data_key="tokens",
     return Response(output, mimetype=content_type)
 
 
+def send_csv_stream(rows, columns, filename="privacyidea-tokendata.csv"):
+    """
+    returns a streamed CSV document of the rows. In contrast to
+    send_csv_result the document is not created in memory, but each row is
+    sent as soon as it is read from the generator.
+
+    The values are written in the same format as in send_csv_result.
+
+    :param rows: generator or list of dicts
+    :param columns: The keys of the row dicts, that are written as columns
+    :type columns: list
+    :param filename: The filename to save the CSV to.
+    :type filename: basestring
+    :return: The streamed response object
+    :rtype: Response object
+    """
+    delim = "'"
+
+    def generate():
+        output = u""
+        for column in columns:
+            output += u"{0!s}{1!s}{2!s}, ".format(delim, column, delim)
+        yield output + u"\n"
+        for row in rows:
+            output = u""
+            for column in columns:
+                val = row.get(column)
+                if type(val) in [str, unicode]:
+                    value = val.replace("\n", " ")
+                else:
+                    value = val
+                output += u"{0!s}{1!s}{2!s}, ".format(delim, value, delim)
+            yield output + u"\n"
+
+    return send_file_stream(generate(), filename)
+
+
+def send_file_stream(parts, filename,
+                     content_type="application/force-download"):
+    """
+    returns a streamed file download. Each part is sent as soon as it is
+    read from the generator.
+
+    :param parts: generator or list of the parts of the file
+    :param filename: The filename to save the file to.
+    :type filename: basestring
+    :param content_type: The content type of the file
+    :return: The streamed response object
+    :rtype: Response object
+    """
+    headers = {'Content-disposition': 'attachment; filename={0!s}'.format(
+        filename)}
+    return Response(stream_with_context(parts), mimetype=content_type,
+                    headers=headers)
+
+
 @log_with(log)
 def getLowerParams(param):
     ret = {}
@@ -273,6 +341,47 @@ def verify_auth_token(auth_token, required_role=None):
         raise AuthError("Authentication failure",
                         "missing Authorization header",
                         status=401)
+    r = _get_cached_auth_token(auth_token)
+    if r is None:
+        r = _decode_auth_token(auth_token)
+    if required_role and r.get("role") not in required_role:
+        # If we require a certain role like "admin", but the users role does
+        # not match
+        raise AuthError("Authentication failure",
+                        "You do not have the necessary role (%s) to access "
+                        "this resource!" % required_role,
+                        status=401)
+    return r
+
+
+def _get_cached_auth_token(auth_token):
+    """
+    Return a copy of the claims of an already verified authentication token
+    or None, if the token is not cached or expired.
+    """
+    key = (current_app.secret_key, auth_token)
+    with _auth_token_cache_lock:
+        entry = _auth_token_cache.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            return None
+        # mark this entry as recently used
+        _auth_token_cache[key] = entry
+        return _copy_claims(entry[1])
+
+
+def _copy_claims(claims):
+    # The claims only contain strings, numbers and the list of rights
+    return dict((k, list(v) if isinstance(v, list) else v)
+                for k, v in claims.items())
+
+
+def _decode_auth_token(auth_token):
+    """
+    Verify the signature and the expiration of the authentication token and
+    add its claims to the cache.
+
+    :return: dict of the claims
+    """
     try:
         r = jwt.decode(auth_token, current_app.secret_key)
     except jwt.DecodeError as err:
@@ -283,11 +392,13 @@ def verify_auth_token(auth_token, required_role=None):
         raise AuthError("Authentication failure",
                         "Your token has expired: {0!s}".format(err),
                         status=401)
-    if required_role and r.get("role") not in required_role:
-        # If we require a certain role like "admin", but the users role does
-        # not match
-        raise AuthError("Authentication failure",
-                        "You do not have the necessary role (%s) to access "
-                        "this resource!" % required_role,
-                        status=401)
+    exp = r.get("exp")
+    if isinstance(exp, (int, long, float)):
+        key = (current_app.secret_key, auth_token)
+        with _auth_token_cache_lock:
+            _auth_token_cache.pop(key, None)
+            _auth_token_cache[key] = (exp, _copy_claims(r))
+            while len(_auth_token_cache) > AUTH_TOKEN_CACHE_SIZE:
+                # remove the least recently used entry
+                _auth_token_cache.popitem(last=False)
     return r
@@ -3,6 +3,7 @@
 # http://www.privacyidea.org
 # (c) cornelius kölbel, privacyidea.org
 #
+# 2016-10-19 Add /machine/authitems to fetch the items of many hosts
 # 2014-12-08 Cornelius Kölbel, <cornelius@privacyidea.org>
 #            Complete rewrite during flask migration
 #            Try to provide REST API
@@ -34,7 +35,7 @@ from ..lib.policy import ACTION
 from ..lib.machine import (get_machines, attach_token, detach_token,
                            add_option, delete_option,
                            list_token_machines, list_machine_tokens,
-                           get_auth_items)
+                           get_auth_items, get_hosts_auth_items)
 import logging
 import netaddr
 
@@ -369,3 +370,63 @@ def get_auth_items_api(application=None):
                                                                application)})
     return send_result(ret)
 
+
+
+@machine_blueprint.route('/authitems', methods=['GET'])
+@machine_blueprint.route('/authitems/<application>', methods=['GET'])
+@prepolicy(mangle, request=request)
+@prepolicy(check_base_action, request, ACTION.AUTHITEMS)
+def get_hosts_auth_items_api(application=None):
+    """
+    This fetches the authentication items of many client machines at once.
+    Only applications, that allow bulk calls like the ssh application,
+    return authentication items.
+
+    :param hostnames: A comma separated list of hostnames
+    :type hostnames: basestring
+    :param challenge: A challenge for which the authentication items are
+        calculated.
+    :type challenge: basestring
+
+    :return: dictionary with the hostnames as keys and the dictionaries with
+        lists of authentication items as values
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+        {
+          "id": 1,
+          "jsonrpc": "2.0",
+          "result": {
+            "status": true,
+            "value": { "host1": { "ssh": [ { "username": "....",
+                                             "sshkey": "...."
+                                           }
+                                         ]
+                                },
+                       "host2": {}
+                     }
+          },
+          "version": "privacyIDEA unknown"
+        }
+    """
+    challenge = getParam(request.all_data, "challenge")
+    hostnames = getParam(request.all_data, "hostnames", optional=False)
+    hostnames = [h.strip() for h in hostnames.split(",") if h.strip()]
+    # Get optional additional filter parameters
+    filter_param = request.all_data
+    for key in ["challenge", "hostnames"]:
+        if key in filter_param:
+            del(filter_param[key])
+
+    ret = get_hosts_auth_items(hostnames, application=application,
+                               challenge=challenge,
+                               filter_param=filter_param, bulk_call=True)
+    g.audit_object.log({'success': True,
+                        'info': "hosts: {0!s}, application: {1!s}".format(
+                            ",".join(hostnames), application)})
+    return send_result(ret)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# http://www.privacyidea.org
+#
+# 2016-10-19 Initial writeup of /system/metrics
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This endpoint returns the metrics of privacyIDEA in the Prometheus text
+format. The metrics are only collected, if PI_METRICS is set in pi.cfg.
+
+The endpoint has its own blueprint, since a monitoring system usually does
+not authenticate at /auth. The clients in PI_METRICS_CLIENTS may read the
+metrics without authentication, all other clients need to pass the
+authorization token of an administrator.
+
+The code of this module is tested in tests/test_api_metrics.py
+"""
+from flask import (Blueprint, request, current_app, Response, abort)
+from netaddr import IPAddress, IPNetwork
+from .auth import check_auth_token
+from ..lib.metrics import get_registry
+import logging
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics_blueprint = Blueprint('metrics_blueprint', __name__)
+
+
+def _is_metrics_client(client_ip):
+    """
+    Check if the client may read the metrics without authentication.
+
+    :param client_ip: The IP address of the client
+    :return: True or False
+    """
+    if not client_ip:
+        return False
+    for network in current_app.config.get("PI_METRICS_CLIENTS", []):
+        if IPAddress(client_ip) in IPNetwork(network):
+            return True
+    return False
+
+
+@metrics_blueprint.before_request
+def before_request():
+    """
+    This is executed before the request.
+
+    If the metrics are not collected, the endpoint does not exist.
+    """
+    if get_registry() is None:
+        abort(404)
+    # We use the address of the direct peer, since the X-Forwarded-For
+    # header can be set by any client.
+    if not _is_metrics_client(request.remote_addr):
+        check_auth_token(required_role=["admin"])
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Return the metrics of all worker processes in the Prometheus text format.
+
+    The metrics contain the number and the duration of the API requests per
+    endpoint and the duration of internal operations like resolver lookups,
+    HSM operations, sending SMS and emails, writing the audit log and
+    evaluating policies.
+
+    :reqheader Authorization: The authorization token of an administrator.
+        It is not necessary for the clients in PI_METRICS_CLIENTS.
+
+    **Example request**:
+
+    .. sourcecode:: http
+
+       GET /system/metrics HTTP/1.1
+       Host: example.com
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: text/plain; version=0.0.4; charset=utf-8
+
+       # HELP privacyidea_requests_total Number of handled API requests.
+       # TYPE privacyidea_requests_total counter
+       privacyidea_requests_total{endpoint="/validate/check",method="POST",status="200"} 42
+    """
+    return Response(get_registry().exposition(), content_type=CONTENT_TYPE)
@@ -3,6 +3,10 @@
 # http://www.privacyidea.org
 # (c) cornelius kölbel, privacyidea.org
 #
+# 2016-10-19 Add bulk token enrollment
+# 2016-10-19 Add bulk token actions
+# 2016-10-19 Add streaming token export
+# 2016-10-19 Search the serial by OTP in chunks and worker processes
 # 2016-08-09 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #            Add number of tokens, searched by get_serial_by_otp
 # 2016-07-17 Cornelius Kölbel <cornelius.koelbel@netknights.it>
@@ -52,7 +56,9 @@ from flask import (Blueprint, request, g, current_app)
 from ..lib.log import log_with
 from lib.utils import (optional,
                        send_result, send_error,
-                       send_csv_result, required, get_all_params)
+                       send_csv_result, send_csv_stream, send_file_stream,
+                       required,
+                       get_all_params)
 from ..lib.user import get_user_from_param
 from ..lib.token import (init_token, get_tokens_paginate, assign_token,
                          unassign_token, remove_token, enable_token,
@@ -62,17 +68,22 @@ from ..lib.token import (init_token, get_tokens_paginate, assign_token,
                          set_sync_window, set_count_auth,
                          set_hashlib, set_max_failcount, set_realms,
                          copy_token_user, copy_token_pin, lost_token,
-                         get_serial_by_otp, get_tokens,
-                         set_validity_period_end, set_validity_period_start)
+                         get_tokens, get_tokens_export, EXPORT_COLUMNS,
+                         set_validity_period_end, set_validity_period_start,
+                         bulk_token_action, bulk_init_tokens,
+                         BULK_CHUNK_SIZE)
 from werkzeug.datastructures import FileStorage
 from cgi import FieldStorage
-from privacyidea.lib.error import (ParameterError, TokenAdminError)
+from privacyidea.lib.error import (ParameterError, TokenAdminError,
+                                   PolicyError)
 from privacyidea.lib.importotp import (parseOATHcsv, parseSafeNetXML,
-                                       parseYubicoCSV, parsePSKCdata, GPGImport)
+                                       parseYubicoCSV, parsePSKCdata, GPGImport,
+                                       export_pskc, export_oath_csv)
 import logging
 from lib.utils import getParam
-from privacyidea.lib.policy import ACTION
+from privacyidea.lib.policy import ACTION, SCOPE
 from privacyidea.lib.challenge import get_challenges_paginate
+from privacyidea.lib.otpsearch import OTPSearch
 from privacyidea.api.lib.prepolicy import (prepolicy, check_base_action,
                                            check_token_init, check_token_upload,
                                            check_max_token_user,
@@ -334,6 +345,73 @@ def list_api():
         return send_result(tokens)
 
 
+@token_blueprint.route('/export', methods=['GET'])
+@log_with(log)
+@admin_required
+def export_api():
+    """
+    Export all tokens matching the filter as a CSV file. In contrast to the
+    CSV output of ``GET /token/`` the export is not limited to one page.
+    The tokens are read from the database in chunks and the CSV rows are
+    streamed to the client.
+
+    :query serial: Export the token data of this single token. You can do a
+        not strict matching by specifying a serial like "*OATH*".
+    :query type: Export only token of type. You ca do a non strict matching by
+        specifying a tokentype like "*otp*", to file hotp and totp tokens.
+    :query user: export tokens of this user
+    :query tokenrealm: only export the tokens in this realm
+    :query basestring description: Export token with this kind of description
+    :query assigned: Only export assigned (True) or not assigned (False) tokens
+    :query resolver: Only export tokens of users in this resolver
+    :query userid: Only export tokens of users with this userid
+    :query columns: comma separated list of the columns to export. Allowed
+        columns are serial, tokentype, description, active, revoked, locked,
+        failcount, maxfail, count, count_window, sync_window, otplen,
+        rollout_state, resolver, user_id, username, user_realm, realms and
+        info. Default are all columns.
+    :query chunksize: The number of tokens read from the database at once.
+
+    :return: The CSV file
+    """
+    param = request.all_data
+    user = get_user_from_param(param, optional)
+    serial = getParam(param, "serial", optional)
+    tokentype = getParam(param, "type", optional)
+    description = getParam(param, "description", optional)
+    realm = getParam(param, "tokenrealm", optional)
+    userid = getParam(param, "userid", optional)
+    resolver = getParam(param, "resolver", optional)
+    assigned = getParam(param, "assigned", optional)
+    if assigned:
+        assigned = assigned.lower() == "true"
+    columns = getParam(param, "columns", optional)
+    if columns:
+        columns = [c.strip() for c in columns.split(",")]
+    else:
+        columns = EXPORT_COLUMNS
+    chunk_size = int(getParam(param, "chunksize", optional, default=500))
+
+    # get_tokens_export checks the columns before the first row is read.
+    rows = get_tokens_export(serial=serial, realm=realm, user=user,
+                             assigned=assigned, tokentype=tokentype,
+                             resolver=resolver, description=description,
+                             userid=userid, columns=columns,
+                             chunk_size=chunk_size)
+    first_row = next(rows, None)
+
+    def all_rows():
+        if first_row is not None:
+            yield first_row
+            for row in rows:
+                yield row
+
+    g.audit_object.log({"success": True,
+                        "info": "realm: {0!s}".format(realm)})
+    return send_csv_stream(all_rows(), columns,
+                           filename="privacyidea-tokenexport.csv")
+
+
 @token_blueprint.route('/assign', methods=['POST'])
 @prepolicy(check_max_token_realm, request)
 @prepolicy(check_max_token_user, request)
@@ -935,6 +1013,12 @@ def get_serial_by_otp_api(otp=None):
     he can type in the OTP value and gets the serial number of the token, that
     generates this very OTP value.
 
+    The tokens are searched in chunks. The number of worker processes, the
+    chunk size and the time budget of the search are defined by
+    ``PI_OTPSEARCH_WORKERS``, ``PI_OTPSEARCH_CHUNKSIZE`` and
+    ``PI_OTPSEARCH_TIMEOUT`` in pi.cfg. If the time budget is exhausted,
+    the response contains ``complete=false``.
+
     :query otp: The given OTP value
     :query type: Limit the search to this token type
     :query unassigned: If set=1, only search in unassigned tokens
@@ -943,7 +1027,8 @@ def get_serial_by_otp_api(otp=None):
         searched
     :query serial: This can be a substring of serial numbers to search in.
     :query window: The number of OTP look ahead (default=10)
-    :return: The serial number of the token found
+    :return: The serial number of the token found, the number of tokens
+        and whether all tokens were searched
     """
     ttype = getParam(request.all_data, "type")
     unassigned_param = getParam(request.all_data, "unassigned")
@@ -955,6 +1040,7 @@ def get_serial_by_otp_api(otp=None):
     serial_substr = serial_substr or ""
 
     serial = None
+    complete = True
     assigned = None
     if unassigned_param:
         assigned = False
@@ -964,14 +1050,293 @@ def get_serial_by_otp_api(otp=None):
     count = get_tokens(tokentype=ttype, serial="*{0!s}*".format(
             serial_substr), assigned=assigned, count=True)
     if not count_only:
-        tokenobj_list = get_tokens(tokentype=ttype,
-                                   serial="*{0!s}*".format(serial_substr),
-                                   assigned=assigned)
-        serial = get_serial_by_otp(tokenobj_list, otp=otp, window=window)
+        otp_search = OTPSearch(otp, window=window, tokentype=ttype,
+                               serial="*{0!s}*".format(serial_substr),
+                               assigned=assigned)
+        serial = otp_search.get_serial()
+        complete = otp_search.complete
 
     g.audit_object.log({"success": True,
                         "info": "get {0!s} by OTP. {1!s} tokens".format(
                             serial, count)})
 
     return send_result({"serial": serial,
-                        "count": count})
+                        "count": count,
+                        "complete": complete})
+
+
+# The admin policy actions of the bulk token actions
+BULK_POLICY_ACTIONS = {"enable": ACTION.ENABLE,
+                       "disable": ACTION.DISABLE,
+                       "revoke": ACTION.REVOKE,
+                       "reset": ACTION.RESET,
+                       "realm": ACTION.TOKENREALMS,
+                       "assign": ACTION.ASSIGN}
+
+
+def _check_bulk_realm(action, realm):
+    """
+    Check the admin policies for the action on the tokens in the given
+    realm like check_base_action does for a single token.
+
+    :return: True or False
+    """
+    policy_object = g.policy_object
+    policies = policy_object.get_policies(
+        action=action, user=g.logged_in_user.get("username"), realm=realm,
+        scope=SCOPE.ADMIN, client=g.client_ip,
+        adminrealm=g.logged_in_user.get("realm"), active=True)
+    return len(policies) > 0
+
+
+def _get_bulk_limit(user=None, realms=None):
+    """
+    Determine how many tokens may still be assigned to the user and put into
+    the realms according to the max_token_per_user and max_token_per_realm
+    policies.
+
+    :return: The number of tokens or None, if there is no limit
+    """
+    policy_object = g.policy_object
+    limits = []
+    if user:
+        limit_list = policy_object.get_action_values(ACTION.MAXTOKENUSER,
+                                                     scope=SCOPE.ENROLL,
+                                                     realm=user.realm,
+                                                     user=user.login,
+                                                     client=g.client_ip)
+        if limit_list:
+            limits.append(int(max(limit_list)) -
+                          get_tokens(user=user, count=True))
+        realms = [user.realm]
+    for realm in realms or []:
+        limit_list = policy_object.get_action_values(ACTION.MAXTOKENREALM,
+                                                     scope=SCOPE.ENROLL,
+                                                     realm=realm,
+                                                     client=g.client_ip)
+        if limit_list:
+            limits.append(int(max(limit_list)) -
+                          get_tokens(realm=realm, count=True))
+    if not limits:
+        return None
+    return max(min(limits), 0)
+
+
+@token_blueprint.route('/bulk/<action>', methods=['POST'])
+@event("token_bulk", request, g)
+@log_with(log)
+@admin_required
+def bulk_api(action=None):
+    """
+    Enable, disable, revoke, reset, set the realms of or assign many tokens
+    with one request. The tokens are either given by a list of serial
+    numbers or by a token filter like in ``GET /token/export``.
+
+    The tokens are changed in chunks, each chunk in one database
+    transaction. The admin policies are checked once for each realm of the
+    tokens. Tokens, which the administrator may not change, are skipped.
+    The event handlers are called for the event ``token_bulk`` and not for
+    the single tokens.
+
+    The audit log contains one entry with the number of changed and
+    skipped tokens. The changed and skipped serial numbers are returned in
+    the details of the response.
+
+    You can call the function like this:
+        POST /token/bulk/disable?serials=<serial1>,<serial2>
+        POST /token/bulk/realm?type=totp&tokenrealm=<realm>&realms=<realms>
+
+    :param action: One of enable, disable, revoke, reset, realm or assign
+    :jsonparam serials: A list or a comma separated list of serial numbers
+    :jsonparam serial: Change the tokens matching this serial number like
+        "*OATH*"
+    :jsonparam type: Change the tokens of this type
+    :jsonparam tokenrealm: Change the tokens in this realm
+    :jsonparam description: Change the tokens with this description
+    :jsonparam assigned: Change only assigned (True) or not assigned (False)
+        tokens
+    :jsonparam resolver: Change the tokens of users in this resolver
+    :jsonparam userid: Change the tokens of users with this userid
+    :jsonparam realms: The action "realm" sets these realms. Comma separated
+    :jsonparam user: The action "assign" assigns the tokens to this user
+    :jsonparam realm: The realm of the user
+    :jsonparam chunksize: The number of tokens changed in one transaction
+    :return: The number of changed tokens in "value". The details contain
+        the list of the changed serials in "changed" and the skipped serials
+        with the reason in "skipped".
+
+    **Example response**:
+
+    .. sourcecode:: http
+
+       HTTP/1.1 200 OK
+       Content-Type: application/json
+
+        {
+          "detail": {
+            "changed": ["OATH0001", "OATH0002"],
+            "skipped": {"OATH0003": "locked",
+                        "OATH0004": "not allowed"}
+          },
+          "id": 1,
+          "jsonrpc": "2.0",
+          "result": {
+            "status": true,
+            "value": 2
+          },
+          "version": "privacyIDEA unknown"
+        }
+    """
+    param = request.all_data
+    if action not in BULK_POLICY_ACTIONS:
+        raise ParameterError("Unknown action {0!s}".format(action))
+    serials = getParam(param, "serials", optional)
+    if serials is not None and type(serials) != list:
+        serials = [s.strip() for s in serials.split(",") if s.strip()]
+    serial = getParam(param, "serial", optional)
+    tokentype = getParam(param, "type", optional)
+    description = getParam(param, "description", optional)
+    realm = getParam(param, "tokenrealm", optional)
+    userid = getParam(param, "userid", optional)
+    resolver = getParam(param, "resolver", optional)
+    assigned = getParam(param, "assigned", optional)
+    if assigned:
+        assigned = assigned.lower() == "true"
+    chunk_size = int(getParam(param, "chunksize", optional,
+                              default=BULK_CHUNK_SIZE))
+    user = None
+    realm_list = None
+    if action == "assign":
+        user = get_user_from_param(param, required)
+    elif action == "realm":
+        realms = getParam(param, "realms", required)
+        if type(realms) == list:
+            realm_list = realms
+        else:
+            realm_list = [r.strip() for r in realms.split(",") if r.strip()]
+
+    policy_action = BULK_POLICY_ACTIONS.get(action)
+    check_realm = None
+    if g.policy_object.get_policies(scope=SCOPE.ADMIN, active=True,
+                                    all_times=True):
+        if action == "assign":
+            # Like assign_api we check the realm of the user
+            if not _check_bulk_realm(policy_action, user.realm):
+                raise PolicyError("Admin actions are defined, but the "
+                                  "action {0!s} is not allowed!".format(
+                                      policy_action))
+        else:
+            def check_realm(token_realm):
+                return _check_bulk_realm(policy_action, token_realm)
+    limit = None
+    if action in ["assign", "realm"]:
+        limit = _get_bulk_limit(user=user, realms=realm_list)
+
+    res = bulk_token_action(action, serials=serials, serial=serial,
+                            tokentype=tokentype, realm=realm,
+                            assigned=assigned, resolver=resolver,
+                            description=description, userid=userid,
+                            realms=realm_list, user=user,
+                            check_realm=check_realm, limit=limit,
+                            chunk_size=chunk_size)
+    g.audit_object.log({"success": True,
+                        "action_detail": "{0!s}: {1:d} tokens".format(
+                            action, res.get("count")),
+                        "info": "changed: {0:d}, skipped: {1:d}".format(
+                            res.get("count"), len(res.get("skipped")))})
+    return send_result(res.get("count"),
+                       details={"changed": res.get("changed"),
+                                "skipped": res.get("skipped")})
+
+
+@token_blueprint.route('/bulk/init', methods=['POST'])
+@event("token_bulkinit", request, g)
+@log_with(log)
+@admin_required
+def bulkinit_api():
+    """
+    Enroll many HOTP or TOTP tokens with one request. The keys are generated
+    on the server and the serial numbers are generated like in
+    ``POST /token/init``.
+
+    The tokens are written in chunks, each chunk in one database
+    transaction. The tokens are not assigned to a user and no QR codes are
+    created. The admin policies for enrolling the token type are checked
+    once for each realm and the policy max_token_per_realm is checked for
+    all tokens. The event handlers are called for the event
+    ``token_bulkinit`` and not for the single tokens.
+
+    The keys of the new tokens are streamed back as a PSKC file, which is
+    encrypted with the pre shared key, or as an OATH CSV file, which is not
+    encrypted. Both files can be imported with ``POST /token/load``.
+
+    You can call the function like this:
+        POST /token/bulk/init?count=1000&type=totp&psk=<32 hex characters>
+
+    :jsonparam count: The number of tokens to enroll
+    :jsonparam type: The token type hotp or totp. Default is hotp.
+    :jsonparam prefix: The prefix of the serial numbers
+    :jsonparam tokenrealms: The realms of the tokens. Comma separated
+    :jsonparam description: The description of the tokens
+    :jsonparam hashlib: The hash algorithm sha1, sha256 or sha512
+    :jsonparam otplen: The length of the OTP values
+    :jsonparam timeStep: The time step of TOTP tokens
+    :jsonparam outform: The format of the file "pskc" (default) or "csv"
+    :jsonparam psk: The AES-128 key to encrypt the PSKC file, 32 hex
+        characters
+    :jsonparam chunksize: The number of tokens written in one transaction
+    :return: The PSKC or CSV file
+    """
+    param = request.all_data
+    count = int(getParam(param, "count", required))
+    tokentype = getParam(param, "type", optional, default="hotp").lower()
+    prefix = getParam(param, "prefix", optional)
+    description = getParam(param, "description", optional)
+    hashlib = getParam(param, "hashlib", optional)
+    otplen = getParam(param, "otplen", optional)
+    timestep = getParam(param, "timeStep", optional)
+    outform = getParam(param, "outform", optional, default="pskc").lower()
+    chunk_size = int(getParam(param, "chunksize", optional,
+                              default=BULK_CHUNK_SIZE))
+    realms = getParam(param, "tokenrealms", optional) or []
+    if type(realms) != list:
+        realms = [r.strip() for r in realms.split(",") if r.strip()]
+
+    tokens = []
+    # The exports read the list of the tokens, when the file is streamed.
+    # Creating them first checks the parameters before any token is written.
+    if outform == "pskc":
+        parts = export_pskc(tokens, getParam(param, "psk", required))
+        filename = "privacyidea-tokens.xml"
+    elif outform == "csv":
+        parts = export_oath_csv(tokens)
+        filename = "privacyidea-tokens.csv"
+    else:
+        raise ParameterError("Unknown outform {0!s}. Allowed are pskc and "
+                             "csv.".format(outform))
+
+    if g.policy_object.get_policies(scope=SCOPE.ADMIN, active=True,
+                                    all_times=True):
+        # Like check_token_init we check the enroll action for the realms
+        policy_action = "enroll{0!s}".format(tokentype.upper())
+        for realm in realms or [None]:
+            if not _check_bulk_realm(policy_action, realm):
+                raise PolicyError("Admin actions are defined, but you are "
+                                  "not allowed to enroll this token type!")
+    limit = _get_bulk_limit(realms=realms)
+    if limit is not None and count > limit:
+        raise PolicyError("The maximum number of allowed tokens in the "
+                          "realms is exceeded. Only {0:d} more tokens are "
+                          "allowed.".format(limit))
+
+    tokens.extend(bulk_init_tokens(count, tokentype=tokentype, prefix=prefix,
+                                   realms=realms, description=description,
+                                   hashlib=hashlib, otplen=otplen,
+                                   timestep=timestep, chunk_size=chunk_size))
+    g.audit_object.log({"success": True,
+                        "token_type": tokentype,
+                        "action_detail": "bulkinit: {0:d} tokens".format(
+                            len(tokens)),
+                        "info": "realms: {0!s}, outform: {1!s}".format(
+                            ", ".join(realms), outform)})
+    return send_file_stream(parts, filename)
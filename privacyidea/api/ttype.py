@@ -47,6 +47,7 @@ from privacyidea.lib.config import (get_token_class, get_from_config, SYSCONF)
 from privacyidea.lib.user import get_user_from_param
 from privacyidea.api.lib.postpolicy import postrequest, sign_response
 from privacyidea.lib.utils import get_client_ip
+from privacyidea.lib.sqlstats import add_to_audit as add_sql_stats_to_audit
 
 
 log = logging.getLogger(__name__)
@@ -90,6 +91,7 @@ def after_request(response):
     # In certain error cases the before_request was not handled
     # completely so that we do not have an audit_object
     if "audit_object" in g:
+        add_sql_stats_to_audit(g.audit_object)
         g.audit_object.finalize_log()
 
     # No caching!
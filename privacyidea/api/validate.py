@@ -79,6 +79,8 @@ from privacyidea.api.auth import jwtauth
 from privacyidea.api.register import register_blueprint
 from privacyidea.api.recover import recover_blueprint
 from privacyidea.lib.utils import get_client_ip
+from privacyidea.lib.sqlstats import add_to_audit as add_sql_stats_to_audit
+from privacyidea.lib.metrics import start_request, finish_request
 from privacyidea.lib.event import event
 
 
@@ -94,6 +96,7 @@ def before_request():
     """
     This is executed before the request
     """
+    start_request()
     request.all_data = get_all_params(request.values, request.data)
     privacyidea_server = current_app.config.get("PI_AUDIT_SERVERNAME") or \
                          request.host
@@ -129,10 +132,12 @@ def after_request(response):
     # In certain error cases the before_request was not handled
     # completely so that we do not have an audit_object
     if "audit_object" in g:
+        add_sql_stats_to_audit(g.audit_object)
         g.audit_object.finalize_log()
 
     # No caching!
     response.headers['Cache-Control'] = 'no-cache'
+    finish_request(response)
     return response
 
 
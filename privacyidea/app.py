@@ -25,6 +25,8 @@ import logging
 import logging.config
 import sys
 from flask import Flask
+from privacyidea.lib.sqlstats import init_app as init_sql_stats
+from privacyidea.lib.metrics import init_app as init_metrics
 import privacyidea.api.before_after
 from privacyidea.api.validate import validate_blueprint
 from privacyidea.api.token import token_blueprint
@@ -49,6 +51,7 @@ from privacyidea.api.radiusserver import radiusserver_blueprint
 from privacyidea.api.recover import recover_blueprint
 from privacyidea.api.event import eventhandling_blueprint
 from privacyidea.api.smsgateway import smsgateway_blueprint
+from privacyidea.api.metrics import metrics_blueprint
 from privacyidea.lib.log import DEFAULT_LOGGING_CONFIG
 from privacyidea.config import config
 from privacyidea.models import db
@@ -154,8 +157,14 @@ def create_app(config_name="development",
     app.register_blueprint(radiusserver_blueprint, url_prefix='/radiusserver')
     app.register_blueprint(eventhandling_blueprint, url_prefix='/event')
     app.register_blueprint(smsgateway_blueprint, url_prefix='/smsgateway')
+    app.register_blueprint(metrics_blueprint, url_prefix='/system')
     db.init_app(app)
     migrate = Migrate(app, db)
+    if app.config.get("PI_SQL_STATS"):
+        # count the SQL queries of each request
+        init_sql_stats(app)
+    if app.config.get("PI_METRICS"):
+        init_metrics(app)
 
     try:
         # Try to read logging config from file
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 #
 #  privacyIDEA
+#  2016-10-19 Pass already loaded token objects to the applications
 #  Jul 18, 2014 Cornelius Kölbel
 #  License:  AGPLv3
 #  contact:  http://www.privacyidea.org
@@ -92,13 +93,15 @@ class MachineApplication(object):
     def get_authentication_item(token_type,
                                 serial,
                                 challenge=None, options=None,
-                                filter_param=None):
+                                filter_param=None, token_obj=None):
         """
         returns a dictionary of authentication items
         like public keys, challenges, responses...
 
         :param filter_param: Additional URL request parameters
         :type filter_param: dict
+        :param token_obj: The token object of the serial, if the caller
+            already loaded it. Otherwise the token is read from the database.
         """
         return "nothing"
 
@@ -113,18 +116,29 @@ class MachineApplication(object):
 
 @log_with(log)
 def get_auth_item(application, token_type,serial,
-                  challenge=None, options=None, filter_param=None):
+                  challenge=None, options=None, filter_param=None,
+                  token_obj=None, class_dict=None):
+    """
+    Return the authentication item of the application for the token.
 
+    :param token_obj: The token object of the serial, if it is already loaded
+    :param class_dict: The dictionary of the application classes. Callers,
+        that fetch many authentication items, can pass the dictionary, so that
+        it is only built once.
+    """
     options = options or {}
     # application_module from application
-    class_dict = get_machine_application_class_dict()
+    class_dict = class_dict or get_machine_application_class_dict()
     # should be able to run as class or as object
     auth_class = class_dict.get(application)
+    kwds = {"challenge": challenge,
+            "options": options,
+            "filter_param": filter_param}
+    if token_obj is not None:
+        kwds["token_obj"] = token_obj
     auth_item = auth_class.get_authentication_item(token_type,
                                                    serial,
-                                                   challenge=challenge,
-                                                   options=options,
-                                                   filter_param=filter_param)
+                                                   **kwds)
     return auth_item
 
 
@@ -40,7 +40,7 @@ class MachineApplication(MachineApplicationBase):
     def get_authentication_item(token_type,
                                 serial,
                                 challenge=None, options=None,
-                                filter_param=None):
+                                filter_param=None, token_obj=None):
         """
         :param token_type: the type of the token. At the moment
                            we only support yubikeys, tokentype "TOTP".
@@ -69,7 +69,10 @@ class MachineApplication(MachineApplicationBase):
                 # create the response. We need to get
                 # the HMAC key and calculate a HMAC response for
                 # the challenge
-                toks = get_tokens(serial=serial, active=True)
+                if token_obj is not None:
+                    toks = [token_obj] if token_obj.is_active() else []
+                else:
+                    toks = get_tokens(serial=serial, active=True)
                 if len(toks) == 1:
                     # tokenclass is a TimeHmacTokenClass
                     (_r, _p, otp, _c) = toks[0].get_otp(challenge=challenge_hex,
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Cache the issued OTP hashes and reuse the worker processes
+#  2016-10-19 Calculate the OTP hashes in worker processes
 #  2015-04-08 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #             Add options ROUNDS to avoid timeouts during OTP hash calculation
 #  2015-04-03 Cornelius Kölbel <cornelius.koelbel@netknights.it>
@@ -24,11 +26,121 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from privacyidea.lib.applications import MachineApplicationBase
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 import passlib.hash
+from flask import current_app
 from privacyidea.lib.token import get_tokens
+from privacyidea.lib.workerpool import get_pool
 log = logging.getLogger(__name__)
 ROUNDS = 6549
+POOL_NAME = "offline"
+
+# The hashes of the issued OTP values. The counter of the token is set to
+# the end of the first issued range, so all following calls issue the same
+# OTP values again, until the token is used online.
+_hash_cache = OrderedDict()
+_hash_cache_lock = threading.Lock()
+# Number of issued ranges, that are kept in the cache of the process
+HASH_CACHE_SIZE = 100
+
+
+def _hash_otp(args):
+    """
+    Return the salted PBKDF2 hash of OTP PIN and OTP value.
+    This is called in the worker processes, so it needs to be a module
+    level function.
+
+    :param args: tuple of the counter, the password (OTP PIN + OTP value)
+        and the number of rounds
+    :return: tuple of the counter and the hash
+    """
+    key, password, rounds = args
+    return key, passlib.hash.pbkdf2_sha512.encrypt(password,
+                                                   rounds=rounds,
+                                                   salt_size=10)
+
+
+def _get_cache_key(serial, counter, otps, otppin, rounds):
+    """
+    Return the key of the cached hashes. The OTP PIN and the OTP values are
+    only part of the key as a fingerprint, so that a new PIN or a new token
+    key do not return the old hashes.
+    """
+    if serial is None or not otps:
+        return None
+    fingerprint = hashlib.sha256(otppin.encode("utf-8"))
+    for index in sorted(otps):
+        fingerprint.update(u"{0!s}:{1!s}".format(
+            index, otps[index]).encode("utf-8"))
+    return serial, counter, len(otps), rounds, fingerprint.hexdigest()
+
+
+def _get_cached_hashes(key):
+    if key is None:
+        return None
+    with _hash_cache_lock:
+        hashes = _hash_cache.pop(key, None)
+        if hashes is None:
+            return None
+        # mark this entry as recently used
+        _hash_cache[key] = hashes
+        return dict(hashes)
+
+
+def _set_cached_hashes(key, hashes):
+    if key is None:
+        return
+    with _hash_cache_lock:
+        _hash_cache.pop(key, None)
+        _hash_cache[key] = dict(hashes)
+        while len(_hash_cache) > HASH_CACHE_SIZE:
+            # remove the least recently used entry
+            _hash_cache.popitem(last=False)
+
+
+def hash_otp_values(otps, otppin="", rounds=ROUNDS, workers=None,
+                    serial=None, counter=None):
+    """
+    Calculate the hashes of OTP PIN and OTP values.
+
+    PBKDF2 is expensive by design. If PI_OFFLINE_WORKERS in pi.cfg is
+    greater than 1, the hashes are calculated in the pool of worker
+    processes, that is shared by all requests of the process.
+
+    If the serial number is given, the hashes are cached. A following call
+    for the same token, start counter, OTP values, OTP PIN and rounds
+    returns the cached hashes.
+
+    :param otps: dict of the index and the OTP value
+    :param otppin: The OTP PIN, that is prepended to the OTP values
+    :param rounds: The number of PBKDF2 rounds
+    :param workers: The number of worker processes. Defaults to
+        PI_OFFLINE_WORKERS (0: calculate the hashes in the current process)
+    :param serial: The serial number of the token
+    :param counter: The counter of the first OTP value
+    :return: dict of the index and the hash
+    """
+    cache_key = _get_cache_key(serial, counter, otps, otppin, rounds)
+    hashes = _get_cached_hashes(cache_key)
+    if hashes is not None:
+        log.debug("Using the cached OTP hashes of token {0!s}".format(serial))
+        return hashes
+
+    if workers is None:
+        workers = current_app.config.get("PI_OFFLINE_WORKERS", 0)
+    workers = int(workers)
+    jobs = [(key, otppin + value, rounds) for key, value in otps.items()]
+    if min(workers, len(jobs)) < 2:
+        hashes = dict(map(_hash_otp, jobs))
+    else:
+        pool = get_pool(POOL_NAME, workers)
+        hashes = dict(pool.map(_hash_otp, jobs,
+                               chunksize=max(len(jobs) // (workers * 4), 1)))
+    _set_cached_hashes(cache_key, hashes)
+    return hashes
 
 
 class MachineApplication(MachineApplicationBase):
@@ -54,7 +166,7 @@ class MachineApplication(MachineApplicationBase):
     def get_authentication_item(token_type,
                                 serial,
                                 challenge=None, options=None,
-                                filter_param=None):
+                                filter_param=None, token_obj=None):
         """
         :param token_type: the type of the token. At the moment
                            we only support "HOTP" token. Supporting time
@@ -76,19 +188,20 @@ class MachineApplication(MachineApplicationBase):
             count = int(options.get("count", 100))
             rounds = int(options.get("rounds", ROUNDS))
             # get the token
-            toks = get_tokens(serial=serial)
+            if token_obj is not None:
+                toks = [token_obj]
+            else:
+                toks = get_tokens(serial=serial)
             if len(toks) == 1:
                 token_obj = toks[0]
                 if password:
                     _r, otppin, _otpval = token_obj.split_pin_pass(password)
                 (res, err, otp_dict) = token_obj.get_multi_otp(count=count)
-                otps = otp_dict.get("otp")
-                for key in otps.keys():
-                    # Return the hash of OTP PIN and OTP values
-                    otps[key] = passlib.hash.\
-                        pbkdf2_sha512.encrypt(otppin + otps.get(key),
-                                                rounds=rounds,
-                                                salt_size=10)
+                # Return the hash of OTP PIN and OTP values
+                otps = hash_otp_values(otp_dict.get("otp"), otppin=otppin,
+                                       rounds=rounds,
+                                       serial=token_obj.get_serial(),
+                                       counter=token_obj.token.count)
                 # We do not disable the token, so if all offline OTP values
                 # are used, the token can be used the authenticate online again.
                 # token_obj.enable(False)
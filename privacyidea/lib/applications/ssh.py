@@ -48,7 +48,7 @@ class MachineApplication(MachineApplicationBase):
     def get_authentication_item(token_type,
                                 serial,
                                 challenge=None, options=None,
-                                filter_param=None):
+                                filter_param=None, token_obj=None):
         """
         :param token_type: the type of the token. At the moment
                            we support the tokenype "sshkey"
@@ -60,7 +60,10 @@ class MachineApplication(MachineApplicationBase):
         filter_param = filter_param or {}
         user_filter = filter_param.get("user")
         if token_type.lower() == "sshkey":
-            toks = get_tokens(serial=serial, active=True)
+            if token_obj is not None:
+                toks = [token_obj] if token_obj.is_active() else []
+            else:
+                toks = get_tokens(serial=serial, active=True)
             if len(toks) == 1:
                 # We return this entry, either if no user_filter is requested
                 #  or if the user_filter matches the user
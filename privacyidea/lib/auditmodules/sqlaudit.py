@@ -46,19 +46,10 @@ from sqlalchemy.orm import mapper
 import datetime
 import traceback
 from sqlalchemy.exc import OperationalError
+from privacyidea.lib.sqlstats import set_engine_name
+from privacyidea.lib.metrics import timed
 
 log = logging.getLogger(__name__)
-try:
-    import matplotlib
-    MATPLOT_READY = True
-    matplotlib.use('Agg')
-    # We need to set the matplotlib backend before importing pandas with pyplot
-    from pandas import DataFrame
-    PANDAS_READY = True
-    # matplotlib is needed to plot
-except Exception as exx:
-    log.warning(exx)
-    PANDAS_READY = False
 
 metadata = MetaData()
 
@@ -155,6 +146,7 @@ class Audit(AuditBase):
             # SQLite does not support pool_size
             self.engine = create_engine(connect_string)
             log.debug("Using no SQL pool_size.")
+        set_engine_name(self.engine, "audit")
 
         # create a configured "Session" class
         Session = sessionmaker(bind=self.engine)
@@ -232,6 +224,7 @@ class Audit(AuditBase):
         for k, v in param.items():
             self.audit_data[k] += v
 
+    @timed("audit")
     def finalize_log(self):
         """
         This method is used to log the data.
@@ -485,7 +478,16 @@ class Audit(AuditBase):
         :return: Audit data
         :rtype: dataframe
         """
-        if not PANDAS_READY:
+        # pandas and matplotlib take long to import and use a lot of memory,
+        # so they are only imported, when statistics are requested.
+        try:
+            import matplotlib
+            # We need to set the matplotlib backend before importing pandas
+            # with pyplot
+            matplotlib.use('Agg')
+            from pandas import DataFrame
+        except Exception as exx:
+            log.warning(exx)
             log.warning("If you want to use statistics, you need to install "
                         "python-pandas.")
             return None
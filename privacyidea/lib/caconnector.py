@@ -30,7 +30,7 @@ The code is tested in tests/test_lib_caconnector.py.
 import logging
 from log import log_with
 from config import (get_caconnector_types,
-                    get_caconnector_class_dict)
+                    caconnector_registry)
 from ..models import (CAConnector,
                       CAConnectorConfig)
 from ..api.lib.utils import required
@@ -225,16 +225,7 @@ def get_caconnector_class(connector_type):
     :type connector_type: basestring
     :return: CA Connector Class
     """
-    ret = None
-    
-    (connector_classes, connector_types) = get_caconnector_class_dict()
-
-    if connector_type in connector_types.values():
-        for k, v in connector_types.items():
-            if v == connector_type:
-                ret = connector_classes.get(k)
-                break
-    return ret
+    return caconnector_registry.get_class(connector_type)
 
 
 #@cache.memoize(10)
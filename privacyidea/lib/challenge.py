@@ -57,6 +57,24 @@ def get_challenges(serial=None, transaction_id=None):
     return challenges
 
 
+@log_with(log)
+def get_valid_challenge_serials(transaction_id):
+    """
+    This returns the serial numbers of all tokens, that have a challenge
+    with the given transaction id, which is not expired, yet.
+
+    The serials are fetched in one single query, so that the caller does not
+    need to check the challenges of each token separately.
+
+    :param transaction_id: challenges with this very transaction id
+    :return: set of serial numbers
+    """
+    sql_query = Challenge.query.with_entities(Challenge.serial).filter(
+        Challenge.transaction_id == transaction_id,
+        Challenge.expiration > datetime.now())
+    return set([serial for (serial,) in sql_query.all()])
+
+
 @log_with(log)
 def get_challenges_paginate(serial=None, transaction_id=None,
                             sortby=Challenge.timestamp,
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Look up the token, resolver, machine resolver and CA
+#             connector classes only once per process
 #  2016-04-08 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #             Avoid consecutive if-statements
 #  2015-12-12 Cornelius Kölbel <cornelius.koelbel@netknights.it>
@@ -35,6 +37,7 @@ The code is tested in tests/test_lib_config
 
 import logging
 import inspect
+import threading
 from flask import current_app
 
 from .log import log_with
@@ -53,6 +56,110 @@ log = logging.getLogger(__name__)
 ENCODING = 'utf-8'
 
 
+class ClassRegistry(object):
+    """
+    The registry of the classes of one kind of plugin like the token types
+    or the resolver types.
+
+    The modules are imported and searched for the classes only once per
+    process, when a class is needed for the first time. Afterwards a class is
+    found by its type with a simple dictionary lookup.
+    Additional modules like custom token types can be added with
+    register_module.
+    """
+
+    def __init__(self, get_modules, is_plugin_class, get_class_type):
+        """
+        :param get_modules: function, that returns the list of the modules
+        :param is_plugin_class: function, that checks, if a class of a module
+            is a plugin class. It is called with the module and the class.
+        :param get_class_type: function, that returns the type of a plugin
+            class or None. It is called with the class name and the class.
+        """
+        self._get_modules = get_modules
+        self._is_plugin_class = is_plugin_class
+        self._get_class_type = get_class_type
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._registered_modules = []
+        self.class_dict = {}
+        self.type_dict = {}
+        self._classes_by_type = {}
+        self._classes_by_lower_type = {}
+
+    def _add_module(self, module):
+        for name in dir(module):
+            obj = getattr(module, name)
+            if inspect.isclass(obj) and self._is_plugin_class(module, obj):
+                try:
+                    class_name = "{0!s}.{1!s}".format(module.__name__,
+                                                      obj.__name__)
+                    self.class_dict[class_name] = obj
+                    class_type = self._get_class_type(class_name, obj)
+                    if class_type is not None:
+                        self.type_dict[class_name] = class_type
+                        self._classes_by_type.setdefault(class_type, obj)
+                        self._classes_by_lower_type.setdefault(
+                            class_type.lower(), obj)
+                except Exception as e:  # pragma: no cover
+                    log.error("error adding the classes of module {0!s}: "
+                              "{1!r}".format(module.__name__, e))
+
+    def _load(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    for module in self._get_modules():
+                        self._add_module(module)
+                    for module in self._registered_modules:
+                        self._add_module(module)
+                    self._loaded = True
+
+    def register_module(self, module_name):
+        """
+        Add the classes of an additional module like a custom token module.
+
+        :param module_name: The name of the module like "mypackage.mytoken"
+        :type module_name: basestring
+        """
+        module = importlib.import_module(module_name)
+        with self._lock:
+            if module in self._registered_modules:
+                return
+            self._registered_modules.append(module)
+            if self._loaded:
+                self._add_module(module)
+
+    def reset(self):
+        """
+        Forget all classes. They are looked up again, when they are needed.
+        The registered modules are kept.
+        """
+        with self._lock:
+            self._loaded = False
+            self.class_dict = {}
+            self.type_dict = {}
+            self._classes_by_type = {}
+            self._classes_by_lower_type = {}
+
+    def get_class_dicts(self):
+        """
+        :return: tuple of the dict of the classes and the dict of the types,
+            both with the class names as keys
+        """
+        self._load()
+        return dict(self.class_dict), dict(self.type_dict)
+
+    def get_class(self, class_type, ignore_case=False):
+        """
+        Return the class of the given type or None
+        """
+        self._load()
+        if ignore_case:
+            return self._classes_by_lower_type.get(class_type.lower())
+        return self._classes_by_type.get(class_type)
+
+
 class SYSCONF(object):
     __doc__ = """This is a list of system config attributes"""
     OVERRIDECLIENT = "OverrideAuthorizationClient"
@@ -193,26 +300,7 @@ def get_token_class_dict():
 
     :return: tuple of two dicts
     """
-    from .tokenclass import TokenClass
-
-    tokenclass_dict = {}
-    tokentype_dict = {}
-    modules = get_token_module_list()
-    for module in modules:
-        for name in dir(module):
-            obj = getattr(module, name)
-            # We must not process imported classes!
-            if (inspect.isclass(obj) and issubclass(obj, TokenClass) and
-                        obj.__module__ == module.__name__):
-                try:
-                    class_name = "{0!s}.{1!s}".format(module.__name__, obj.__name__)
-                    tokenclass_dict[class_name] = obj
-                    if hasattr(obj, 'get_class_type'):
-                        tokentype_dict[class_name] = obj.get_class_type()
-                except Exception as e:  # pragma: no cover
-                    log.error("error constructing token_class_dict: {0!r}".format(e))
-
-    return tokenclass_dict, tokentype_dict
+    return token_registry.get_class_dicts()
 
 
 #@cache.memoize(1)
@@ -225,17 +313,24 @@ def get_token_class(tokentype):
     """
     if tokentype.lower() == "hmac":
         tokentype = "hotp"
-    class_dict, type_dict = get_token_class_dict()
-    tokenmodule = ""
-    tokenclass = None
-    for module, ttype in type_dict.items():
-        if ttype.lower() == tokentype.lower():
-            tokenmodule = module
-            break
-    if tokenmodule:
-        tokenclass = class_dict.get(tokenmodule)
+    return token_registry.get_class(tokentype, ignore_case=True)
+
 
-    return tokenclass
+def register_token_module(module_name):
+    """
+    Add the token classes of a custom token module to the known token types.
+    This should be called during the start of the application.
+
+    :param module_name: The name of the module like "mypackage.mytoken"
+    :type module_name: basestring
+    """
+    token_registry.register_module(module_name)
+    try:
+        current_app.config.pop("pi_token_types", None)
+        current_app.config.pop("pi_token_classes", None)
+    except RuntimeError:
+        # We are running outside of an application context
+        pass
 
 
 #@cache.memoize(1)
@@ -312,27 +407,7 @@ def get_machine_resolver_class_dict():
 
     :return: tuple of two dicts
     """
-    resolverclass_dict = {}
-    resolvertype_dict = {}
-
-    modules = get_machine_resolver_module_list()
-    for module in modules:
-        log.debug("module: {0!s}".format(module))
-        for name in dir(module):
-            obj = getattr(module, name)
-            if inspect.isclass(obj) and \
-                    (issubclass(obj, BaseMachineResolver)) and \
-                    (obj != BaseMachineResolver):
-                try:
-                    class_name = "{0!s}.{1!s}".format(module.__name__, obj.__name__)
-                    resolverclass_dict[class_name] = obj
-                    resolvertype_dict[class_name] = obj.type
-
-                except Exception as e:  # pragma: no cover
-                    log.error("error constructing machine resolver "
-                              "class_list: %r" % e)
-
-    return resolverclass_dict, resolvertype_dict
+    return machine_resolver_registry.get_class_dicts()
 
 
 def get_caconnector_class_dict():
@@ -347,27 +422,7 @@ def get_caconnector_class_dict():
 
     :return: tuple of two dicts
     """
-    class_dict = {}
-    type_dict = {}
-
-    modules = get_caconnector_module_list()
-    for module in modules:
-        log.debug("module: {0!s}".format(module))
-        for name in dir(module):
-            obj = getattr(module, name)
-            if inspect.isclass(obj) and \
-                    (issubclass(obj, BaseCAConnector)) and \
-                    (obj != BaseCAConnector):
-                try:
-                    class_name = "{0!s}.{1!s}".format(module.__name__, obj.__name__)
-                    class_dict[class_name] = obj
-                    type_dict[class_name] = obj.connector_type
-
-                except Exception as e:  # pragma: no cover
-                    log.error("error constructing CA connector "
-                              "class_list: %r" % e)
-
-    return class_dict, type_dict
+    return caconnector_registry.get_class_dicts()
 
 
 #@cache.memoize(1)
@@ -388,35 +443,7 @@ def get_resolver_class_dict():
 
     :return: tuple of two dicts.
     """
-    resolverclass_dict = {}
-    resolverprefix_dict = {}
-
-    modules = get_resolver_module_list()
-    base_class_repr = "privacyidea.lib.resolvers.UserIdResolver.UserIdResolver"
-    for module in modules:
-        log.debug("module: {0!s}".format(module))
-        for name in dir(module):
-            obj = getattr(module, name)
-            # There are other classes like HMAC in the lib.tokens module,
-            # which we do not want to load.
-            if inspect.isclass(obj) and (issubclass(obj, UserIdResolver) or
-                                             obj == UserIdResolver):
-                # We must not process imported classes!
-                # if obj.__module__ == module.__name__:
-                try:
-                    class_name = "{0!s}.{1!s}".format(module.__name__, obj.__name__)
-                    resolverclass_dict[class_name] = obj
-
-                    prefix = class_name.split('.')[1]
-                    if hasattr(obj, 'getResolverClassType'):
-                        prefix = obj.getResolverClassType()
-
-                    resolverprefix_dict[class_name] = prefix
-
-                except Exception as e:  # pragma: no cover
-                    log.error("error constructing resolverclass_list: {0!r}".format(e))
-
-    return resolverclass_dict, resolverprefix_dict
+    return resolver_registry.get_class_dicts()
 
 
 @log_with(log)
@@ -650,6 +677,48 @@ def get_machine_resolver_module_list():
     return modules
 
 
+def _is_token_class(module, obj):
+    from .tokenclass import TokenClass
+    # We must not process imported classes!
+    return issubclass(obj, TokenClass) and obj.__module__ == module.__name__
+
+
+def _get_token_type(class_name, obj):
+    if hasattr(obj, 'get_class_type'):
+        return obj.get_class_type()
+
+
+def _is_resolver_class(module, obj):
+    # There are other classes like HMAC in the lib.tokens module,
+    # which we do not want to load.
+    return issubclass(obj, UserIdResolver) or obj == UserIdResolver
+
+
+def _get_resolver_type(class_name, obj):
+    prefix = class_name.split('.')[1]
+    if hasattr(obj, 'getResolverClassType'):
+        prefix = obj.getResolverClassType()
+    return prefix
+
+
+# The registries of the classes. The modules are searched only once, when a
+# class is needed for the first time.
+token_registry = ClassRegistry(
+    get_token_module_list, _is_token_class, _get_token_type)
+resolver_registry = ClassRegistry(
+    get_resolver_module_list, _is_resolver_class, _get_resolver_type)
+machine_resolver_registry = ClassRegistry(
+    get_machine_resolver_module_list,
+    lambda module, obj: (issubclass(obj, BaseMachineResolver) and
+                         obj != BaseMachineResolver),
+    lambda class_name, obj: obj.type)
+caconnector_registry = ClassRegistry(
+    get_caconnector_module_list,
+    lambda module, obj: (issubclass(obj, BaseCAConnector) and
+                         obj != BaseCAConnector),
+    lambda class_name, obj: obj.connector_type)
+
+
 def set_privacyidea_config(key, value, typ="", desc=""):
     """
     Set a config value and writes it to the Config database table.
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Add aes_encrypt for the PSKC export
 #  2016-04-08 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Avoid consecutive if statements
 #
@@ -40,6 +41,7 @@ import random
 import string
 from .log import log_with
 from .error import HSMException
+from .metrics import timed
 import binascii
 import ctypes
 from flask import current_app
@@ -330,6 +332,7 @@ def _get_hsm():
 
 
 @log_with(log, log_entry=False)
+@timed("hsm")
 def encryptPassword(password):
     from privacyidea.lib.utils import to_utf8
     hsm = _get_hsm()
@@ -342,6 +345,7 @@ def encryptPassword(password):
 
 
 @log_with(log, log_entry=False)
+@timed("hsm")
 def encryptPin(cryptPin):
     hsm = _get_hsm()
     ret = hsm.encrypt_pin(cryptPin)
@@ -349,6 +353,7 @@ def encryptPin(cryptPin):
 
 
 @log_with(log, log_exit=False)
+@timed("hsm")
 def decryptPassword(cryptPass):
     hsm = _get_hsm()
     try:
@@ -360,6 +365,7 @@ def decryptPassword(cryptPass):
 
 
 @log_with(log, log_exit=False)
+@timed("hsm")
 def decryptPin(cryptPin):
     hsm = _get_hsm()
     ret = hsm.decrypt_pin(cryptPin)
@@ -367,6 +373,7 @@ def decryptPin(cryptPin):
 
 
 @log_with(log, log_entry=False)
+@timed("hsm")
 def encrypt(data, iv, id=0):
     '''
     encrypt a variable from the given input with an initialiation vector
@@ -387,6 +394,7 @@ def encrypt(data, iv, id=0):
 
 
 @log_with(log, log_exit=False)
+@timed("hsm")
 def decrypt(input, iv, id=0):
     '''
     decrypt a variable from the given input with an initialiation vector
@@ -426,6 +434,25 @@ def aes_decrypt(key, iv, cipherdata, mode=AES.MODE_CBC):
     return output
 
 
+def aes_encrypt(key, iv, data, mode=AES.MODE_CBC):
+    """
+    Encrypts the given data with the key/iv. The data is padded according
+    to PKCS#7, so that it can be decrypted with aes_decrypt.
+
+    :param key: The encryption key
+    :type key: binary string
+    :param iv: The initialization vector
+    :type iv: binary string
+    :param data: The plain text
+    :type data: binary string
+    :param mode: The AES MODE
+    :return: cipher text in binary data
+    """
+    padding = AES.block_size - len(data) % AES.block_size
+    aes = AES.new(key, mode, iv)
+    return aes.encrypt(data + chr(padding) * padding)
+
+
 # @log_with(log)
 def geturandom(length=20, hex=False):
     '''
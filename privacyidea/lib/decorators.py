@@ -22,6 +22,7 @@ import logging
 import functools
 from privacyidea.lib.error import TokenAdminError
 from privacyidea.lib.error import ParameterError
+from privacyidea.models import unit_of_work
 from flask import request
 from gettext import gettext as _
 log = logging.getLogger(__name__)
@@ -116,3 +117,18 @@ def check_copy_serials(func):
 
     return check_serial_wrapper
 
+
+
+def single_commit(func):
+    """
+    Decorator to run the function in a unit of work. The changes of tokens,
+    tokeninfos and challenges are not committed one by one, but in one
+    transaction, when the function returns or raises an exception.
+    """
+    @functools.wraps(func)
+    def single_commit_wrapper(*args, **kwds):
+        with unit_of_work():
+            f_result = func(*args, **kwds)
+        return f_result
+
+    return single_commit_wrapper
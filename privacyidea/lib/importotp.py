@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Export and import the hashlib of HOTP and TOTP tokens
+#  2016-10-19 Add PSKC and OATH CSV export of generated tokens
+#  2016-10-19 Import BeautifulSoup, gnupg and pbkdf2 only when they are used
 #  2016-07-17 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #             Add GPG encrpyted import
 #  2016-01-16 Cornelius Kölbel <cornelius.koelbel@netknights.it>
@@ -45,13 +48,14 @@ import base64
 from privacyidea.lib.utils import modhex_decode
 from privacyidea.lib.utils import modhex_encode
 from privacyidea.lib.log import log_with
-from privacyidea.lib.crypto import aes_decrypt
+from privacyidea.lib.crypto import aes_decrypt, aes_encrypt, geturandom
+from privacyidea.lib.error import ParameterError
+from xml.sax.saxutils import escape, quoteattr
+import hmac
+from hashlib import sha1
 from Crypto.Cipher import AES
-from bs4 import BeautifulSoup
 import traceback
-from passlib.utils.pbkdf2 import pbkdf2
 from privacyidea.lib.utils import to_utf8
-import gnupg
 
 import logging
 log = logging.getLogger(__name__)
@@ -96,10 +100,11 @@ def parseOATHcsv(csv):
     This function parses CSV data for oath token.
     The file format is
 
-        serial, key, [hotp,totp], [6,8], [30|60],
+        serial, key, [hotp,totp], [6,8], [30|60], [sha1|sha256|sha512]
         serial, key, ocra, [ocra-suite]
 
-    It imports sha1 hotp or totp token.
+    It imports hotp or totp token. If the hashlib is not given, a key of 32
+    hex characters is imported as sha256 and all other keys as sha1.
     I can also import ocra token.
     The default is hotp
     if totp is set, the default seconds are 30
@@ -157,6 +162,10 @@ def parseOATHcsv(csv):
             if len(l) >= 5:
                 seconds = int(l[4].strip())
 
+            # hashlib
+            if len(l) >= 6 and l[5].strip():
+                hashlib = l[5].strip().lower()
+
             log.debug("read the line |{0!s}|{1!s}|{2!s}|{3:d} {4!s}|{5:d}|".format(serial, key, ttype, otplen, ocrasuite, seconds))
 
             TOKENS[serial] = {'type': ttype,
@@ -414,6 +423,7 @@ def derive_key(xml, password):
     if derivation_algo.lower() != "pbkdf2":
         raise ImportException("We only support PBKDF2 as Key derivation "
                               "function!")
+    from passlib.utils.pbkdf2 import pbkdf2
     salt = keymeth.find("salt").text.strip()
     keylength = keymeth.find("keylength").text.strip()
     rounds = keymeth.find("iterationcount").text.strip()
@@ -445,6 +455,8 @@ def parsePSKCdata(xml_data,
         { serial : { otpkey , counter, .... }}
     """
 
+    # BeautifulSoup and lxml take long to import and are only needed here
+    from bs4 import BeautifulSoup
     tokens = {}
     #xml = BeautifulSoup(xml_data, "lxml")
     xml = strip_prefix_from_soup(BeautifulSoup(xml_data, "lxml"))
@@ -472,6 +484,10 @@ def parsePSKCdata(xml_data,
         token["type"] = algo[-4:].lower()
         parameters = key.algorithmparameters
         token["otplen"] = parameters.responseformat["length"] or 6
+        if parameters.suite and parameters.suite.string:
+            # e.g. HMAC-SHA256
+            suite = parameters.suite.string.strip().lower()
+            token["hashlib"] = suite.split("-")[-1]
         try:
             if key.data.secret.plainvalue:
                 secret = key.data.secret.plainvalue.string
@@ -503,6 +519,135 @@ def parsePSKCdata(xml_data,
     return tokens
 
 
+PSKC_ALGORITHMS = {"hotp": "urn:ietf:params:xml:ns:keyprov:pskc:hotp",
+                   "totp": "urn:ietf:params:xml:ns:keyprov:pskc:totp"}
+PSKC_AES128_CBC = "http://www.w3.org/2001/04/xmlenc#aes128-cbc"
+PSKC_HMAC_SHA1 = "http://www.w3.org/2000/09/xmldsig#hmac-sha1"
+PSKC_SUITES = {"sha1": "HMAC-SHA1",
+               "sha256": "HMAC-SHA256",
+               "sha512": "HMAC-SHA512"}
+
+
+def _pskc_encrypted_value(tag, key, data):
+    """
+    Return the XML element with the AES-128-CBC encrypted data. As in
+    RFC6030 the cipher value contains the IV followed by the cipher text.
+    """
+    iv = geturandom(16)
+    cipher = iv + aes_encrypt(key, iv, data)
+    return cipher, (u'<{0!s}><xenc:EncryptionMethod Algorithm="{1!s}"/>'
+                    u'<xenc:CipherData><xenc:CipherValue>{2!s}'
+                    u'</xenc:CipherValue></xenc:CipherData></{0!s}>'.format(
+                        tag, PSKC_AES128_CBC, base64.b64encode(cipher)))
+
+
+def export_pskc(tokens, preshared_key_hex, manufacturer=u"privacyIDEA"):
+    """
+    This function creates a PSKC document (RFC6030) of HOTP and TOTP tokens.
+    It is the counterpart of parsePSKCdata.
+
+    The secrets are encrypted with AES-128-CBC and the pre shared key. The
+    integrity of the encrypted secrets is protected by HMAC-SHA1 with a
+    random MAC key, which is also encrypted with the pre shared key.
+
+    The document is returned in parts, so that it can be streamed.
+
+    :param tokens: list or generator of token dictionaries with the keys
+        serial, type, otpkey (hexlified), otplen, hashlib and counter or
+        timeStep
+    :param preshared_key_hex: The AES-128 key, hexlified
+    :param manufacturer: The manufacturer in the DeviceInfo
+    :return: generator of the parts of the XML document
+    """
+    try:
+        psk = binascii.unhexlify(preshared_key_hex)
+    except (TypeError, ValueError):
+        psk = None
+    if not psk or len(psk) != 16:
+        raise ParameterError("The pre shared key needs to be 32 hex "
+                             "characters long.")
+    mac_key = geturandom(20)
+    _mac_cipher, mac_key_element = _pskc_encrypted_value("MACKey", psk,
+                                                         mac_key)
+
+    def generate():
+        yield (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+               u'<KeyContainer Version="1.0" '
+               u'xmlns="urn:ietf:params:xml:ns:keyprov:pskc" '
+               u'xmlns:ds="http://www.w3.org/2000/09/xmldsig#" '
+               u'xmlns:xenc="http://www.w3.org/2001/04/xmlenc#">\n'
+               u'<EncryptionKey><ds:KeyName>Pre-shared-key</ds:KeyName>'
+               u'</EncryptionKey>\n'
+               u'<MACMethod Algorithm="{0!s}">{1!s}</MACMethod>\n'.format(
+                   PSKC_HMAC_SHA1, mac_key_element))
+        for token in tokens:
+            tokentype = token.get("type", "hotp").lower()
+            if tokentype not in PSKC_ALGORITHMS:
+                raise ParameterError("Only HOTP and TOTP tokens can be "
+                                     "exported as PSKC.")
+            hashlib = (token.get("hashlib") or "sha1").lower()
+            if hashlib not in PSKC_SUITES:
+                raise ParameterError("Unknown hashlib {0!s}".format(hashlib))
+            serial = u"{0!s}".format(token.get("serial"))
+            cipher, secret = _pskc_encrypted_value(
+                "EncryptedValue", psk, binascii.unhexlify(token.get("otpkey")))
+            value_mac = base64.b64encode(hmac.new(mac_key, cipher,
+                                                  sha1).digest())
+            if tokentype == "totp":
+                moving_factor = (u"<TimeInterval><PlainValue>{0!s}"
+                                 u"</PlainValue></TimeInterval>".format(
+                                     int(token.get("timeStep", 30))))
+            else:
+                moving_factor = (u"<Counter><PlainValue>{0!s}</PlainValue>"
+                                 u"</Counter>".format(
+                                     int(token.get("counter", 0))))
+            yield (u'<KeyPackage><DeviceInfo><Manufacturer>{0!s}'
+                   u'</Manufacturer><SerialNo>{1!s}</SerialNo></DeviceInfo>'
+                   u'<Key Id={2!s} Algorithm="{3!s}"><AlgorithmParameters>'
+                   u'<Suite>{4!s}</Suite>'
+                   u'<ResponseFormat Length="{5:d}" Encoding="DECIMAL"/>'
+                   u'</AlgorithmParameters><Data><Secret>{6!s}<ValueMAC>{7!s}'
+                   u'</ValueMAC></Secret>{8!s}</Data></Key></KeyPackage>'
+                   u'\n'.format(escape(manufacturer), escape(serial),
+                                quoteattr(serial),
+                                PSKC_ALGORITHMS.get(tokentype),
+                                PSKC_SUITES.get(hashlib),
+                                int(token.get("otplen", 6)), secret,
+                                value_mac, moving_factor))
+        yield u"</KeyContainer>\n"
+
+    return generate()
+
+
+def export_oath_csv(tokens):
+    """
+    This function creates a CSV file of HOTP and TOTP tokens in the format,
+    that is read by parseOATHcsv:
+
+        serial, key, [hotp,totp], [6,8], [30|60], [sha1|sha256|sha512]
+
+    The time step is only written for TOTP tokens and the hashlib is only
+    written, if it is not sha1. In this case the time step of HOTP tokens
+    is written as 30, since the columns are read by their position.
+    Note, that the secrets are not encrypted.
+
+    :param tokens: list or generator of token dictionaries with the keys
+        serial, type, otpkey (hexlified), otplen, timeStep and hashlib
+    :return: generator of the lines of the CSV file
+    """
+    for token in tokens:
+        line = u"{0!s}, {1!s}, {2!s}, {3!s}".format(token.get("serial"),
+                                                   token.get("otpkey"),
+                                                   token.get("type"),
+                                                   token.get("otplen"))
+        hashlib = (token.get("hashlib") or "sha1").lower()
+        if token.get("type") == "totp" or hashlib != "sha1":
+            line += u", {0!s}".format(token.get("timeStep") or 30)
+        if hashlib != "sha1":
+            line += u", {0!s}".format(hashlib)
+        yield line + u"\n"
+
+
 class GPGImport(object):
     """
     This class is used to decrypt GPG encrypted import files.
@@ -517,6 +662,7 @@ class GPGImport(object):
         self.config = config or {}
         self.gnupg_home = self.config.get("PI_GNUPG_HOME",
                                           "/etc/privacyidea/gpg")
+        import gnupg
         self.gpg = gnupg.GPG(gnupghome=self.gnupg_home)
         self.private_keys = self.gpg.list_keys(True)
 
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Return the auth items of unknown hosts and aliases in bulk
+#  2016-10-19 Load the machine tokens of many hosts at once
 #  2015-02-27 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Initial writup
 #
@@ -29,17 +31,19 @@ lib/machineresolver.py, so this can be tested standalone without realms,
 tokens and webservice!
 """
 from .machineresolver import get_resolver_list, get_resolver_object
-from privacyidea.models import Token
 from privacyidea.models import (MachineToken, db, MachineTokenOptions,
                                 MachineResolver, get_token_id,
                                 get_machineresolver_id,
                                 get_machinetoken_id)
 from netaddr import IPAddress
-from sqlalchemy import and_
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 import logging
 log = logging.getLogger(__name__)
 from privacyidea.lib.log import log_with
-from privacyidea.lib.applications.base import get_auth_item
+from privacyidea.lib.applications.base import (get_auth_item,
+                                               get_machine_application_class_dict)
+from privacyidea.lib.token import create_tokenclass_object
 
 
 
@@ -273,6 +277,59 @@ def delete_option(machinetoken_id=None, machine_id=None, resolver_name=None,
     return r
 
 
+def _get_machinetoken_rows(machines, serial=None, application=None):
+    """
+    Read the machine tokens of the given machines from the database. The
+    tokens and the options of the machine tokens are loaded in the same
+    query.
+
+    :param machines: list of tuples (machine_id, resolver_name)
+    :param serial: Only return the machine tokens of this token
+    :param application: Only return the machine tokens of this application
+    :return: list of tuples of the MachineToken and the resolver name
+    """
+    resolver_names = set([resolver_name for _m, resolver_name in machines])
+    resolver_ids = dict([(r.name, r.id) for r in MachineResolver.query.filter(
+        MachineResolver.name.in_(resolver_names)).all()])
+    resolver_names = dict([(v, k) for k, v in resolver_ids.items()])
+    conditions = []
+    for machine_id, resolver_name in machines:
+        conditions.append(and_(
+            MachineToken.machine_id == machine_id,
+            MachineToken.machineresolver_id == resolver_ids.get(
+                resolver_name)))
+    if not conditions:
+        return []
+
+    sql_query = MachineToken.query.options(joinedload(
+        MachineToken.option_list)).filter(or_(*conditions))
+    if application:
+        sql_query = sql_query.filter(MachineToken.application == application)
+    if serial:
+        token_id = get_token_id(serial)
+        sql_query = sql_query.filter(MachineToken.token_id == token_id)
+
+    return [(row, resolver_names.get(row.machineresolver_id))
+            for row in sql_query.order_by(MachineToken.id).all()]
+
+
+def _machinetoken_dict(row, resolver_name):
+    """
+    :param row: The MachineToken database object
+    :param resolver_name: The name of the machine resolver
+    :return: dict of the machine token
+    """
+    options = {}
+    for option in row.option_list:
+        options[option.mt_key] = option.mt_value
+    return {"serial": row.token.serial,
+            "machine_id": row.machine_id,
+            "resolver": resolver_name,
+            "type": row.token.tokentype,
+            "application": row.application,
+            "options": options}
+
+
 @log_with(log)
 def list_machine_tokens(hostname=None,
                         machine_id=None,
@@ -286,35 +343,11 @@ def list_machine_tokens(hostname=None,
     :return: JSON of all tokens connected to machines with the corresponding
              application.
     """
-    res = []
     machine_id, resolver_name = _get_host_identifier(hostname, machine_id,
                                                      resolver_name)
-    machineresolver_id = get_machineresolver_id(resolver_name)
-
-
-    sql_query = MachineToken.query.filter(and_(MachineToken.machine_id ==
-                                          machine_id,
-                    MachineToken.machineresolver_id == machineresolver_id))
-    if application:
-        sql_query = sql_query.filter(MachineToken.application == application)
-    if serial:
-        token_id = get_token_id(serial)
-        sql_query = sql_query.filter(MachineToken.token_id == token_id)
-
-    for row in sql_query.all():
-        # row.token contains the database token
-        option_list = row.option_list
-        options = {}
-        for option in option_list:
-            options[option.mt_key] = option.mt_value
-        res.append({"serial": row.token.serial,
-                    "machine_id": machine_id,
-                    "resolver": resolver_name,
-                    "type": row.token.tokentype,
-                    "application": row.application,
-                    "options": options})
-
-    return res
+    rows = _get_machinetoken_rows([(machine_id, resolver_name)],
+                                  serial=serial, application=application)
+    return [_machinetoken_dict(row, r_name) for row, r_name in rows]
 
 
 @log_with(log)
@@ -325,20 +358,27 @@ def list_token_machines(serial):
     :return: returns a list of machines and apps
     """
     res = []
-    db_token = Token.query.filter(Token.serial == serial).first()
-
-    for machine in db_token.machine_list:
-        MR = MachineResolver.query.filter(MachineResolver.id ==
-                                          machine.machineresolver_id).first()
-        resolver_name = MR.name
-
-        option_list = machine.option_list
+    token_id = get_token_id(serial)
+    machines = MachineToken.query.options(joinedload(
+        MachineToken.option_list)).filter(
+        MachineToken.token_id == token_id).order_by(MachineToken.id).all()
+    # Read the names of all machine resolvers at once
+    resolver_ids = set([machine.machineresolver_id for machine in machines])
+    resolver_names = {}
+    if resolver_ids:
+        resolver_names = dict([(r.id, r.name) for r in
+                               MachineResolver.query.filter(
+                                   MachineResolver.id.in_(
+                                       resolver_ids)).all()])
+
+    for machine in machines:
         options = {}
-        for option in option_list:
+        for option in machine.option_list:
             options[option.mt_key] = option.mt_value
         res.append({"machine_id": machine.machine_id,
                     "application": machine.application,
-                    "resolver": resolver_name,
+                    "resolver": resolver_names.get(
+                        machine.machineresolver_id),
                     "options": options,
                     "serial": serial})
 
@@ -399,28 +439,95 @@ def get_auth_items(hostname, ip=None, application=None,
     #
     # TODO: We should check, if the IP Address matches the hostname
     #
-    auth_items = {}
-    machinetokens = list_machine_tokens(hostname=hostname,
-                                        serial=serial,
-                                        application=application)
+    machines = {_get_host_identifier(hostname, None, None): [hostname]}
+    return _get_machines_auth_items(machines, application=application,
+                                    serial=serial, challenge=challenge,
+                                    filter_param=filter_param).get(hostname)
+
+
+def get_hosts_auth_items(hostnames, application=None, serial=None,
+                         challenge=None, filter_param=None, bulk_call=False):
+    """
+    Return the authentication items for many hosts. The machine tokens of all
+    hosts are read from the database in one query and the loaded tokens are
+    passed to the applications.
+
+    :param hostnames: list of hostnames
+    :param application: Only return the items of this application
+    :param serial: Only return the items of this token
+    :param challenge: A challenge for the authitem
+    :type challenge: basestring
+    :param filter_param: Additional application specific parameter to filter
+        the return value
+    :type filter_param: dict
+    :param bulk_call: If True, only applications, that allow bulk calls,
+        return authentication items.
+    :return: dictionary with the hostnames as keys and the dictionaries of
+        lists of the application auth items as values. Unknown hosts get an
+        empty dictionary.
+    """
+    # Several hostnames can be aliases of the same machine
+    machines = {}
+    for hostname in hostnames:
+        try:
+            identifier = _get_host_identifier(hostname, None, None)
+        except Exception as exx:
+            log.warning("Can not identify the machine {0!r}: {1!s}".format(
+                hostname, exx))
+            continue
+        machines.setdefault(identifier, []).append(hostname)
+    host_items = _get_machines_auth_items(machines, application=application,
+                                          serial=serial, challenge=challenge,
+                                          filter_param=filter_param,
+                                          bulk_call=bulk_call)
+    for hostname in hostnames:
+        host_items.setdefault(hostname, {})
+    return host_items
+
+
+def _get_machines_auth_items(machines, application=None, serial=None,
+                             challenge=None, filter_param=None,
+                             bulk_call=False):
+    """
+    Return the authentication items of the machines.
 
-    for mtoken in machinetokens:
-        auth_item = get_auth_item(mtoken.get("application"),
+    :param machines: dictionary with the tuples (machine_id, resolver_name)
+        as keys and the lists of the hostnames of the machines as values
+    :return: dictionary with the hostnames as keys and the dictionaries of
+        lists of the application auth items as values.
+    """
+    rows = _get_machinetoken_rows(machines.keys(), serial=serial,
+                                  application=application)
+
+    class_dict = get_machine_application_class_dict()
+    host_items = dict([(hostname, {}) for hostnames in machines.values()
+                       for hostname in hostnames])
+    for row, resolver_name in rows:
+        mtoken = _machinetoken_dict(row, resolver_name)
+        app_name = mtoken.get("application")
+        app_class = class_dict.get(app_name)
+        if bulk_call and not (app_class and app_class.allow_bulk_call):
+            log.debug("The application {0!s} does not allow bulk "
+                      "calls.".format(app_name))
+            continue
+        auth_item = get_auth_item(app_name,
                                   mtoken.get("type"),
                                   mtoken.get("serial"),
                                   challenge,
                                   options=mtoken.get("options"),
-                                  filter_param=filter_param)
+                                  filter_param=filter_param,
+                                  token_obj=create_tokenclass_object(
+                                      row.token),
+                                  class_dict=class_dict)
         if auth_item:
-            if mtoken.get("application") not in auth_items:
-                # we create a new empty list for the new application type
-                auth_items[mtoken.get("application")] = []
-
             # Add the options the the auth_item
             for k, v in mtoken.get("options", {}).items():
                 auth_item[k] = v
 
-            # append the auth_item to the list
-            auth_items[mtoken.get("application")].append(auth_item)
+            # append the auth_item to the list of the application of each
+            # hostname of the machine
+            for hostname in machines[(row.machine_id, resolver_name)]:
+                host_items[hostname].setdefault(app_name, []).append(
+                    auth_item)
 
-    return auth_items
+    return host_items
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Clear the cache of a machine resolver, that is changed
+#             or deleted
 #  2015-02-25 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Initial writup
 #
@@ -39,7 +41,8 @@ from ..api.lib.utils import required
 from ..api.lib.utils import getParam
 from sqlalchemy import func
 from .crypto import encryptPassword, decryptPassword
-from privacyidea.lib.config import get_machine_resolver_class_dict
+from privacyidea.lib.config import (get_machine_resolver_class_dict,
+                                     machine_resolver_registry)
 from privacyidea.lib.utils import (sanity_name_check, get_data_from_params)
 
 
@@ -116,6 +119,7 @@ def save_resolver(params):
                               Value=value,
                               Type=types.get(key, ""),
                               Description=desc.get(key, "")).save()
+    get_resolver_class(resolvertype).clear_cache(resolvername)
     return resolver_id
 
 
@@ -175,6 +179,9 @@ def delete_resolver(resolvername):
     if reso:
         reso.delete()
         ret = reso.id
+        resolver_class = get_resolver_class(reso.rtype)
+        if resolver_class:
+            resolver_class.clear_cache(reso.name)
     return ret
 
 
@@ -212,16 +219,7 @@ def get_resolver_class(resolver_type):
                           fully qualified or abbreviated
     :return: resolver object class
     """
-    ret = None
-    
-    (resolver_clazzes, resolver_types) = get_machine_resolver_class_dict()
-
-    if resolver_type in resolver_types.values():
-        for k, v in resolver_types.items():
-            if v == resolver_type:
-                ret = resolver_clazzes.get(k)
-                break
-    return ret
+    return machine_resolver_registry.get_class(resolver_type)
 
 
 @log_with(log)
@@ -159,6 +159,19 @@ class BaseMachineResolver(object):
         """
         return None
 
+    @classmethod
+    def clear_cache(cls, resolver_name=None):
+        """
+        Remove everything, the resolver class keeps in the process for the
+        given machine resolver, like cached lookups or open connections.
+        This is called, when a machine resolver is changed or deleted.
+
+        :param resolver_name: The name of the machine resolver. If it is
+            None, all machine resolvers of this class are cleared.
+        :return: None
+        """
+        return None
+
     @staticmethod
     def get_config_description():
         """
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Keep an index of the parsed hosts file per process
 #  2016-04-08 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Avoid consecutive if-statements
 #  2015-02-25 Cornelius Kölbel <cornelius@privacyidea.org>
@@ -31,8 +32,113 @@ from .base import Machine
 from .base import BaseMachineResolver
 from .base import MachineResolverError
 
+import os
+import threading
 import netaddr
 
+# The parsed hosts files are shared by all resolvers of the process. They are
+# keyed by the filename and reread, when the file on disk changes.
+_hosts_index_cache = {}
+_hosts_index_lock = threading.Lock()
+# length of the fragments in the substring index
+NGRAM_LENGTH = 3
+
+
+def _ngrams(text):
+    """
+    Return the set of all fragments of NGRAM_LENGTH in the given text.
+    """
+    return set(text[i:i + NGRAM_LENGTH]
+               for i in range(len(text) - NGRAM_LENGTH + 1))
+
+
+class HostsIndex(object):
+    """
+    The parsed content of a hosts file.
+
+    Each line is parsed only once. The entries are kept in the order of the
+    file as tuples (line_id, line_ip, line_hostname). The exact maps by id,
+    hostname and IP address and the substring index contain the positions of
+    the entries in this list.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = []
+        self.by_id = {}
+        self.by_hostname = {}
+        self.by_ip = {}
+        self.ngrams = {}
+        f = open(filename, "r")
+        try:
+            for line in f:
+                split_line = line.split()
+                if len(split_line) < 2:
+                    # skip lines with less than 2 columns
+                    continue
+                if split_line[0][0] == "#":
+                    # skip comments
+                    continue
+                self._add_entry(split_line[0],
+                                netaddr.IPAddress(split_line[0]),
+                                split_line[1:])
+        finally:
+            f.close()
+
+    def _add_entry(self, line_id, line_ip, line_hostname):
+        pos = len(self.entries)
+        self.entries.append((line_id, line_ip, line_hostname))
+        self.by_id.setdefault(line_id, []).append(pos)
+        self.by_ip.setdefault(line_ip, []).append(pos)
+        for name in line_hostname:
+            self.by_hostname.setdefault(name, []).append(pos)
+        for text in [line_id, "{0!s}".format(line_ip)] + line_hostname:
+            for ngram in _ngrams(text):
+                self.ngrams.setdefault(ngram, set()).add(pos)
+
+    def substring_candidates(self, substrings):
+        """
+        Return the positions of all entries, which may contain each of the
+        given substrings in their id, IP address or hostnames.
+        The result is a superset, the caller needs to check the entries.
+        Substrings shorter than NGRAM_LENGTH do not restrict the result.
+
+        :param substrings: list of strings
+        :return: set of positions or None, if the result is not restricted
+        """
+        candidates = None
+        for substring in substrings:
+            for ngram in _ngrams(substring):
+                positions = self.ngrams.get(ngram, set())
+                if candidates is None:
+                    candidates = set(positions)
+                else:
+                    candidates &= positions
+                if not candidates:
+                    return set()
+        return candidates
+
+
+def get_hosts_index(filename):
+    """
+    Return the parsed hosts file. The file is only parsed again, if its
+    modification time, size or inode changed.
+
+    :param filename: The name of the hosts file
+    :return: HostsIndex object
+    """
+    stat = os.stat(filename)
+    stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+    cached = _hosts_index_cache.get(filename)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with _hosts_index_lock:
+        cached = _hosts_index_cache.get(filename)
+        if not cached or cached[0] != stamp:
+            cached = (stamp, HostsIndex(filename))
+            _hosts_index_cache[filename] = cached
+    return cached[1]
+
 
 class HostsMachineResolver(BaseMachineResolver):
 
@@ -53,56 +159,83 @@ class HostsMachineResolver(BaseMachineResolver):
         :return: list of Machine Objects
         """
         machines = []
+        index = get_hosts_index(self.filename)
 
-        f = open(self.filename, "r")
-        try:
-            for line in f:
-                split_line = line.split()
-                if len(split_line) < 2:
-                    # skip lines with less than 2 columns
-                    continue
-                if split_line[0][0] == "#":
-                    # skip comments
-                    continue
-                line_id = split_line[0]
-                line_ip = netaddr.IPAddress(split_line[0])
-                line_hostname = split_line[1:]
-                # check if machine_id, ip or hostname matches a substring
-                if (any and any not in line_id and
-                        len([x for x in line_hostname if any in x]) <= 0 and
-                        any not in "{0!s}".format(line_ip)):
-                    # "any" was provided but did not match either
-                    # hostname, ip or machine_id
-                    continue
+        if machine_id and not substring:
+            # The first line with this id, which also matches "any", is the
+            # only result.
+            for pos in index.by_id.get(machine_id, []):
+                if self._match_any(index.entries[pos], any):
+                    return [self._get_machine(index.entries[pos])]
+
+        # restrict the lines, that need to be checked
+        candidates = None
+        if hostname and not substring:
+            candidates = set(index.by_hostname.get(hostname, []))
+        if isinstance(ip, netaddr.IPAddress):
+            ip_candidates = set(index.by_ip.get(ip, []))
+            if candidates is None:
+                candidates = ip_candidates
+            else:
+                candidates &= ip_candidates
+        substrings = [s for s in [any] if s]
+        if substring:
+            substrings.extend([s for s in [machine_id, hostname] if s])
+        ngram_candidates = index.substring_candidates(substrings)
+        if ngram_candidates is not None:
+            if candidates is None:
+                candidates = ngram_candidates
+            else:
+                candidates &= ngram_candidates
+        if candidates is None:
+            positions = range(len(index.entries))
+        else:
+            positions = sorted(candidates)
 
+        for pos in positions:
+            line_id, line_ip, line_hostname = index.entries[pos]
+            # check if machine_id, ip or hostname matches a substring
+            if not self._match_any(index.entries[pos], any):
+                # "any" was provided but did not match either
+                # hostname, ip or machine_id
+                continue
+            if machine_id and substring and machine_id not in line_id:
+                # do not append this machine!
+                continue
+            if hostname:
+                if substring:
+                    h_match = len([x for x in line_hostname if hostname in x])
                 else:
-                    if machine_id:
-                        if not substring and machine_id == line_id:
-                            return [Machine(self.name, line_id,
-                                            hostname=line_hostname, ip=line_ip)]
-                        if substring and machine_id not in line_id:
-                            # do not append this machine!
-                            continue
-                    if hostname:
-                        if substring:
-                            h_match = len([x for x in line_hostname if hostname in x])
-                        else:
-                            h_match = hostname in line_hostname
-                        if not h_match:
-                            # do not append this machine!
-                            continue
-
-                    if ip and ip != line_ip:
-                        # Do not append this machine!
-                        continue
-
-                machines.append(Machine(self.name, line_id,
-                                        hostname=line_hostname,
-                                        ip=line_ip))
-        finally:
-            f.close()
+                    h_match = hostname in line_hostname
+                if not h_match:
+                    # do not append this machine!
+                    continue
+
+            if ip and ip != line_ip:
+                # Do not append this machine!
+                continue
+
+            machines.append(self._get_machine(index.entries[pos]))
         return machines
 
+    def _get_machine(self, entry):
+        line_id, line_ip, line_hostname = entry
+        return Machine(self.name, line_id, hostname=list(line_hostname),
+                       ip=line_ip)
+
+    @staticmethod
+    def _match_any(entry, any):
+        """
+        Check if the substring "any" is contained in the machine_id, the
+        hostnames or the ip of the entry.
+        """
+        if not any:
+            return True
+        line_id, line_ip, line_hostname = entry
+        return (any in line_id or
+                len([x for x in line_hostname if any in x]) > 0 or
+                any in "{0!s}".format(line_ip))
+
     def get_machine_id(self, hostname=None, ip=None):
         """
         Returns the machine id for a given hostname or IP address.
@@ -118,12 +251,14 @@ class HostsMachineResolver(BaseMachineResolver):
         :return: The machine ID, which depends on the resolver
         :rtype: basestring
         """
-        machines = self.get_machines()
-        for machine in machines:
-            h_match = not hostname or machine.has_hostname(hostname)
-            i_match = not ip or machine.has_ip(ip)
-            if h_match and i_match:
-                return machine.id
+        index = get_hosts_index(self.filename)
+        positions = set(range(len(index.entries)))
+        if hostname:
+            positions &= set(index.by_hostname.get(hostname, []))
+        if ip:
+            positions &= set(index.by_ip.get(netaddr.IPAddress(ip), []))
+        if positions:
+            return index.entries[min(positions)][0]
 
         return
 
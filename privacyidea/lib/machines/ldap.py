@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Pool the bound connections and cache the lookups of
+#             machine ids, hostnames and IP addresses
 #  2016-08-12 Sebastian Plattner
 #             Allow hostname and machine ID being the same
 #             LDAP attribute.
@@ -42,36 +44,154 @@ import ldap3
 import netaddr
 import traceback
 import logging
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from privacyidea.lib.resolvers.LDAPIdResolver import AUTHTYPE
 from privacyidea.lib.resolvers.LDAPIdResolver import IdResolver
 from gettext import gettext as _
 
 log = logging.getLogger(__name__)
 
+# Bound connections, which are currently not used, per resolver and
+# configuration. They are reused by the following searches of the process.
+_connection_pool = {}
+_connection_pool_lock = threading.Lock()
+# Number of idle connections, that are kept per resolver and configuration
+POOL_SIZE = 10
+# The results of exact lookups by machine id, hostname or IP address
+_lookup_cache = OrderedDict()
+_lookup_cache_lock = threading.Lock()
+# Number of lookups, that are kept in the cache of the process
+CACHE_SIZE = 1000
+
+
+def _get_cached_lookup(key):
+    """
+    Return the cached result of a lookup or None, if the lookup is not
+    cached or expired.
+    """
+    with _lookup_cache_lock:
+        entry = _lookup_cache.pop(key, None)
+        if entry is None or entry[0] < time.time():
+            return None
+        # mark this entry as recently used
+        _lookup_cache[key] = entry
+        return entry[1]
+
+
+def _set_cached_lookup(key, value, timeout):
+    with _lookup_cache_lock:
+        _lookup_cache.pop(key, None)
+        _lookup_cache[key] = (time.time() + timeout, value)
+        while len(_lookup_cache) > CACHE_SIZE:
+            # remove the least recently used entry
+            _lookup_cache.popitem(last=False)
+
 
 class LdapMachineResolver(BaseMachineResolver):
 
     type = "ldap"
 
     def __init__(self, name, config=None):
-        self.i_am_bound = False
         self.name = name
+        self._config_key = None
         if config:
             self.load_config(config)
 
     def _bind(self):
-        if not self.i_am_bound:
-            server_pool = IdResolver.get_serverpool(self.uri, self.timeout)
-            self.l = IdResolver.create_connection(authtype=self.authtype,
-                                                  server=server_pool,
-                                                  user=self.binddn,
-                                                  password=self.bindpw,
-                                                  auto_referrals=not
-                                                  self.noreferrals)
-            self.l.open()
-            if not self.l.bind():
-                raise Exception("Wrong credentials")
-            self.i_am_bound = True
+        """
+        Create a new bound connection.
+        """
+        server_pool = IdResolver.get_serverpool(self.uri, self.timeout)
+        l = IdResolver.create_connection(authtype=self.authtype,
+                                         server=server_pool,
+                                         user=self.binddn,
+                                         password=self.bindpw,
+                                         auto_referrals=not
+                                         self.noreferrals)
+        l.open()
+        if not l.bind():
+            raise Exception("Wrong credentials")
+        return l
+
+    def _get_connection(self):
+        """
+        Return a bound connection from the pool or a new one.
+
+        :return: tuple of the connection and whether it was taken from the pool
+        """
+        with _connection_pool_lock:
+            idle = _connection_pool.get(self._config_key)
+            if idle:
+                return idle.pop(), True
+        return self._bind(), False
+
+    def _release_connection(self, connection):
+        """
+        Put a connection back to the pool after a successful search.
+        """
+        with _connection_pool_lock:
+            idle = _connection_pool.setdefault(self._config_key, [])
+            if len(idle) < POOL_SIZE:
+                idle.append(connection)
+                return
+        self._unbind(connection)
+
+    @staticmethod
+    def _unbind(connection):
+        try:
+            connection.unbind()
+        except Exception as exx:  # pragma: no cover
+            log.debug("Could not unbind LDAP connection: {0!r}".format(exx))
+
+    def _search(self, **kwargs):
+        """
+        Run a search on a pooled connection and return the response.
+        A connection from the pool may have been closed by the server in the
+        meantime. In this case the search is repeated once with a new
+        connection.
+        """
+        connection, reused = self._get_connection()
+        try:
+            connection.search(**kwargs)
+            response = connection.response
+        except Exception as exx:
+            self._unbind(connection)
+            if not reused:
+                raise
+            log.info("Pooled LDAP connection of machine resolver {0!s} "
+                     "failed: {1!r}".format(self.name, exx))
+            connection = self._bind()
+            try:
+                connection.search(**kwargs)
+                response = connection.response
+            except Exception:
+                self._unbind(connection)
+                raise
+        self._release_connection(connection)
+        return response
+
+    @classmethod
+    def clear_cache(cls, resolver_name=None):
+        """
+        Remove the cached lookups and the idle connections of the given
+        machine resolver or of all LDAP machine resolvers.
+
+        :param resolver_name: The name of the machine resolver
+        """
+        with _lookup_cache_lock:
+            for key in list(_lookup_cache):
+                if resolver_name is None or key[0] == resolver_name:
+                    del _lookup_cache[key]
+        connections = []
+        with _connection_pool_lock:
+            for key in list(_connection_pool):
+                if resolver_name is None or key[0] == resolver_name:
+                    connections.extend(_connection_pool.pop(key))
+        for connection in connections:
+            cls._unbind(connection)
 
     @staticmethod
     def _get_entry(entry_attribute, entries):
@@ -137,7 +257,17 @@ class LdapMachineResolver(BaseMachineResolver):
         :return: list of Machine Objects
         """
         machines = []
-        self._bind()
+        cache_key = None
+        if self.cache_timeout and not substring and not any and \
+                (machine_id or hostname or ip):
+            cache_key = (self.name, self._config_key, machine_id, hostname,
+                         "{0!s}".format(ip) if ip else None)
+            cached = _get_cached_lookup(cache_key)
+            if cached is not None:
+                log.debug("Reading {0!s} from cache".format(cache_key[2:]))
+                return [Machine(self.name, m_id, hostname=m_hostname, ip=m_ip)
+                        for m_id, m_hostname, m_ip in cached]
+
         attributes = []
         if self.id_attribute.lower() != "dn":
             attributes.append(self.id_attribute)
@@ -154,20 +284,20 @@ class LdapMachineResolver(BaseMachineResolver):
                                           substring, any)
 
         if self.id_attribute.lower() == "dn" and machine_id:
-            self.l.search(search_base=machine_id,
-                          search_scope=ldap3.BASE,
-                          search_filter=filter,
-                          attributes=attributes,
-                          paged_size=self.sizelimit)
+            response = self._search(search_base=machine_id,
+                                    search_scope=ldap3.BASE,
+                                    search_filter=filter,
+                                    attributes=attributes,
+                                    paged_size=self.sizelimit)
         else:
-            self.l.search(search_base=self.basedn,
-                          search_scope=ldap3.SUBTREE,
-                          search_filter=filter,
-                          attributes=attributes,
-                          paged_size=self.sizelimit)
+            response = self._search(search_base=self.basedn,
+                                    search_scope=ldap3.SUBTREE,
+                                    search_filter=filter,
+                                    attributes=attributes,
+                                    paged_size=self.sizelimit)
 
         # returns a list of dictionaries
-        for entry in self.l.response:
+        for entry in response:
             dn = entry.get("dn")
             attributes = entry.get("attributes")
 
@@ -194,6 +324,10 @@ class LdapMachineResolver(BaseMachineResolver):
                 log.error("Error during fetching LDAP objects: {0!r}".format(exx))
                 log.debug("{0!s}".format(traceback.format_exc()))
 
+        if cache_key:
+            _set_cached_lookup(cache_key,
+                               [(m.id, m.hostname, m.ip) for m in machines],
+                               self.cache_timeout)
         return machines
 
     def get_machine_id(self, hostname=None, ip=None):
@@ -257,6 +391,12 @@ class LdapMachineResolver(BaseMachineResolver):
         self.editable = config.get("EDITABLE", False)
         self.certificate = config.get("CACERTIFICATE")
         self.authtype = config.get("AUTHTYPE", AUTHTYPE.SIMPLE)
+        self.cache_timeout = int(config.get("CACHE_TIMEOUT", 120))
+        # Connections and cached lookups are shared by all instances with
+        # the same name and configuration.
+        self._config_key = (self.name,
+                            hashlib.sha256(repr(sorted(
+                                config.items()))).hexdigest())
 
     @classmethod
     def get_config_description(cls):
@@ -265,6 +405,7 @@ class LdapMachineResolver(BaseMachineResolver):
                                              "BINDDN": "string",
                                              "BINDPW": "password",
                                              "TIMEOUT": "int",
+                                             "CACHE_TIMEOUT": "int",
                                              "SIZELIMIT": "int",
                                              "HOSTNAMEATTRIBUTE": "string",
                                              "IDATTRIBUTE": "string",
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+#
+#  2016-10-19 Remove the metrics files of finished workers
+#  2016-10-19 Collect request and operation latencies for /system/metrics
+#
+#  License:  AGPLv3
+#  contact:  http://www.privacyidea.org
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__doc__ = """This module contains the in-process metrics registry. It counts
+the API requests and measures the duration of the requests and of internal
+operations like resolver lookups, HSM operations, sending SMS and emails,
+writing the audit log and evaluating policies.
+
+The metrics are collected, if PI_METRICS is set in pi.cfg. They can be
+read in the Prometheus text format at /system/metrics.
+
+Each process has its own registry. With several WSGI worker processes
+PI_METRICS_DIR needs to point to a directory, that is writable by all
+workers. Each worker writes its metrics to its own file in this directory
+at most every PI_METRICS_WRITE_INTERVAL seconds and the files of all workers
+are added up, when the metrics are read. A worker removes its file, when it
+exits. The files of workers, which are not running anymore and which were
+not written for STALE_WRITE_INTERVALS write intervals, are removed, when the
+metrics are read.
+
+This module is tested in tests/test_lib_metrics.py
+"""
+import atexit
+import errno
+import json
+import logging
+import os
+import threading
+import time
+import binascii
+from functools import wraps
+from contextlib import contextmanager
+from flask import g, request
+
+log = logging.getLogger(__name__)
+
+REQUESTS_TOTAL = "privacyidea_requests_total"
+REQUEST_SECONDS = "privacyidea_request_duration_seconds"
+OPERATION_SECONDS = "privacyidea_operation_duration_seconds"
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+METRICS = {REQUESTS_TOTAL: (COUNTER, "Number of handled API requests."),
+           REQUEST_SECONDS: (HISTOGRAM, "Duration of the API requests in "
+                                        "seconds."),
+           OPERATION_SECONDS: (HISTOGRAM, "Duration of internal operations "
+                                          "in seconds.")}
+
+# The upper bounds of the histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_WRITE_INTERVAL = 10
+FILE_PREFIX = "metrics-"
+# The file of a worker, that is not running anymore, is removed, if it was
+# not written for this number of write intervals.
+STALE_WRITE_INTERVALS = 5
+
+# The registry of this process. It is None, if the metrics are not collected.
+_registry = None
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    labels = list(labels) + (extra or [])
+    if not labels:
+        return ""
+    return "{{{0!s}}}".format(",".join(
+        ['{0!s}="{1!s}"'.format(name, unicode(value).replace(
+            "\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+         for name, value in labels]))
+
+
+def _process_running(pid):
+    """
+    Check if the process with the given pid is running on this machine.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as exx:
+        # We may not send signals to the processes of other users
+        return exx.errno == errno.EPERM
+    return True
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return "{0!s}".format(value)
+
+
+class MetricsRegistry(object):
+    """
+    The counters and histograms of one process.
+
+    A histogram is stored as a list of the number of values in each bucket
+    (not cumulated), followed by the sum and the number of all values.
+    """
+
+    def __init__(self, directory=None, write_interval=DEFAULT_WRITE_INTERVAL):
+        """
+        :param directory: The directory, in which the metrics of all worker
+            processes are stored. If None, only the metrics of this process
+            are returned.
+        :param write_interval: The number of seconds between writing the
+            metrics of this process to the directory.
+        """
+        self.directory = directory
+        self.write_interval = write_interval
+        self._lock = threading.Lock()
+        self._reset()
+        atexit.register(self.remove_file)
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.last_write = 0
+        self.filename = None
+        if self.directory:
+            # A new process with a reused pid must not overwrite the file
+            # of the old process.
+            self.filename = os.path.join(
+                self.directory, "{0!s}{1!s}-{2!s}.json".format(
+                    FILE_PREFIX, self.pid,
+                    binascii.hexlify(os.urandom(4))))
+
+    def _check_fork(self):
+        # A forked worker must not count the metrics of its parent twice.
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase the counter with the given labels.
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add the value to the histogram with the given labels.
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [0] * len(BUCKETS) + [0.0, 0]
+                self.histograms[key] = histogram
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def get_data(self):
+        """
+        Return the metrics of this process as a JSON serializable dict.
+        """
+        with self._lock:
+            self._check_fork()
+            return {"counters": [[name, list(labels), value] for (
+                name, labels), value in self.counters.items()],
+                    "histograms": [[name, list(labels), list(histogram)]
+                                   for (name, labels), histogram in
+                                   self.histograms.items()]}
+
+    def write(self, force=False):
+        """
+        Write the metrics of this process to its file in the directory. The
+        file is written at most every write_interval seconds.
+
+        :param force: Write the file regardless of the interval
+        """
+        if not self.directory:
+            return
+        now = time.time()
+        if not force and now - self.last_write < self.write_interval:
+            return
+        self.last_write = now
+        data = self.get_data()
+        tmp_filename = "{0!s}.tmp".format(self.filename)
+        try:
+            with open(tmp_filename, "w") as f:
+                json.dump(data, f)
+            # The readers never see a partially written file
+            os.rename(tmp_filename, self.filename)
+        except (IOError, OSError) as exx:
+            log.warning("Could not write the metrics to {0!s}: {1!s}".format(
+                self.filename, exx))
+
+    def remove_file(self):
+        """
+        Remove the file of this process from the directory. This is called,
+        when the process exits.
+        """
+        if not self.filename or self.pid != os.getpid():
+            return
+        try:
+            os.remove(self.filename)
+        except OSError as exx:
+            if exx.errno != errno.ENOENT:
+                log.warning("Could not remove the metrics file {0!s}: "
+                            "{1!s}".format(self.filename, exx))
+
+    def _is_stale(self, filename):
+        """
+        Check if the file belongs to a worker, that is not running anymore
+        and that did not write the file for STALE_WRITE_INTERVALS write
+        intervals.
+        """
+        try:
+            age = time.time() - os.path.getmtime(filename)
+        except OSError:
+            return False
+        if age <= STALE_WRITE_INTERVALS * self.write_interval:
+            return False
+        try:
+            pid = int(os.path.basename(filename)[len(FILE_PREFIX):].split(
+                "-")[0])
+        except ValueError:
+            return True
+        return not _process_running(pid)
+
+    def _read_files(self):
+        """
+        Return the data of all other processes from the directory.
+        """
+        if not self.directory:
+            return []
+        data_list = []
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError as exx:
+            log.warning("Could not read the metrics directory {0!s}: "
+                        "{1!s}".format(self.directory, exx))
+            return []
+        for filename in filenames:
+            filename = os.path.join(self.directory, filename)
+            if (not os.path.basename(filename).startswith(FILE_PREFIX) or
+                    not filename.endswith(".json") or
+                    filename == self.filename):
+                continue
+            if self._is_stale(filename):
+                log.info("Removing the metrics file {0!s} of a finished "
+                         "worker.".format(filename))
+                try:
+                    os.remove(filename)
+                except OSError as exx:
+                    log.warning("Could not remove the metrics file {0!s}: "
+                                "{1!s}".format(filename, exx))
+                continue
+            try:
+                with open(filename) as f:
+                    data_list.append(json.load(f))
+            except (IOError, OSError, ValueError) as exx:
+                log.warning("Could not read the metrics file {0!s}: "
+                            "{1!s}".format(filename, exx))
+        return data_list
+
+    def collect(self):
+        """
+        Add up the metrics of this process and of all other processes in
+        the directory.
+
+        :return: tuple of the counters and the histograms. Both are dicts
+            with the tuple (name, labels) as key.
+        """
+        counters = {}
+        histograms = {}
+        for data in [self.get_data()] + self._read_files():
+            for name, labels, value in data.get("counters", []):
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in data.get("histograms", []):
+                key = (name, tuple(tuple(label) for label in labels))
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histograms[key] = list(values)
+                else:
+                    histograms[key] = [a + b for a, b in zip(histogram,
+                                                             values)]
+        return counters, histograms
+
+    def exposition(self):
+        """
+        Return the metrics of all processes in the Prometheus text format.
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name in sorted(METRICS):
+            metric_type, description = METRICS.get(name)
+            lines.append("# HELP {0!s} {1!s}".format(name, description))
+            lines.append("# TYPE {0!s} {1!s}".format(name, metric_type))
+            if metric_type == COUNTER:
+                for (c_name, labels), value in sorted(counters.items()):
+                    if c_name == name:
+                        lines.append("{0!s}{1!s} {2!s}".format(
+                            name, _format_labels(labels),
+                            _format_value(value)))
+            else:
+                for (h_name, labels), values in sorted(histograms.items()):
+                    if h_name != name:
+                        continue
+                    cumulated = 0
+                    for bound, count in zip(BUCKETS, values):
+                        cumulated += count
+                        lines.append("{0!s}_bucket{1!s} {2:d}".format(
+                            name, _format_labels(labels, [("le", bound)]),
+                            cumulated))
+                    lines.append("{0!s}_bucket{1!s} {2:d}".format(
+                        name, _format_labels(labels, [("le", "+Inf")]),
+                        values[-1]))
+                    lines.append("{0!s}_sum{1!s} {2!s}".format(
+                        name, _format_labels(labels),
+                        _format_value(values[-2])))
+                    lines.append("{0!s}_count{1!s} {2:d}".format(
+                        name, _format_labels(labels), values[-1]))
+        return "\n".join(lines) + "\n"
+
+
+def get_registry():
+    """
+    Return the metrics registry of this process or None, if the metrics are
+    not collected.
+    """
+    return _registry
+
+
+def init_app(app):
+    """
+    Collect the metrics of the application according to PI_METRICS_DIR and
+    PI_METRICS_WRITE_INTERVAL in pi.cfg.
+
+    :param app: The flask application
+    """
+    global _registry
+    _registry = MetricsRegistry(
+        directory=app.config.get("PI_METRICS_DIR"),
+        write_interval=float(app.config.get("PI_METRICS_WRITE_INTERVAL",
+                                            DEFAULT_WRITE_INTERVAL)))
+    return _registry
+
+
+def observe_operation(operation, seconds):
+    """
+    Add the duration of an internal operation like "resolver" or "hsm".
+    """
+    if _registry is not None:
+        _registry.observe(OPERATION_SECONDS, seconds, operation=operation)
+
+
+@contextmanager
+def timer(operation):
+    """
+    Measure the duration of the code block as the given operation::
+
+        with timer("sms"):
+            sms.submit_message(phone, message)
+    """
+    if _registry is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe_operation(operation, time.time() - start)
+
+
+def timed(operation):
+    """
+    Decorator to measure the duration of a function as the given operation.
+
+    :param operation: The name of the operation like "policy"
+    """
+    def decorator(func):
+        @wraps(func)
+        def timed_wrapper(*args, **kwds):
+            if _registry is None:
+                return func(*args, **kwds)
+            start = time.time()
+            try:
+                return func(*args, **kwds)
+            finally:
+                observe_operation(operation, time.time() - start)
+        return timed_wrapper
+    return decorator
+
+
+def start_request():
+    """
+    Remember the start of the request. This is called in the before_request
+    of the blueprints.
+    """
+    if _registry is not None:
+        g.metrics_start = time.time()
+
+
+def finish_request(response):
+    """
+    Count the request and add its duration. This is called in the
+    after_request of the blueprints.
+
+    :param response: The response of the request
+    """
+    start = g.get("metrics_start")
+    if _registry is None or start is None:
+        return
+    # A request is only counted once
+    g.metrics_start = None
+    endpoint = request.url_rule.rule if request.url_rule else request.path
+    _registry.observe(REQUEST_SECONDS, time.time() - start,
+                      endpoint=endpoint, method=request.method)
+    _registry.inc(REQUESTS_TOTAL, endpoint=endpoint, method=request.method,
+                  status=response.status_code)
+    _registry.write()
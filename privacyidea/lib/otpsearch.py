@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+#
+#  2016-10-19 Reuse the worker processes of the OTP search
+#
+#  http://www.privacyidea.org
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This module contains the search engine, that finds the token, which
+generates a given OTP value. It is used by the endpoint /token/getserial.
+
+The tokens are read from the database in chunks. The candidate OTP values of
+HOTP and TOTP tokens are calculated from the encrypted token keys, optionally
+in the pool of worker processes, which is shared by all requests of the
+process, so that the decrypted keys only exist in the workers. All other
+token types are checked via their own check_otp_exist.
+
+The search stops as soon as a second matching token is found or the time
+budget is exhausted.
+
+The code is tested in tests/test_lib_otpsearch.py
+"""
+
+import binascii
+import logging
+import multiprocessing
+import time
+
+from flask import current_app
+from sqlalchemy import and_
+
+from privacyidea.lib.config import get_from_config
+from privacyidea.lib.crypto import init_hsm, zerome
+from privacyidea.lib.error import TokenAdminError
+from privacyidea.lib.log import log_with
+from privacyidea.lib.security.default import DefaultSecurityModule
+from privacyidea.lib.token import (_create_token_query,
+                                   create_tokenclass_object)
+from privacyidea.lib.tokenclass import TokenClass
+from privacyidea.lib.tokens.HMAC import HmacOtp
+from privacyidea.lib.workerpool import get_pool, terminate_pool
+from privacyidea.models import Token, TokenInfo
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+# The token types, whose OTP values can be calculated from the token key
+# without instantiating the token class
+HMAC_TOKENTYPES = ["hotp", "totp"]
+TOKENINFO_KEYS = [u"hashlib", u"timeStep", u"timeShift"]
+
+POOL_NAME = "otpsearch"
+
+# The security module of the worker processes
+_worker_hsm = None
+
+
+def _check_candidates(hsm, otp, candidates):
+    """
+    Calculate the OTP values of the given candidates and return the serials
+    of the tokens, that generate the given OTP value.
+
+    :param hsm: The security module to decrypt the token keys
+    :param otp: The OTP value to search for
+    :param candidates: list of tuples (serial, key_enc, key_iv, otplen,
+        hashlib, start, end, last_counter). If last_counter is not None,
+        counters smaller or equal to last_counter are not accepted.
+    :return: list of matching serial numbers
+    """
+    matches = []
+    for (serial, key_enc, key_iv, otplen, hashlib_name, start, end,
+         last_counter) in candidates:
+        try:
+            akey = hsm.decrypt(binascii.unhexlify(key_enc),
+                               binascii.unhexlify(key_iv))
+            bkey = binascii.unhexlify(akey)
+            zerome(akey)
+            hmac2otp = HmacOtp(digits=otplen,
+                               hashfunc=TokenClass.get_hashlib(hashlib_name))
+            for counter in range(start, end):
+                if hmac2otp.generate(counter, key=bkey) == otp:
+                    if last_counter is None or counter > last_counter:
+                        matches.append(serial)
+                    break
+            zerome(bkey)
+        except Exception as exx:  # pragma: no cover
+            # A flaw in a single token should not stop the search
+            log.warning("error in calculating OTP for token {0!s}: "
+                        "{1!s}".format(serial, exx))
+    return matches
+
+
+def _init_worker(hsm):
+    """
+    Initialize a worker process with the security module of the parent
+    process. The pool is forked, so the security module is not pickled.
+    """
+    global _worker_hsm
+    _worker_hsm = hsm
+
+
+def _worker_check_candidates(otp, candidates):
+    """
+    Entry point of the worker processes.
+    """
+    return _check_candidates(_worker_hsm, otp, candidates)
+
+
+class OTPSearch(object):
+    """
+    Search the token, that creates a given OTP value.
+
+    Usage::
+
+        search = OTPSearch(otp, window=10, tokentype="hotp")
+        serial = search.get_serial()
+
+    After the search ``search.searched`` contains the number of checked
+    tokens and ``search.complete`` indicates, if all tokens could be checked
+    within the time budget.
+    """
+
+    def __init__(self, otp, window=10, tokentype=None, serial=None,
+                 assigned=None, workers=None, chunk_size=None,
+                 timeout=None):
+        """
+        :param otp: The OTP value to search for
+        :param window: The look ahead window
+        :param tokentype: Restrict the search to this token type
+        :param serial: Restrict the search to serials matching this
+            (wildcard) serial
+        :param assigned: Search only in assigned (True) or unassigned (False)
+            tokens
+        :param workers: The number of worker processes. 0 calculates the OTP
+            values in the current process. Defaults to PI_OTPSEARCH_WORKERS.
+        :param chunk_size: The number of tokens read from the database at
+            once. Defaults to PI_OTPSEARCH_CHUNKSIZE.
+        :param timeout: The time budget of the search in seconds. Defaults
+            to PI_OTPSEARCH_TIMEOUT. 0 means no time limit.
+        """
+        config = current_app.config
+        self.otp = otp
+        self.window = int(window)
+        self.tokentype = tokentype
+        self.serial = serial
+        self.assigned = assigned
+        if workers is None:
+            workers = config.get("PI_OTPSEARCH_WORKERS", 0)
+        self.workers = int(workers)
+        self.chunk_size = int(chunk_size or
+                              config.get("PI_OTPSEARCH_CHUNKSIZE",
+                                         DEFAULT_CHUNK_SIZE))
+        if timeout is None:
+            timeout = config.get("PI_OTPSEARCH_TIMEOUT", 0)
+        self.timeout = float(timeout)
+        self.searched = 0
+        self.complete = True
+        self.matches = []
+        # A matching token, whose counter was already increased by
+        # check_otp_exist
+        self._applied_token = None
+
+    def _get_chunks(self):
+        """
+        Yield the database tokens in chunks of chunk_size. We page by the
+        token id, so that the database does not need to skip rows.
+        """
+        sql_query = _create_token_query(tokentype=self.tokentype,
+                                        serial=self.serial,
+                                        assigned=self.assigned)
+        last_id = 0
+        while True:
+            chunk = sql_query.filter(Token.id > last_id).order_by(
+                Token.id).limit(self.chunk_size).all()
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            yield chunk
+            if len(chunk) < self.chunk_size:
+                break
+
+    @staticmethod
+    def _get_tokeninfo(db_tokens):
+        """
+        Read the tokeninfo needed to calculate the OTP values of all tokens
+        of a chunk in one query.
+
+        :return: dict with token_id as key and the tokeninfo dict as value
+        """
+        token_ids = [db_token.id for db_token in db_tokens]
+        tokeninfo = {}
+        if token_ids:
+            for ti in TokenInfo.query.filter(and_(
+                    TokenInfo.token_id.in_(token_ids),
+                    TokenInfo.Key.in_(TOKENINFO_KEYS))).all():
+                tokeninfo.setdefault(ti.token_id, {})[ti.Key] = ti.Value
+        return tokeninfo
+
+    def _build_candidates(self, db_tokens):
+        """
+        Create the candidate tuples for the worker from the HOTP and TOTP
+        tokens of a chunk. The token keys stay encrypted.
+
+        :return: tuple of the list of candidates and the list of the
+            remaining database tokens, that need to be checked by the
+            tokenclass.
+        """
+        candidates = []
+        others = []
+        hmac_tokens = [t for t in db_tokens
+                       if t.tokentype.lower() in HMAC_TOKENTYPES]
+        tokeninfo = self._get_tokeninfo(hmac_tokens)
+        for db_token in db_tokens:
+            tokentype = db_token.tokentype.lower()
+            if tokentype not in HMAC_TOKENTYPES:
+                others.append(db_token)
+                continue
+            info = tokeninfo.get(db_token.id, {})
+            counter = int(db_token.count)
+            if tokentype == "totp":
+                # see TotpTokenClass.check_otp_exist and check_otp
+                timestep = int(info.get("timeStep") or
+                               get_from_config("totp.timeStep") or 30)
+                timeshift = float(info.get("timeShift") or 0)
+                hashlib_name = info.get("hashlib") or \
+                    get_from_config("totp.hashlib", u'sha1')
+                window = self.window or db_token.sync_window
+                current = int(((time.time() + timeshift) / timestep) + 0.5)
+                start = max(current - window, 0)
+                end = current + window
+                last_counter = counter if counter else None
+            else:
+                hashlib_name = info.get("hashlib") or \
+                    get_from_config("hotp.hashlib", u'sha1')
+                start = counter
+                end = counter + self.window
+                last_counter = None
+            candidates.append((db_token.serial, db_token.key_enc,
+                               db_token.key_iv, int(db_token.otplen),
+                               hashlib_name, start, end, last_counter))
+        return candidates, others
+
+    def _check_others(self, db_tokens):
+        """
+        Check the tokens, whose OTP values can not be calculated by the
+        worker, via the tokenclass.
+        """
+        matches = []
+        for db_token in db_tokens:
+            tokenobject = create_tokenclass_object(db_token)
+            if not isinstance(tokenobject, TokenClass):
+                continue
+            try:
+                r = tokenobject.check_otp_exist(otp=self.otp,
+                                                window=self.window)
+                if r >= 0:
+                    matches.append(db_token.serial)
+                    self._applied_token = tokenobject
+            except Exception as err:
+                # A flaw in a single token should not stop privacyidea from
+                # finding the right token
+                log.warning("error in calculating OTP for token {0!s}: "
+                            "{1!s}".format(db_token.serial, err))
+        return matches
+
+    def _add_matches(self, matches):
+        self.matches.extend(matches)
+        if len(self.matches) > 1:
+            raise TokenAdminError('multiple tokens are matching this OTP '
+                                  'value!', id=1200)
+
+    def _time_left(self, start_time):
+        """
+        :return: the remaining seconds of the time budget or None, if there
+            is no time budget.
+        """
+        if not self.timeout:
+            return None
+        return self.timeout - (time.time() - start_time)
+
+    def _search_local(self, hsm, start_time):
+        for chunk in self._get_chunks():
+            remaining = self._time_left(start_time)
+            if remaining is not None and remaining <= 0:
+                self.complete = False
+                break
+            candidates, others = self._build_candidates(chunk)
+            self._add_matches(_check_candidates(hsm, self.otp, candidates))
+            self._add_matches(self._check_others(others))
+            self.searched += len(chunk)
+
+    def _search_pool(self, hsm, start_time):
+        pool = get_pool(POOL_NAME, self.workers, initializer=_init_worker,
+                        initargs=(hsm,))
+        pending = []
+        try:
+            for chunk in self._get_chunks():
+                remaining = self._time_left(start_time)
+                if remaining is not None and remaining <= 0:
+                    self.complete = False
+                    break
+                candidates, others = self._build_candidates(chunk)
+                pending.append((pool.apply_async(_worker_check_candidates,
+                                                 (self.otp, candidates)),
+                                len(candidates)))
+                self._add_matches(self._check_others(others))
+                self.searched += len(others)
+                # Do not read more tokens from the database than the workers
+                # can handle.
+                while len(pending) >= 2 * self.workers:
+                    self._collect(pending.pop(0), start_time)
+                if not self.complete:
+                    break
+            while pending and self.complete:
+                self._collect(pending.pop(0), start_time)
+        finally:
+            if pending:
+                # The search was stopped. The remaining jobs would block the
+                # pool for the next requests.
+                terminate_pool(POOL_NAME)
+
+    def _collect(self, job, start_time):
+        async_result, num_candidates = job
+        remaining = self._time_left(start_time)
+        try:
+            if remaining is not None:
+                if remaining <= 0:
+                    raise multiprocessing.TimeoutError()
+                matches = async_result.get(remaining)
+            else:
+                matches = async_result.get()
+        except multiprocessing.TimeoutError:
+            log.warning("The time budget of {0!s} seconds for the OTP search "
+                        "is exhausted.".format(self.timeout))
+            self.complete = False
+            return
+        self.searched += num_candidates
+        self._add_matches(matches)
+
+    @log_with(log)
+    def get_token(self):
+        """
+        Run the search and return the token object, that generates the OTP
+        value. The OTP counter of the found token is increased, so that the
+        OTP value can not be used again.
+
+        :return: The token object or None
+        :raises TokenAdminError: if more than one token matches.
+        """
+        start_time = time.time()
+        hsm = init_hsm()
+        # Forked workers can only reuse the key file based security module.
+        # An HSM session can not be shared between processes.
+        if self.workers > 0 and isinstance(hsm, DefaultSecurityModule):
+            self._search_pool(hsm, start_time)
+        else:
+            self._search_local(hsm, start_time)
+
+        result_token = None
+        if len(self.matches) == 1:
+            if self._applied_token is not None:
+                result_token = self._applied_token
+            else:
+                db_token = Token.query.filter(Token.serial ==
+                                              self.matches[0]).first()
+                tokenobject = create_tokenclass_object(db_token)
+                # increase the OTP counter of the found token
+                if tokenobject.check_otp_exist(otp=self.otp,
+                                               window=self.window) >= 0:
+                    result_token = tokenobject
+        log.debug("searched {0!s} tokens in {1!s} seconds. complete: "
+                  "{2!s}".format(self.searched, time.time() - start_time,
+                                 self.complete))
+        return result_token
+
+    def get_serial(self):
+        """
+        Run the search and return the serial number of the token, that
+        generates the OTP value.
+
+        :return: serial number or None
+        """
+        serial = None
+        token = self.get_token()
+        if token is not None:
+            serial = token.get_serial()
+        return serial
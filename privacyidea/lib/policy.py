@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Remember the UI rights per policy version
 #  2016-06-21 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #             Change PIN policies
 #  2016-05-07 Cornelius Kölbel <cornelius.koelbel@netknights.it>
@@ -132,13 +133,19 @@ Sat, Sun.
 """
 
 from .log import log_with
+from .metrics import timed
 from configobj import ConfigObj
 
 from netaddr import IPAddress
 from netaddr import IPNetwork
 from gettext import gettext as _
 
+import copy
+import hashlib
+import json
 import logging
+import threading
+from collections import OrderedDict
 from ..models import (Policy, db)
 from privacyidea.lib.config import (get_token_classes, get_token_types)
 from privacyidea.lib.error import ParameterError, PolicyError
@@ -152,6 +159,39 @@ log = logging.getLogger(__name__)
 optional = True
 required = False
 
+# The rights of the web UI per role, realm, user, client and policy version.
+# The web UI asks for the same rights with each page view.
+_rights_cache = OrderedDict()
+_rights_cache_lock = threading.Lock()
+# Number of rights, that are kept in the cache of the process
+RIGHTS_CACHE_SIZE = 1000
+
+
+def _get_cached_rights(key):
+    """
+    Return a copy of the cached rights or None, if they are not cached.
+    """
+    if key is None:
+        return None
+    with _rights_cache_lock:
+        rights = _rights_cache.pop(key, None)
+        if rights is None:
+            return None
+        # mark this entry as recently used
+        _rights_cache[key] = rights
+        return copy.copy(rights)
+
+
+def _set_cached_rights(key, rights):
+    if key is None:
+        return
+    with _rights_cache_lock:
+        _rights_cache.pop(key, None)
+        _rights_cache[key] = copy.copy(rights)
+        while len(_rights_cache) > RIGHTS_CACHE_SIZE:
+            # remove the least recently used entry
+            _rights_cache.popitem(last=False)
+
 
 class SCOPE(object):
     __doc__ = """This is the list of the allowed scopes that can be used in
@@ -310,8 +350,33 @@ class PolicyClass(object):
         for pol in policies:
             # read each policy
             self.policies.append(pol.get())
+        self._version = None
+
+    @property
+    def version(self):
+        """
+        The fingerprint of the policies in this object. It changes with each
+        change of the policies.
+        """
+        if self._version is None:
+            policies = sorted(self.policies, key=lambda pol: pol.get("name"))
+            self._version = hashlib.sha1(json.dumps(policies, sort_keys=True,
+                                                    default=str)).hexdigest()
+        return self._version
+
+    def _rights_cache_key(self, *args):
+        """
+        Return the key of the rights for the given arguments in the cache or
+        None, if the rights must not be cached. This is the case, if a policy
+        is restricted to a time, since the rights then depend on the time of
+        the request.
+        """
+        if [pol for pol in self.policies if pol.get("time")]:
+            return None
+        return (self.version,) + args
 
     @log_with(log)
+    @timed("policy")
     def get_policies(self, name=None, scope=None, realm=None, active=None,
                      resolver=None, user=None, client=None, action=None,
                      adminrealm=None, time=None, all_times=False):
@@ -503,6 +568,11 @@ class PolicyClass(object):
         """
         from privacyidea.lib.auth import ROLE
         from privacyidea.lib.token import get_dynamic_policy_definitions
+        cache_key = self._rights_cache_key("rights", scope, realm, username,
+                                           client)
+        rights = _get_cached_rights(cache_key)
+        if rights is not None:
+            return rights
         rights = []
         userealm = None
         adminrealm = None
@@ -535,6 +605,7 @@ class PolicyClass(object):
         # reduce the list
         rights = list(set(rights))
         log.debug("returning the admin rights: {0!s}".format(rights))
+        _set_cached_rights(cache_key, rights)
         return rights
 
     @log_with(log)
@@ -565,6 +636,13 @@ class PolicyClass(object):
         :return: list of token types, the user may enroll
         """
         from privacyidea.lib.auth import ROLE
+        cache_key = self._rights_cache_key("enroll_tokentypes", client,
+                                           logged_in_user.get("role"),
+                                           logged_in_user.get("realm"),
+                                           logged_in_user.get("username"))
+        enroll_types = _get_cached_rights(cache_key)
+        if enroll_types is not None:
+            return enroll_types
         enroll_types = {}
         role = logged_in_user.get("role")
         if role == ROLE.ADMIN:
@@ -598,6 +676,7 @@ class PolicyClass(object):
                     # tokentype, it is deleted.
                     del(enroll_types[tokentype])
 
+        _set_cached_rights(cache_key, enroll_types)
         return enroll_types
 
 # --------------------------------------------------------------------------
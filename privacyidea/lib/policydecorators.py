@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Remember the otppin policy and the userstore PIN check
+#             during a request
 #  2015-10-31 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Added time_limit and last_auth
 #  2015-03-15 Cornelius Kölbel <cornelius@privacyidea.org>
@@ -41,8 +43,10 @@ from privacyidea.lib.error import PolicyError, privacyIDEAError
 import functools
 from privacyidea.lib.policy import ACTION, SCOPE, ACTIONVALUE, LOGINMODE
 from privacyidea.lib.user import User
-from privacyidea.lib.utils import parse_timelimit, parse_timedelta
+from privacyidea.lib.utils import parse_timelimit, parse_timedelta, to_utf8
 import datetime
+import hashlib
+import os
 from privacyidea.lib.radiusserver import get_radius
 
 log = logging.getLogger(__name__)
@@ -492,6 +496,24 @@ def login_mode(wrapped_function, *args, **kwds):
     return wrapped_function(*args, **kwds)
 
 
+def _get_otppin_cache(g):
+    """
+    Return the dictionary in the request context "g", in which auth_otppin
+    remembers the otppin policies and the results of the userstore PIN
+    checks. The PINs are only stored as salted hashes.
+
+    :param g: The flask global object of the request
+    :return: dict with the keys "salt", "policy" and "userstore"
+    """
+    otppin_cache = getattr(g, "otppin_cache", None)
+    if otppin_cache is None:
+        otppin_cache = {"salt": os.urandom(16),
+                        "policy": {},
+                        "userstore": {}}
+        g.otppin_cache = otppin_cache
+    return otppin_cache
+
+
 def auth_otppin(wrapped_function, *args, **kwds):
     """
     Decorator to decorate the tokenclass.check_pin function.
@@ -529,13 +551,19 @@ def auth_otppin(wrapped_function, *args, **kwds):
             # If we still have no user and no tokenrealm, we create an empty
             # user object.
             user_object=User("", realm="")
-        # get the policy
-        policy_object = g.policy_object
-        otppin_list = policy_object.get_action_values(ACTION.OTPPIN,
-                                                      scope=SCOPE.AUTH,
-                                                      realm=user_object.realm,
-                                                      user=user_object.login,
-                                                      client=clientip)
+        # The PIN of all tokens of a user is checked with the same policy
+        # and against the same userstore. So we remember the policy
+        # decision and the result of the userstore check during the request.
+        otppin_cache = _get_otppin_cache(g)
+        policy_key = (user_object.login, user_object.realm, clientip)
+        otppin_list = otppin_cache["policy"].get(policy_key)
+        if otppin_list is None:
+            # get the policy
+            policy_object = g.policy_object
+            otppin_list = policy_object.get_action_values(
+                ACTION.OTPPIN, scope=SCOPE.AUTH, realm=user_object.realm,
+                user=user_object.login, client=clientip)
+            otppin_cache["policy"][policy_key] = otppin_list
         if otppin_list:
             # There is an otppin policy
             if len(otppin_list) > 1:
@@ -551,8 +579,14 @@ def auth_otppin(wrapped_function, *args, **kwds):
                     return False
 
             if otppin_list[0] == ACTIONVALUE.USERSTORE:
-                rv = user_object.check_password(pin)
-                return rv is not None
+                pin_key = (user_object.login, user_object.resolver,
+                           user_object.realm,
+                           hashlib.sha256(otppin_cache["salt"] +
+                                          (to_utf8(pin) or "")).hexdigest())
+                if pin_key not in otppin_cache["userstore"]:
+                    rv = user_object.check_password(pin)
+                    otppin_cache["userstore"][pin_key] = rv is not None
+                return otppin_cache["userstore"][pin_key]
 
     # call and return the original check_pin function
     return wrapped_function(*args, **kwds)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 #  privacyIDEA is a fork of LinOTP
 #
+#  2016-10-19 Cache the realm configuration in the process
 #  Nov 27, 2014 Cornelius Kölbel <cornelius@privacyidea.org>
 #               Migration to flask
 #               Rewrite of methods
@@ -39,15 +40,130 @@ in tests/test_lib_realm.py
 from ..models import (Realm,
                       ResolverRealm,
                       Resolver,
+                      Config,
                       db)
 from log import log_with
+import copy
 import logging
+import threading
+from datetime import datetime
+from flask import g, has_app_context
 from privacyidea.lib.utils import sanity_name_check
 log = logging.getLogger(__name__)
 
+# The key in the config table, that changes with each change of the realms
+REALM_TIMESTAMP_KEY = "__realmtimestamp__"
+
+# The realms are read from the database only once per process. The cached
+# realms are valid as long as the realm timestamp in the database does not
+# change. The timestamp is checked once per request.
+_realm_topology = {"timestamp": None,
+                   "realms": None}
+_realm_topology_lock = threading.Lock()
+
+
+def _read_realm_topology():
+    """
+    Read all realms and their resolvers from the database.
+
+    :return: dict with the keys "realms" (like the return value of
+        get_realms), "ordered_resolvers" (realm name -> list of resolver
+        names ordered by priority), "resolver_realms" (resolver name -> list of
+        realm names) and "default" (the name of the default realm)
+    """
+    realms = {}
+    ordered_resolvers = {}
+    resolver_realms = {}
+    default_realm = None
+    for realm in Realm.query.all():
+        useridresolvers = []
+        for res in realm.resolver_list:
+            useridresolvers.append({"name": res.resolver.name,
+                                    "type": res.resolver.rtype,
+                                    "priority": res.priority})
+            resolver_realms.setdefault(res.resolver.name, []).append(
+                realm.name)
+        realms[realm.name] = {"resolver": useridresolvers,
+                              "default": realm.default}
+        # The resolver with the lowest priority is the first. Resolvers
+        # without priority come last.
+        ordered_resolvers[realm.name] = [
+            r.get("name") for r in sorted(useridresolvers,
+                                          key=lambda r: r.get("priority") or
+                                          1000)]
+        if realm.default:
+            default_realm = realm.name
+    return {"realms": realms,
+            "ordered_resolvers": ordered_resolvers,
+            "resolver_realms": resolver_realms,
+            "default": default_realm}
+
+
+def _get_realm_timestamp():
+    """
+    :return: the timestamp of the last change of the realms or None
+    """
+    entry = Config.query.filter_by(Key=REALM_TIMESTAMP_KEY).first()
+    if entry:
+        return entry.Value
+    return None
+
+
+def _get_realm_topology():
+    """
+    Return the cached realm topology. The timestamp of the realms is only
+    checked once per request. If the realms were changed in another
+    process, the topology is read again.
+
+    :return: dict as returned by _read_realm_topology
+    """
+    if has_app_context():
+        topology = getattr(g, "realm_topology", None)
+        if topology is not None:
+            return topology
+
+    timestamp = _get_realm_timestamp()
+    if timestamp is None:
+        # There is no timestamp until the realms are saved for the first
+        # time, e.g. after an update or a restore of the database. Without a
+        # timestamp we can not tell, if the cached realms belong to this
+        # database, so they are neither used nor cached.
+        return _read_realm_topology()
+
+    with _realm_topology_lock:
+        if _realm_topology.get("realms") is None or \
+                _realm_topology.get("timestamp") != timestamp:
+            log.debug("Reading the realms from the database.")
+            _realm_topology["realms"] = _read_realm_topology()
+            _realm_topology["timestamp"] = timestamp
+        topology = _realm_topology.get("realms")
+
+    if has_app_context():
+        g.realm_topology = topology
+    return topology
+
+
+def _update_realm_timestamp():
+    """
+    Write a new realm timestamp to the database and drop the cached realms.
+    This needs to be called after each change of the realms.
+    The session is committed.
+    """
+    timestamp = unicode(datetime.now())
+    if Config.query.filter_by(Key=REALM_TIMESTAMP_KEY).count() > 0:
+        Config.query.filter_by(Key=REALM_TIMESTAMP_KEY)\
+            .update({'Value': timestamp})
+    else:
+        db.session.add(Config(REALM_TIMESTAMP_KEY, timestamp))
+    db.session.commit()
+    with _realm_topology_lock:
+        _realm_topology["realms"] = None
+        _realm_topology["timestamp"] = None
+    if has_app_context():
+        g.realm_topology = None
+
 
 @log_with(log)
-#@cache.memoize(10)
 def get_realms(realmname=""):
     '''
     either return all defined realms or a specific realm
@@ -59,21 +175,37 @@ def get_realms(realmname=""):
     :return: a dict with realm description like
     :rtype: dict
     '''
-    result = {}
-
+    realms = _get_realm_topology().get("realms")
     if realmname:
-        realm_q = Realm.query.filter_by(name=realmname)
-    else:
-        realm_q = Realm.query.all()
-    for realm in realm_q:
-        useridresolvers = []
-        for res in realm.resolver_list:
-            useridresolvers.append({"name": res.resolver.name,
-                                    "type": res.resolver.rtype,
-                                    "priority": res.priority})
-        result[realm.name] = {"resolver": useridresolvers,
-                              "default": realm.default}
-    return result
+        if realmname in realms:
+            realms = {realmname: realms.get(realmname)}
+        else:
+            realms = {}
+    # The caller may modify the returned dict
+    return copy.deepcopy(realms)
+
+
+def get_ordered_resolvers(realmname):
+    """
+    returns the names of the resolvers in the realm ordered by priority.
+    The resolver with the lowest priority is the first.
+
+    :param realmname: The name of the realm
+    :return: list of resolver names
+    """
+    return list(_get_realm_topology().get("ordered_resolvers").get(
+        realmname, []))
+
+
+def get_resolver_realms(resolvername):
+    """
+    returns the names of the realms, that contain the resolver
+
+    :param resolvername: The name of the resolver
+    :return: list of realm names
+    """
+    return list(_get_realm_topology().get("resolver_realms").get(
+        resolvername, []))
 
 
 #@cache.memoize(10)
@@ -123,6 +255,7 @@ def set_default_realm(default_realm=None):
     if default_realm:
         r = Realm.query.filter_by(name=default_realm).update({"default": True})
     db.session.commit()
+    _update_realm_timestamp()
     return r
 
 
@@ -136,11 +269,7 @@ def get_default_realm():
     @return: the realm name
     @rtype : string
     """
-    r = Realm.query.filter_by(default=True).first()
-    if r:
-        return r.name
-    else:
-        return None
+    return _get_realm_topology().get("default")
 
 
 @log_with(log)
@@ -159,6 +288,7 @@ def delete_realm(realmname):
 
     realm = Realm.query.filter_by(name=realmname).first()
     ret = realm.delete()
+    _update_realm_timestamp()
 
     # If there was a default realm before
     # and if there is only one realm left, we set the
@@ -238,5 +368,6 @@ def set_realm(realm, resolvers=None, priority=None):
     if Realm.query.count() == 1:
         Realm.query.filter_by(name=realm).update({'default': True})
         db.session.commit()
+    _update_realm_timestamp()
 
     return (added, failed)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 #  privacyIDEA is a fork of LinOTP
 #
+#  2016-10-19 Cache the resolver definitions in the process
 #  2016-04-08 Cornelius Kölbel <cornelus@privacyidea.org>
 #             simplify repetetive unequal checks
 #
@@ -42,22 +43,141 @@ config.py, so this can be tested standalone without realms, tokens and
 webservice!
 """
 
+import copy
 import logging
+import threading
+from datetime import datetime
+from flask import g, has_app_context
 from log import log_with
 from config import (get_resolver_types,
-                     get_resolver_class_dict)
+                     resolver_registry)
 from ..models import (Resolver,
-                      ResolverConfig)
+                      ResolverConfig,
+                      Config,
+                      db)
 from ..api.lib.utils import required
 from ..api.lib.utils import getParam
 from .error import ConfigAdminError
 from sqlalchemy import func
-from .crypto import encryptPassword, decryptPassword
+from .crypto import (encryptPassword, decryptPassword,
+                     FAILED_TO_DECRYPT_PASSWORD)
 from privacyidea.lib.utils import sanity_name_check
 #from privacyidea.lib.cache import cache
 
 log = logging.getLogger(__name__)
 
+# The key in the config table, that changes with each change of the resolvers
+RESOLVER_TIMESTAMP_KEY = "__resolvertimestamp__"
+
+# The resolver definitions are read and decrypted only once per process. They
+# are valid as long as the resolver timestamp in the database does not
+# change. The timestamp is checked once per request.
+_resolver_definitions = {"timestamp": None,
+                         "resolvers": None}
+_resolver_definitions_lock = threading.Lock()
+
+
+def _read_resolver_definitions():
+    """
+    Read all resolvers and their configuration from the database. The
+    passwords in the configuration are decrypted.
+
+    :return: tuple of the dict of the resolvers like the return value of
+        get_resolver_list and a flag, whether all passwords could be
+        decrypted
+    """
+    resolvers = {}
+    decrypted = True
+    for reso in Resolver.query.all():
+        data = {}
+        for conf in reso.rconfig:
+            value = conf.Value
+            if conf.Type == "password":
+                value = decryptPassword(value)
+                if value == FAILED_TO_DECRYPT_PASSWORD:
+                    decrypted = False
+            data[conf.Key] = value
+        resolvers[reso.name] = {"resolvername": reso.name,
+                                "type": reso.rtype,
+                                "data": data}
+    return resolvers, decrypted
+
+
+def _get_resolver_timestamp():
+    """
+    :return: the timestamp of the last change of the resolvers or None
+    """
+    entry = Config.query.filter_by(Key=RESOLVER_TIMESTAMP_KEY).first()
+    if entry:
+        return entry.Value
+    return None
+
+
+def _get_resolver_definitions():
+    """
+    Return the cached resolver definitions. The timestamp of the resolvers
+    is only checked once per request. If the resolvers were changed in
+    another process, the definitions are read again.
+
+    The returned dict must not be modified.
+
+    :return: dict of the resolvers as returned by _read_resolver_definitions
+    """
+    if has_app_context():
+        resolvers = getattr(g, "resolver_definitions", None)
+        if resolvers is not None:
+            return resolvers
+
+    timestamp = _get_resolver_timestamp()
+    if timestamp is None:
+        # There is no timestamp until the resolvers are saved for the first
+        # time, e.g. after an update or a restore of the database. Without a
+        # timestamp we can not tell, if the cached resolvers belong to this
+        # database, so they are neither used nor cached.
+        resolvers, _decrypted = _read_resolver_definitions()
+        return resolvers
+
+    with _resolver_definitions_lock:
+        resolvers = _resolver_definitions.get("resolvers")
+        if resolvers is None or \
+                _resolver_definitions.get("timestamp") != timestamp:
+            log.debug("Reading the resolvers from the database.")
+            resolvers, decrypted = _read_resolver_definitions()
+            if decrypted:
+                _resolver_definitions["resolvers"] = resolvers
+                _resolver_definitions["timestamp"] = timestamp
+            else:
+                # The security module may not be ready, yet. We do not keep
+                # the failed passwords for the next requests.
+                log.warning("Could not decrypt the resolver passwords. The "
+                            "resolvers are not cached.")
+                _resolver_definitions["resolvers"] = None
+                _resolver_definitions["timestamp"] = None
+
+    if has_app_context():
+        g.resolver_definitions = resolvers
+    return resolvers
+
+
+def _update_resolver_timestamp():
+    """
+    Write a new resolver timestamp to the database and drop the cached
+    resolver definitions. This needs to be called after each change of the
+    resolvers. The session is committed.
+    """
+    timestamp = unicode(datetime.now())
+    if Config.query.filter_by(Key=RESOLVER_TIMESTAMP_KEY).count() > 0:
+        Config.query.filter_by(Key=RESOLVER_TIMESTAMP_KEY)\
+            .update({'Value': timestamp})
+    else:
+        db.session.add(Config(RESOLVER_TIMESTAMP_KEY, timestamp))
+    db.session.commit()
+    with _resolver_definitions_lock:
+        _resolver_definitions["resolvers"] = None
+        _resolver_definitions["timestamp"] = None
+    if has_app_context():
+        g.resolver_definitions = None
+
 
 # Hide the keyswords BINDPW and Password in params
 @log_with(log, hide_args_keywords={0: ["BINDPW", "Password"]})
@@ -91,16 +211,18 @@ def save_resolver(params):
     if resolvertype not in resolvertypes:
             raise Exception("resolver type : {0!s} not in {1!s}".format(resolvertype, unicode(resolvertypes)))
 
-    # check the name
-    resolvers = get_resolver_list(filter_resolver_name=resolvername)
-    for r_name, resolver in resolvers.items():
-        if resolver.get("type") == resolvertype:
+    # check the name. We do not use the cached resolvers, since we need to
+    # know the resolvers, that are really in the database.
+    existing_resolver = Resolver.query.filter(func.lower(Resolver.name) ==
+                                              resolvername.lower()).first()
+    if existing_resolver:
+        if existing_resolver.rtype == resolvertype:
             # We found the resolver with the same name and the same type,
             # So we will update this resolver
             update_resolver = True
         else:
             raise Exception("resolver with similar name and other type already "
-                            "exists: %s" % r_name)
+                            "exists: %s" % existing_resolver.name)
 
     # create a dictionary for the ResolverConfig
     resolver_config = get_resolver_config_description(resolvertype)
@@ -142,8 +264,7 @@ def save_resolver(params):
 
     # Everything passed. So lets actually create the resolver in the DB
     if update_resolver:
-        resolver_id = Resolver.query.filter(func.lower(Resolver.name) ==
-                                  resolvername.lower()).first().id
+        resolver_id = existing_resolver.id
     else:
         resolver = Resolver(params.get("resolver"),
                             params.get("type"))
@@ -157,6 +278,7 @@ def save_resolver(params):
                        Value=value,
                        Type=types.get(key, ""),
                        Description=desc.get(key, "")).save()
+    _update_resolver_timestamp()
     return resolver_id
 
 
@@ -166,7 +288,8 @@ def get_resolver_list(filter_resolver_type=None,
                       filter_resolver_name=None,
                       editable=None):
     """
-    Gets the list of configured resolvers from the database
+    Gets the list of configured resolvers. The resolvers are read from the
+    database only once per process.
 
     :param filter_resolver_type: Only resolvers of the given type are returned
     :type filter_resolver_type: basestring
@@ -177,37 +300,24 @@ def get_resolver_list(filter_resolver_type=None,
     :rtype: Dictionary of the resolvers and their configuration
     """
     Resolvers = {}
-    if filter_resolver_name:
-        resolvers = Resolver.query\
-                            .filter(func.lower(Resolver.name) ==
-                                    filter_resolver_name.lower())
-    elif filter_resolver_type:
-        resolvers = Resolver.query\
-                            .filter(Resolver.rtype == filter_resolver_type)
-    else:
-        resolvers = Resolver.query.all()
-    
-    for reso in resolvers:
-        r = {"resolvername": reso.name,
-             "type": reso.rtype}
-        # Add resolver config data
-        data = {}
-        for conf in reso.rconfig:
-            value = conf.Value
-            if conf.Type == "password":
-                value = decryptPassword(value)
-            data[conf.Key] = value
-        r["data"] = data
+    for name, reso in _get_resolver_definitions().items():
+        if filter_resolver_name:
+            if name.lower() != filter_resolver_name.lower():
+                continue
+        elif filter_resolver_type:
+            if reso.get("type") != filter_resolver_type:
+                continue
+        data = reso.get("data")
         if editable is None:
-            Resolvers[reso.name] = r
+            Resolvers[name] = reso
         else:
-            if editable is True and (r["data"].get("Editable") or r["data"].get("EDITABLE"))== "1":
-                Resolvers[reso.name] = r
-            elif editable is False and (r["data"].get("Editable") or r["data"].get("EDTIABLE")) != "1":
-                Resolvers[reso.name] = r
-
+            if editable is True and (data.get("Editable") or data.get("EDITABLE"))== "1":
+                Resolvers[name] = reso
+            elif editable is False and (data.get("Editable") or data.get("EDTIABLE")) != "1":
+                Resolvers[name] = reso
 
-    return Resolvers
+    # The caller may modify the returned resolvers
+    return copy.deepcopy(Resolvers)
 
 
 @log_with(log)
@@ -232,6 +342,7 @@ def delete_resolver(resolvername):
                                    "realm %r." % (resolvername, realmname))
         reso.delete()
         ret = reso.id
+        _update_resolver_timestamp()
     return ret
 
 
@@ -245,8 +356,8 @@ def get_resolver_config(resolvername):
     :return: the config of the resolver
     :rtype: dict
     """
-    reso = get_resolver_list(filter_resolver_name=resolvername)
-    return reso.get(resolvername, {}).get("data", {})
+    reso = _get_resolver_definitions().get(resolvername, {})
+    return copy.deepcopy(reso.get("data", {}))
 
 
 @log_with(log)
@@ -283,16 +394,7 @@ def get_resolver_class(resolver_type):
                           fully qualified or abreviated
     :return: resolver object class
     '''
-    ret = None
-    
-    (resolver_clazzes, resolver_types) = get_resolver_class_dict()
-
-    if resolver_type in resolver_types.values():
-        for k, v in resolver_types.items():
-            if v == resolver_type:
-                ret = resolver_clazzes.get(k)
-                break
-    return ret
+    return resolver_registry.get_class(resolver_type)
 
 
 #@cache.memoize(10)
@@ -304,9 +406,8 @@ def get_resolver_type(resolvername):
     :return: The type of the resolver
     :rtype: string
     """
-    reso_list = get_resolver_list(filter_resolver_name=resolvername)
-    r_type = reso_list.get(resolvername, {}).get("type")
-    return r_type
+    reso = _get_resolver_definitions().get(resolvername, {})
+    return reso.get("type")
 
 
 @log_with(log)
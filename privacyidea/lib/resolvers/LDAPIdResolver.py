@@ -2,6 +2,7 @@
 #  Copyright (C) 2014 Cornelius Kölbel
 #  contact:  corny@cornelinux.de
 #
+#  2016-10-19 Add getMultipleUserInfo to read many users with one search
 #  2016-07-14 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #             Adding getUserId cache.
 #  2016-04-13 Cornelius Kölbel <cornelius.koelbel@netknights.it>
@@ -68,6 +69,8 @@ from privacyidea.lib.utils import to_utf8
 from privacyidea.lib.error import privacyIDEAError
 
 CACHE = {}
+# The number of userids, that are combined in one OR filter
+MULTIPLE_USERINFO_CHUNK = 50
 
 log = logging.getLogger(__name__)
 ENCODING = "utf-8"
@@ -357,6 +360,68 @@ class IdResolver (UserIdResolver):
 
         return ret
 
+    def getMultipleUserInfo(self, userids):
+        """
+        This function returns the user info of several users. The users are
+        read with one OR search filter per MULTIPLE_USERINFO_CHUNK userids.
+        The results are taken from and written to the getUserInfo cache.
+
+        :param userids: list of userids
+        :type userids: list
+        :return: dict with the userid as key and the user info as value
+        :rtype: dict
+        """
+        if self.uidtype.lower() == "dn":
+            # We can not search for DNs with a search filter.
+            return UserIdResolver.getMultipleUserInfo(self, userids)
+
+        ret = {}
+        resolver_id = self.getResolverId()
+        if resolver_id not in CACHE:
+            CACHE[resolver_id] = {"getUserId": {},
+                                  "getUserInfo": {},
+                                  "_getDN": {}}
+        r_cache = CACHE.get(resolver_id).get("getUserInfo")
+        now = datetime.datetime.now()
+        missing_userids = []
+        for userid in userids:
+            if userid in r_cache and now < r_cache[userid]["timestamp"] + \
+                    datetime.timedelta(seconds=self.cache_timeout):
+                if r_cache[userid]["value"]:
+                    ret[userid] = r_cache[userid]["value"]
+            else:
+                missing_userids.append(userid)
+
+        if missing_userids:
+            self._bind()
+        attributes = self.userinfo.values()
+        attributes.append(str(self.uidtype))
+        for i in range(0, len(missing_userids), MULTIPLE_USERINFO_CHUNK):
+            uid_filter = ""
+            for userid in missing_userids[i:i + MULTIPLE_USERINFO_CHUNK]:
+                search_userid = userid
+                if self.uidtype == "objectGUID":
+                    search_userid = escape_bytes(uuid.UUID(
+                        "{{{0!s}}}".format(userid)).bytes_le)
+                uid_filter += "({0!s}={1!s})".format(self.uidtype,
+                                                     search_userid)
+            filter = "(&{0!s}(|{1!s}))".format(self.searchfilter, uid_filter)
+            self.l.search(search_base=self.basedn,
+                          search_scope=self.scope,
+                          search_filter=filter,
+                          attributes=attributes)
+            r = self._trim_result(self.l.response)
+            for entry in r:
+                userid = self._get_uid(entry, self.uidtype)
+                ret[userid] = self._ldap_attributes_to_user_object(
+                    entry.get("attributes"))
+
+        # now we cache the results
+        for userid in missing_userids:
+            r_cache[userid] = {"value": ret.get(userid, {}),
+                               "timestamp": now}
+        return ret
+
     def _ldap_attributes_to_user_object(self, attributes):
         """
         This helper function converts the LDAP attributes to a dictionary for
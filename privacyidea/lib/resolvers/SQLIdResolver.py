@@ -35,6 +35,7 @@ from UserIdResolver import UserIdResolver
 
 from sqlalchemy import and_
 from sqlalchemy import create_engine
+from privacyidea.lib.sqlstats import set_engine_name
 from sqlalchemy.orm import sessionmaker
 
 import traceback
@@ -408,6 +409,42 @@ class IdResolver (UserIdResolver):
         
         return userinfo
     
+    def getMultipleUserInfo(self, userids):
+        """
+        This function returns the user info of several users with one SQL
+        query.
+
+        :param userids: list of userids
+        :type userids: list
+        :return: dict with the userid as key and the user info as value
+        :rtype: dict
+        """
+        ret = {}
+        if not userids:
+            return ret
+        # The userid column may be an integer column, while the token
+        # stores the userid as a string
+        userid_map = dict([(u"{0!s}".format(userid), userid)
+                           for userid in userids])
+        try:
+            conditions = []
+            column = self.map.get("userid")
+            conditions.append(getattr(self.TABLE, column).in_(userids))
+            conditions = self._append_where_filter(conditions, self.TABLE,
+                                                   self.where)
+            filter_condition = and_(*conditions)
+            result = self.session.query(self.TABLE).filter(filter_condition)
+
+            for r in result:
+                userinfo = self._get_user_from_mapped_object(r)
+                userid = userid_map.get(u"{0!s}".format(userinfo.get("id")))
+                if userid is not None:
+                    ret[userid] = userinfo
+        except Exception as exx:  # pragma: no cover
+            log.error("Could not get the userinformation: {0!r}".format(exx))
+
+        return ret
+
     def getUsername(self, userId):
         """
         Returns the username/loginname for a given userid
@@ -585,6 +622,7 @@ class IdResolver (UserIdResolver):
             self.engine = create_engine(self.connect_string,
                                         encoding=self.encoding,
                                         convert_unicode=False)
+        set_engine_name(self.engine, "sqlresolver")
         # create a configured "Session" class
         Session = sessionmaker(bind=self.engine)
 
@@ -152,6 +152,25 @@ class UserIdResolver(object):
         """
         return {}
 
+    def getMultipleUserInfo(self, userids):
+        """
+        This function returns the user information of several users at once.
+        Resolvers, that can fetch many users with a single request (like
+        one LDAP search or one SQL query) should overwrite this method.
+
+        :param userids: list of IDs of the users in the resolver
+        :type userids: list
+        :return: dictionary with the userid as key and the user information
+            as value. Users, that are not found, are not contained.
+        :rtype: dict
+        """
+        ret = {}
+        for userid in userids:
+            userinfo = self.getUserInfo(userid)
+            if userinfo:
+                ret[userid] = userinfo
+        return ret
+
     def getUserList(self, searchDict=None):
         """
         This function finds the user objects,
@@ -35,6 +35,7 @@ The code is tested in tests/test_lib_smsprovider
 
 from privacyidea.models import SMSGateway, SMSGatewayOption
 import logging
+from privacyidea.lib.metrics import timer
 log = logging.getLogger(__name__)
 
 
@@ -256,4 +257,5 @@ def send_sms_identifier(identifier, phone, message):
     :return: True in case of success
     """
     sms = create_sms_instance(identifier)
-    return sms.submit_message(phone, message)
+    with timer("sms"):
+        return sms.submit_message(phone, message)
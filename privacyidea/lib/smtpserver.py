@@ -22,6 +22,7 @@ from privacyidea.lib.crypto import (decryptPassword, encryptPassword,
                                     FAILED_TO_DECRYPT_PASSWORD)
 import logging
 from privacyidea.lib.log import log_with
+from privacyidea.lib.metrics import timed
 from time import gmtime, strftime
 import smtplib
 from email.mime.text import MIMEText
@@ -56,6 +57,7 @@ class SMTPServer(object):
         return self.test_email(self.config, recipient, subject, body, sender)
 
     @staticmethod
+    @timed("smtp")
     def test_email(config, recipient, subject, body, sender=None):
         """
         Sends an email via the SMTP Database Object
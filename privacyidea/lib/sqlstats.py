@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+#  2016-10-19 Count and time the SQL queries of a request
+#
+#  License:  AGPLv3
+#  contact:  http://www.privacyidea.org
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__doc__ = """This module counts the SQL queries of a request and measures the
+time spent in the database. It is activated with PI_SQL_STATS in pi.cfg.
+
+The queries of all SQLAlchemy engines are counted, i.e. of the privacyIDEA
+database, the audit database and the SQL resolvers. The engines are named
+with set_engine_name, so that the queries are also counted per engine.
+
+The numbers are returned in the response headers X-PI-SQL-Queries and
+X-PI-SQL-Time and are written to the debug log. If a request exceeds
+PI_SQL_STATS_MAX_QUERIES or PI_SQL_STATS_MAX_TIME, a warning is logged and
+the numbers are added to the info field of the audit log.
+
+This module is tested in tests/test_lib_sqlstats.py
+"""
+import logging
+import time
+import weakref
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+# The names of the engines like "privacyidea", "audit" or "sqlresolver"
+_engine_names = weakref.WeakKeyDictionary()
+QUERY_START_KEY = "pi_query_start"
+
+
+class SQLStats(object):
+    """
+    The number of queries and the time spent in the database during one
+    request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.engines = {}
+
+    def add(self, engine_name, seconds):
+        self.count += 1
+        self.seconds += seconds
+        count, engine_seconds = self.engines.get(engine_name, (0, 0.0))
+        self.engines[engine_name] = (count + 1, engine_seconds + seconds)
+
+    def exceeds(self, max_queries=0, max_time=0):
+        """
+        Check if the request exceeded one of the thresholds. A threshold of
+        0 is not checked.
+        """
+        return bool((max_queries and self.count > max_queries) or
+                    (max_time and self.seconds > max_time))
+
+    def __str__(self):
+        engines = ", ".join(["{0!s}: {1:d}".format(name, count) for name, (
+            count, _seconds) in sorted(self.engines.items())])
+        return "{0:d} SQL queries in {1:.3f} seconds ({2!s})".format(
+            self.count, self.seconds, engines)
+
+
+def set_engine_name(engine, name):
+    """
+    Set the name, under which the queries of the engine are counted.
+
+    :param engine: SQLAlchemy engine
+    :param name: The name like "audit"
+    """
+    _engine_names[engine] = name
+
+
+def get_request_stats():
+    """
+    Return the SQLStats object of the current request or None, if the
+    queries are not counted.
+    """
+    if has_request_context():
+        return g.get("sql_stats")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault(QUERY_START_KEY, []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get(QUERY_START_KEY)
+    if not starts:
+        return
+    seconds = time.time() - starts.pop()
+    stats = get_request_stats()
+    if stats is not None:
+        stats.add(_engine_names.get(conn.engine, "other"), seconds)
+
+
+def add_to_audit(audit_object):
+    """
+    Add the numbers of the current request to the info field of the audit
+    log, if the request exceeded one of the thresholds.
+    This needs to be called before the audit log is finalized.
+
+    :param audit_object: The audit object of the request
+    """
+    stats = get_request_stats()
+    if stats is not None and stats.exceeds(
+            g.get("sql_stats_max_queries"), g.get("sql_stats_max_time")):
+        info = audit_object.audit_data.get("info")
+        audit_object.log({"info": "{0!s} {1!s}".format(
+            info, stats).strip() if info else "{0!s}".format(stats)})
+
+
+def init_app(app):
+    """
+    Count the SQL queries of each request of the application.
+
+    :param app: The flask application
+    """
+    from privacyidea.models import db
+    if not event.contains(Engine, "before_cursor_execute",
+                          _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    max_queries = int(app.config.get("PI_SQL_STATS_MAX_QUERIES", 0))
+    max_time = float(app.config.get("PI_SQL_STATS_MAX_TIME", 0))
+
+    @app.before_request
+    def start_sql_stats():
+        set_engine_name(db.engine, "privacyidea")
+        g.sql_stats = SQLStats()
+        g.sql_stats_max_queries = max_queries
+        g.sql_stats_max_time = max_time
+
+    @app.after_request
+    def finish_sql_stats(response):
+        stats = get_request_stats()
+        if stats is not None:
+            response.headers["X-PI-SQL-Queries"] = str(stats.count)
+            response.headers["X-PI-SQL-Time"] = "{0:.6f}".format(
+                stats.seconds)
+            if stats.exceeds(max_queries, max_time):
+                log.warning("{0!s} {1!s}: {2!s}".format(request.method,
+                                                        request.path, stats))
+            else:
+                log.debug("{0!s} {1!s}: {2!s}".format(request.method,
+                                                      request.path, stats))
+        return response
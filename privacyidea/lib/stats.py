@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Import matplotlib only when statistics are created
 #  2015-07-16 Initial writeup
 #  (c) Cornelius Kölbel
 #  License:  AGPLv3
@@ -27,21 +28,29 @@ import logging
 from privacyidea.lib.log import log_with
 import datetime
 import StringIO
+import sys
 log = logging.getLogger(__name__)
 
-try:
-    import matplotlib
-    MATPLOT_READY = True
-    matplotlib.style.use('ggplot')
-    matplotlib.use('Agg')
-except Exception as exx:
-    MATPLOT_READY = False
-    log.warning("If you want to see statistics you need to install python "
-                "matplotlib.")
-
 customcmap = [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
 
 
+def _get_pyplot():
+    """
+    matplotlib takes long to import and uses a lot of memory. So it is only
+    imported, when statistics are created.
+
+    :return: the module matplotlib.pyplot
+    """
+    import matplotlib
+    if "matplotlib.pyplot" not in sys.modules:
+        # The backend needs to be set before pyplot is imported
+        matplotlib.use('Agg')
+        import matplotlib.style
+        matplotlib.style.use('ggplot')
+    import matplotlib.pyplot
+    return matplotlib.pyplot
+
+
 @log_with(log)
 def get_statistics(auditobject, start_time=datetime.datetime.now()
                                          -datetime.timedelta(days=7),
@@ -56,6 +65,11 @@ def get_statistics(auditobject, start_time=datetime.datetime.now()
     :return: JSON
     """
     result = {}
+    try:
+        _get_pyplot()
+    except Exception as exx:
+        log.warning("If you want to see statistics you need to install python "
+                    "matplotlib.")
     df = auditobject.get_dataframe(start_time=start_time, end_time=end_time)
 
     # authentication successful/fail per user or serial
@@ -105,7 +119,7 @@ def _get_fail(df, key):
                                        "GET /validate/check"]))][
                      key].value_counts()[:5]
 
-        plot_canvas = matplotlib.pyplot.figure()
+        plot_canvas = _get_pyplot().figure()
         ax = plot_canvas.add_subplot(1,1,1)
 
         fig = series.plot(ax=ax, kind="bar",
@@ -140,7 +154,7 @@ def _get_number_of(df, key, nums=5):
     output = StringIO.StringIO()
     output.truncate(0)
     try:
-        plot_canvas = matplotlib.pyplot.figure()
+        plot_canvas = _get_pyplot().figure()
         ax = plot_canvas.add_subplot(1, 1, 1)
 
         series = df[key].value_counts()[:nums]
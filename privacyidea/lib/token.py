@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 #  privacyIDEA is a fork of LinOTP
 #
+#  2016-10-19 Add bulk token enrollment
+#  2016-10-19 Add bulk token actions
+#  2016-10-19 Commit the changes of check_token_list only once
+#  2016-10-19 Check the PINs first in check_realm_pass
+#  2016-10-19 Resolve the challenges of a transaction in one query
+#  2016-10-19 Resolve the token owners of token lists in bulk
 #  2016-06-21 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Add next pin change response
 #  2016-06-13 Cornelius Kölbel <cornelius@privacyidea.org>
@@ -57,22 +63,25 @@ import binascii
 import os
 import logging
 
+from flask import current_app
 from sqlalchemy import (and_, func)
 from privacyidea.lib.error import (TokenAdminError,
                                    ParameterError,
                                    privacyIDEAError)
 from privacyidea.lib.decorators import (check_user_or_serial,
-                                        check_copy_serials)
+                                        check_copy_serials, single_commit)
 from privacyidea.lib.tokenclass import TokenClass
-from privacyidea.lib.utils import generate_password
+from privacyidea.lib.utils import generate_password, generate_otpkey
+from privacyidea.lib.crypto import encrypt, geturandom
 from privacyidea.lib.log import log_with
 from privacyidea.models import (Token, Realm, TokenRealm, Challenge,
-                                MachineToken, TokenInfo)
+                                MachineToken, TokenInfo, db)
 from privacyidea.lib.config import get_from_config
 from privacyidea.lib.config import (get_token_class, get_token_prefix,
-                                    get_token_types,
+                                    get_token_types, get_prepend_pin,
                                     get_inc_fail_count_on_false_pin)
-from privacyidea.lib.user import get_user_info
+from privacyidea.lib.user import get_multiple_user_info
+from privacyidea.lib.challenge import get_valid_challenge_serials
 from gettext import gettext as _
 from privacyidea.lib.realm import realm_is_defined
 from privacyidea.lib.policydecorators import (libpolicy,
@@ -90,6 +99,26 @@ required = False
 
 ENCODING = "utf-8"
 
+# check_realm_pass reads the tokens of the realm in chunks of this size
+REALMPASS_CHUNK_SIZE = 500
+# The maximum number of tokens with a matching PIN, for which
+# check_realm_pass calculates the OTP values
+REALMPASS_MAX_CANDIDATES = 100
+
+# The columns, that can be exported by get_tokens_export
+EXPORT_COLUMNS = ["serial", "tokentype", "description", "active", "revoked",
+                  "locked", "failcount", "maxfail", "count", "count_window",
+                  "sync_window", "otplen", "rollout_state", "resolver",
+                  "user_id", "username", "user_realm", "realms", "info"]
+EXPORT_CHUNK_SIZE = 500
+# The actions of bulk_token_action
+BULK_ACTIONS = ["enable", "disable", "revoke", "reset", "realm", "assign"]
+# bulk_token_action changes the tokens in chunks of this size. Each chunk is
+# committed in its own transaction.
+BULK_CHUNK_SIZE = 500
+# The token types, that can be enrolled by bulk_init_tokens
+BULK_INIT_TYPES = ["hotp", "totp"]
+
 
 @log_with(log)
 def create_tokenclass_object(db_token):
@@ -246,6 +275,73 @@ def _create_token_query(tokentype=None, realm=None, assigned=None, user=None,
     return sql_query
 
 
+def _get_token_realms(token_ids):
+    """
+    Read the realm names of the given tokens with one query.
+
+    :param token_ids: list of database ids of the tokens
+    :return: dict with the token id as key and the list of realm names as
+        value
+    :rtype: dict
+    """
+    token_realms = {}
+    if token_ids:
+        realm_query = db.session.query(TokenRealm.token_id, Realm.name)\
+            .filter(and_(TokenRealm.realm_id == Realm.id,
+                         TokenRealm.token_id.in_(token_ids)))
+        for token_id, realmname in realm_query:
+            token_realms.setdefault(token_id, []).append(realmname)
+    return token_realms
+
+
+def _get_token_owners(db_tokens):
+    """
+    Determine the owners of the given database tokens. The user information
+    is read with one request per resolver and the realms of the tokens are
+    read with one query. This avoids asking the resolver for each single
+    token.
+
+    :param db_tokens: list of database tokens
+    :return: dict with the token id as key and a tuple of the user
+        information and the realm name as value. The user information is
+        None, if the resolver failed. The realm name is only set, if the
+        token is in exactly one realm.
+    :rtype: dict
+    """
+    owners = {}
+    userids = {}
+    for db_token in db_tokens:
+        if db_token.user_id and db_token.resolver:
+            userids.setdefault(db_token.resolver, []).append(db_token.user_id)
+
+    user_info = {}
+    for resolver, resolver_userids in userids.items():
+        try:
+            user_info[resolver] = get_multiple_user_info(resolver_userids,
+                                                         resolver)
+        except Exception as exx:
+            # In certain cases the LDAP or SQL server might not be reachable.
+            log.error("User information can not be retrieved: {0!s}".format(
+                exx))
+            user_info[resolver] = None
+
+    token_realms = _get_token_realms([db_token.id for db_token in db_tokens
+                                      if db_token.user_id])
+
+    for db_token in db_tokens:
+        if db_token.resolver in user_info and db_token.user_id:
+            resolver_info = user_info.get(db_token.resolver)
+            info = None
+            if resolver_info is not None:
+                info = resolver_info.get(db_token.user_id, {})
+            realms = token_realms.get(db_token.id, [])
+            realmname = ""
+            if len(realms) == 1:
+                realmname = realms[0]
+            owners[db_token.id] = (info, realmname)
+    return owners
+
+
 @log_with(log)
 #@cache.memoize(10)
 def get_tokens(tokentype=None, realm=None, assigned=None, user=None,
@@ -388,23 +484,23 @@ def get_tokens_paginate(tokentype=None, realm=None, assigned=None, user=None,
     if pagination.has_next:
         next = page + 1
     token_list = []
+    # get the users of all tokens on this page at once
+    owners = _get_token_owners(tokens)
     for token in tokens:
         tokenobject = create_tokenclass_object(token)
         if isinstance(tokenobject, TokenClass):
             token_dict = tokenobject.get_as_dict()
             # add user information
-            # In certain cases the LDAP or SQL server might not be reachable.
-            # Then an exception is raised
             token_dict["username"] = ""
             token_dict["user_realm"] = ""
-            try:
-                userobject = tokenobject.user
-                if userobject:
-                    token_dict["username"] = userobject.login
-                    token_dict["user_realm"] = userobject.realm
-            except Exception as exx:
-                log.error("User information can not be retrieved: {0!s}".format(exx))
-                token_dict["username"] = "**resolver error**"
+            if token.id in owners:
+                user_info, realmname = owners.get(token.id)
+                if user_info is None:
+                    # The resolver could not be reached
+                    token_dict["username"] = "**resolver error**"
+                elif user_info.get("username") and realmname:
+                    token_dict["username"] = user_info.get("username")
+                    token_dict["user_realm"] = realmname
 
             token_list.append(token_dict)
 
@@ -416,6 +512,87 @@ def get_tokens_paginate(tokentype=None, realm=None, assigned=None, user=None,
     return ret
 
 
+@log_with(log)
+def get_tokens_export(tokentype=None, realm=None, assigned=None, user=None,
+                      serial=None, active=None, resolver=None,
+                      description=None, userid=None, columns=None,
+                      chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    This generator returns all tokens matching the filter as a dictionary
+    containing the requested columns. It is used to export the token list
+    without any page size limit.
+
+    The tokens are read in chunks of chunk_size ordered by the token id, the
+    owners, realms and tokeninfo of each chunk are read in bulk.
+
+    :param columns: The columns to return. Allowed are the entries of
+        EXPORT_COLUMNS. If None, all columns are returned.
+    :type columns: list
+    :param chunk_size: The number of tokens to read from the database at once
+    :type chunk_size: int
+    :return: generator of dicts
+    """
+    columns = columns or EXPORT_COLUMNS
+    for column in columns:
+        if column not in EXPORT_COLUMNS:
+            raise ParameterError("Unknown column {0!s}. Allowed columns are "
+                                 "{1!s}".format(column,
+                                                ", ".join(EXPORT_COLUMNS)))
+    sql_query = _create_token_query(tokentype=tokentype, realm=realm,
+                                    assigned=assigned, user=user,
+                                    serial=serial, active=active,
+                                    resolver=resolver,
+                                    description=description, userid=userid)
+    with_owners = "username" in columns or "user_realm" in columns
+    last_id = 0
+    while True:
+        db_tokens = sql_query.filter(Token.id > last_id).order_by(
+            Token.id).limit(chunk_size).all()
+        if not db_tokens:
+            break
+        last_id = db_tokens[-1].id
+        token_ids = [db_token.id for db_token in db_tokens]
+
+        owners = {}
+        if with_owners:
+            owners = _get_token_owners(db_tokens)
+        token_realms = {}
+        if "realms" in columns:
+            token_realms = _get_token_realms(token_ids)
+        token_info = {}
+        if "info" in columns:
+            for ti in TokenInfo.query.filter(
+                    TokenInfo.token_id.in_(token_ids)):
+                info = token_info.setdefault(ti.token_id, {})
+                if ti.Type:
+                    info[ti.Key + ".type"] = ti.Type
+                info[ti.Key] = ti.Value
+
+        for db_token in db_tokens:
+            user_info, user_realm = owners.get(db_token.id, ({}, ""))
+            row = {}
+            for column in columns:
+                if column == "username":
+                    if user_info is None:
+                        row[column] = "**resolver error**"
+                    elif user_realm:
+                        row[column] = user_info.get("username", "")
+                    else:
+                        row[column] = ""
+                elif column == "user_realm":
+                    row[column] = user_realm if user_info else ""
+                elif column == "realms":
+                    row[column] = token_realms.get(db_token.id, [])
+                elif column == "info":
+                    row[column] = token_info.get(db_token.id, {})
+                else:
+                    row[column] = getattr(db_token, column)
+            yield row
+
+        if len(db_tokens) < chunk_size:
+            break
+
+
 @log_with(log)
 def get_token_type(serial):
     """
@@ -624,15 +801,16 @@ def get_all_token_users():
     """
     tokens = {}
     tokenobject_list = get_tokens(assigned=True)
+    owners = _get_token_owners([tokenobject.token for tokenobject in
+                                tokenobject_list])
 
     for tokenobject in tokenobject_list:
         user_info = {}
-        if tokenobject.token.user_id and tokenobject.token.resolver:
-            user_info = get_user_info(tokenobject.token.user_id,
-                                      tokenobject.token.resolver)
+        if tokenobject.token.id in owners:
+            user_info = owners.get(tokenobject.token.id)[0] or {}
 
         if tokenobject.token.user_id and len(user_info) == 0:
-            user_info['username'] = u'/:no user info:/'
+            user_info = {'username': u'/:no user info:/'}
 
         if user_info:
             tokens[tokenobject.token.serial] = user_info
@@ -805,6 +983,15 @@ def get_tokenserial_of_transaction(transaction_id):
     return serial
 
 
+def _create_serial(prefix, tokennum):
+    h_serial = ''
+    num_str = '{:04d}'.format(tokennum)
+    h_len = 8 - len(num_str)
+    if h_len > 0:
+        h_serial = binascii.hexlify(os.urandom(h_len)).upper()[0:h_len]
+    return "{0!s}{1!s}{2!s}".format(prefix, num_str, h_serial)
+
+
 @log_with(log)
 def gen_serial(tokentype=None, prefix=None):
     """
@@ -815,14 +1002,6 @@ def gen_serial(tokentype=None, prefix=None):
     :return: serial number
     :rtype: string
     """
-    def _gen_serial(_prefix, _tokennum):
-        h_serial = ''
-        num_str = '{:04d}'.format(_tokennum)
-        h_len = 8 - len(num_str)
-        if h_len > 0:
-            h_serial = binascii.hexlify(os.urandom(h_len)).upper()[0:h_len]
-        return "{0!s}{1!s}{2!s}".format(_prefix, num_str, h_serial)
-
     if not tokentype:
         tokentype = 'PIUN'
     if not prefix:
@@ -832,7 +1011,7 @@ def gen_serial(tokentype=None, prefix=None):
     tokennum = Token.query.filter(Token.tokentype == u'' + tokentype).count()
 
     # Now create the serial
-    serial = _gen_serial(prefix, tokennum)
+    serial = _create_serial(prefix, tokennum)
 
     # now test if serial already exists
     while True:
@@ -840,11 +1019,166 @@ def gen_serial(tokentype=None, prefix=None):
         if numtokens == 0:
             # ok, there is no such token, so we're done
             break
-        serial = _gen_serial(prefix, tokennum + numtokens)  # pragma: no cover
+        serial = _create_serial(prefix, tokennum + numtokens)  # pragma: no cover
 
     return serial
 
 
+def gen_serials(count, tokentype=None, prefix=None,
+                chunk_size=BULK_CHUNK_SIZE):
+    """
+    generate count serials for a given tokentype in the same format as
+    gen_serial.
+
+    In contrast to gen_serial the tokens of the tokentype are only counted
+    once and the uniqueness of the serials is checked with one query for
+    each chunk of chunk_size serials.
+
+    :param count: The number of serials
+    :param tokentype: the token type prefix is done by a lookup on the tokens
+    :param prefix: A prefix to the serial number
+    :param chunk_size: The number of serials checked in one query
+    :return: list of serial numbers
+    """
+    if not tokentype:
+        tokentype = 'PIUN'
+    if not prefix:
+        prefix = get_token_prefix(tokentype.lower(), tokentype.upper())
+
+    tokennum = Token.query.filter(Token.tokentype == u'' + tokentype).count()
+    serials = []
+    known = set()
+    while len(serials) < count:
+        candidates = []
+        for _i in range(min(count - len(serials), chunk_size)):
+            candidates.append(_create_serial(prefix, tokennum))
+            tokennum += 1
+        known.update([row.serial for row in db.session.query(
+            Token.serial).filter(Token.serial.in_(candidates))])
+        for serial in candidates:
+            # The existing serials are skipped and the missing serials are
+            # created with the next numbers in the next round.
+            if serial not in known:
+                known.add(serial)
+                serials.append(serial)
+    return serials
+
+
+@log_with(log, log_exit=False)
+def bulk_init_tokens(count, tokentype="hotp", prefix=None, realms=None,
+                     description=None, hashlib=None, otplen=None,
+                     timestep=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Enroll many HOTP or TOTP tokens at once with keys generated on the
+    server.
+
+    In contrast to init_token the token objects are not created. The
+    serials are generated with gen_serials and the tokens, their token info
+    and their realms are written with bulk inserts in chunks of chunk_size
+    tokens. Each chunk is committed in its own transaction. The tokens are
+    not assigned to a user and do not have a PIN. QR codes are not created.
+
+    The default values of the tokens are read from the configuration like
+    in init_token.
+
+    :param count: The number of tokens
+    :param tokentype: One of BULK_INIT_TYPES
+    :param prefix: A prefix of the serial numbers
+    :param realms: The realms of the tokens
+    :type realms: list
+    :param description: The description of the tokens
+    :param hashlib: The hash algorithm sha1, sha256 or sha512. The key size
+        is chosen accordingly.
+    :param otplen: The length of the OTP values
+    :param timestep: The time step of TOTP tokens
+    :param chunk_size: The number of tokens written in one transaction
+    :return: list of dicts with serial, type, otpkey (hexlified), otplen,
+        hashlib and counter (HOTP) or timeStep (TOTP) of the new tokens.
+    :rtype: list
+    """
+    # Avoid a circular import
+    from privacyidea.lib.tokens.hotptoken import keylen
+    tokentype = (tokentype or "hotp").lower()
+    if tokentype not in BULK_INIT_TYPES:
+        raise ParameterError("Only the token types {0!s} can be enrolled "
+                             "in bulk.".format(", ".join(BULK_INIT_TYPES)))
+    count = int(count)
+    if count < 1:
+        raise ParameterError("The number of tokens must be positive")
+    if chunk_size < 1:
+        raise ParameterError("The chunk size must be positive")
+    if tokentype == "totp":
+        hashlib = hashlib or get_from_config("totp.hashlib", u"sha1")
+    hashlib = hashlib or u"sha1"
+    key_size = keylen.get(hashlib)
+    if not key_size:
+        raise ParameterError("Unknown hashlib {0!s}".format(hashlib))
+    otplen = int(otplen or get_from_config("DefaultOtpLen") or 6)
+    token_values = {"tokentype": u"" + tokentype,
+                    "description": u"{0!s}".format(description or ""),
+                    "otplen": otplen,
+                    "maxfail": int(get_from_config("DefaultMaxFailCount")
+                                   or 10),
+                    "count_window": int(get_from_config("DefaultCountWindow")
+                                        or 10),
+                    "sync_window": int(get_from_config("DefaultSyncWindow")
+                                       or 1000),
+                    "active": True,
+                    "revoked": False,
+                    "locked": False,
+                    "failcount": 0,
+                    "count": 0}
+    info = {"hashlib": hashlib}
+    if tokentype == "totp":
+        timestep = int(timestep or get_from_config("totp.timeStep") or 30)
+        info["timeStep"] = timestep
+        info["timeWindow"] = get_from_config("totp.timeWindow") or 180
+        info["timeShift"] = get_from_config("totp.timeShift") or 0
+    realm_ids = []
+    if realms:
+        # get rid of non-defined realms like set_realms
+        realm_ids = [r.id for r in Realm.query.filter(
+            Realm.name.in_(set(realms)))]
+
+    serials = gen_serials(count, tokentype=tokentype, prefix=prefix,
+                          chunk_size=chunk_size)
+    tokens = []
+    for i in range(0, len(serials), chunk_size):
+        chunk = serials[i:i + chunk_size]
+        rows = []
+        for serial in chunk:
+            otpkey = generate_otpkey(key_size)
+            iv = geturandom(16)
+            row = {"serial": u"" + serial,
+                   "key_enc": unicode(binascii.hexlify(encrypt(otpkey, iv))),
+                   "key_iv": unicode(binascii.hexlify(iv))}
+            row.update(token_values)
+            rows.append(row)
+            token = {"serial": serial, "type": tokentype, "otpkey": otpkey,
+                     "otplen": otplen, "hashlib": hashlib}
+            if tokentype == "totp":
+                token["timeStep"] = timestep
+            else:
+                token["counter"] = 0
+            tokens.append(token)
+        db.session.execute(Token.__table__.insert(), rows)
+        token_ids = [row.id for row in db.session.query(Token.id).filter(
+            Token.serial.in_(chunk))]
+        db.session.execute(TokenInfo.__table__.insert(),
+                           [{"token_id": token_id, "Key": u"" + key,
+                             "Value": u"{0!s}".format(value), "Type": u"",
+                             "Description": u""}
+                            for token_id in token_ids
+                            for key, value in info.items()])
+        if realm_ids:
+            db.session.execute(TokenRealm.__table__.insert(),
+                               [{"token_id": token_id, "realm_id": realm_id}
+                                for token_id in token_ids
+                                for realm_id in realm_ids])
+        db.session.commit()
+    return tokens
+
+
 @log_with(log)
 def init_token(param, user=None, tokenrealms=None):
     """
@@ -1302,6 +1636,171 @@ def enable_token(serial, enable=True, user=None):
     return len(tokenobject_list)
 
 
+@log_with(log)
+def bulk_token_action(action, serials=None, tokentype=None, realm=None,
+                      assigned=None, serial=None, resolver=None,
+                      description=None, userid=None, realms=None, user=None,
+                      check_realm=None, limit=None,
+                      chunk_size=BULK_CHUNK_SIZE):
+    """
+    Enable, disable, revoke, reset, set the realms of or assign many tokens
+    at once. The tokens are either given by the list of serials or by the
+    filter arguments, which are the same as in get_tokens.
+
+    The tokens are read in chunks of chunk_size and each chunk is changed
+    with set based SQL updates in its own transaction. In contrast to the
+    functions for single tokens, the token objects are not created and the
+    event handlers are not called for the single tokens.
+
+    Like with the functions for single tokens, locked tokens can not be
+    enabled, disabled, reset or assigned. Tokens, which already belong to a
+    user, are not assigned. Tokens, that are already enabled or disabled,
+    are not changed.
+
+    :param action: One of BULK_ACTIONS
+    :param serials: list of serial numbers
+    :type serials: list
+    :param realms: The realms of the tokens for the action "realm"
+    :type realms: list
+    :param user: The user, to whom the tokens are assigned for the action
+        "assign". The tokens are also put into the realm of the user.
+    :type user: User object
+    :param check_realm: A function, which is called once for each realm of
+        the tokens with the realm name or None for tokens without realm. If
+        it returns False, the tokens of this realm are not changed. As in
+        get_realms_of_token, the first realm of a token is used.
+    :param limit: The maximum number of tokens to change. The remaining
+        tokens are skipped.
+    :param chunk_size: The number of tokens changed in one transaction
+    :return: dict with the number of changed tokens in "count", the list of
+        the serials of the changed tokens in "changed" and a dict of the
+        serials of the skipped tokens with the reason in "skipped"
+    :rtype: dict
+    """
+    if action not in BULK_ACTIONS:
+        raise ParameterError("Unknown action {0!s}. Allowed actions are "
+                             "{1!s}".format(action, ", ".join(BULK_ACTIONS)))
+    if serials is None and not any([tokentype, realm, assigned is not None,
+                                    serial, resolver, description, userid]):
+        # We do not want to change all tokens by mistake
+        raise ParameterError("Missing serials or token filter")
+    if chunk_size < 1:
+        raise ParameterError("The chunk size must be positive")
+
+    realm_ids = []
+    if action == "realm":
+        realms = realms or []
+        # get rid of non-defined realms like set_realms
+        realm_ids = [r.id for r in Realm.query.filter(
+            Realm.name.in_(set(realms)))] if realms else []
+    elif action == "assign":
+        if user is None or user.is_empty():
+            raise ParameterError("Missing user for the action assign")
+        (uid, resolvertype, resolvername) = user.get_user_identifiers()
+        realm_ids = [r.id for r in Realm.query.filter(
+            Realm.name == user.realm)]
+
+    columns = [Token.id, Token.serial, Token.active, Token.locked,
+               Token.user_id]
+    if serials is not None:
+        serials = list(serials)
+
+        def chunks():
+            for i in range(0, len(serials), chunk_size):
+                chunk = serials[i:i + chunk_size]
+                rows = db.session.query(*columns).filter(
+                    Token.serial.in_(chunk)).all()
+                found = set([row.serial for row in rows])
+                missing = [s for s in chunk if s not in found]
+                yield rows, missing
+    else:
+        sql_query = _create_token_query(tokentype=tokentype, realm=realm,
+                                        assigned=assigned, serial=serial,
+                                        resolver=resolver,
+                                        description=description,
+                                        userid=userid).with_entities(*columns)
+
+        def chunks():
+            last_id = 0
+            while True:
+                rows = sql_query.filter(Token.id > last_id).order_by(
+                    Token.id).limit(chunk_size).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                yield rows, []
+                if len(rows) < chunk_size:
+                    break
+
+    result = {"count": 0, "changed": [], "skipped": {}}
+    realm_allowed = {}
+    for rows, missing in chunks():
+        for missing_serial in missing:
+            result["skipped"][missing_serial] = "not found"
+        token_realms = {}
+        if check_realm:
+            token_realms = _get_token_realms([row.id for row in rows])
+        change = []
+        for row in rows:
+            reason = None
+            if check_realm:
+                first_realm = (token_realms.get(row.id) or [None])[0]
+                if first_realm not in realm_allowed:
+                    realm_allowed[first_realm] = check_realm(first_realm)
+                if not realm_allowed.get(first_realm):
+                    reason = "not allowed"
+            if reason is None:
+                if action in ["enable", "disable", "reset", "assign"] and \
+                        row.locked:
+                    reason = "locked"
+                elif action == "assign" and row.user_id:
+                    reason = "assigned"
+                elif action == "enable" and row.active:
+                    continue
+                elif action == "disable" and not row.active:
+                    continue
+                elif limit is not None and \
+                        result["count"] + len(change) >= limit:
+                    reason = "limit"
+            if reason:
+                result["skipped"][row.serial] = reason
+            else:
+                change.append(row)
+
+        if change:
+            token_ids = [row.id for row in change]
+            token_query = Token.query.filter(Token.id.in_(token_ids))
+            if action in ["enable", "disable"]:
+                token_query.update({"active": action == "enable"},
+                                   synchronize_session=False)
+            elif action == "revoke":
+                token_query.update({"revoked": True, "locked": True,
+                                    "active": False},
+                                   synchronize_session=False)
+            elif action == "reset":
+                token_query.update({"failcount": 0},
+                                   synchronize_session=False)
+            elif action == "assign":
+                token_query.update({"user_id": uid,
+                                    "resolver": resolvername,
+                                    "resolver_type": resolvertype,
+                                    "failcount": 0},
+                                   synchronize_session=False)
+            if action in ["realm", "assign"]:
+                TokenRealm.query.filter(TokenRealm.token_id.in_(
+                    token_ids)).delete(synchronize_session=False)
+                if realm_ids:
+                    db.session.execute(TokenRealm.__table__.insert(),
+                                       [{"token_id": token_id,
+                                         "realm_id": realm_id}
+                                        for token_id in token_ids
+                                        for realm_id in realm_ids])
+            db.session.commit()
+            result["count"] += len(change)
+            result["changed"].extend([row.serial for row in change])
+    return result
+
+
 def is_token_active(serial):
     """
     Return True if the token is active, otherwise false
@@ -1750,20 +2249,83 @@ def check_realm_pass(realm, passw, options=None):
     """
     res = False
     reply_dict = {}
+    max_candidates = int(current_app.config.get(
+        "PI_REALMPASS_MAX_CANDIDATES", REALMPASS_MAX_CANDIDATES))
+    prepend_pin = get_prepend_pin()
+    # If the request context is passed, the otppin policy might check the
+    # PIN against the userstore.
+    pin_prefilter = not (options or {}).get("g")
     # since an attacker does not know, which token is tested, we restrict to
     # only active tokens. He would not guess that the given OTP value is that
     #  of an inactive token.
-    tokenobject_list = get_tokens(realm=realm, assigned=True, active=True)
-    if not tokenobject_list:
+    sql_query = _create_token_query(realm=realm, assigned=True, active=True)
+    token_found = False
+    # The tokens with a matching PIN are limited by max_candidates. The
+    # tokens, whose PIN can not be checked in advance, are not counted.
+    candidates = []
+    unchecked_tokens = []
+    last_id = 0
+    while True:
+        db_tokens = sql_query.filter(Token.id > last_id).order_by(
+            Token.id).limit(REALMPASS_CHUNK_SIZE).all()
+        if not db_tokens:
+            break
+        token_found = True
+        last_id = db_tokens[-1].id
+        for db_token in db_tokens:
+            tokenclass = get_token_class(db_token.tokentype)
+            if tokenclass is None:  # pragma: no cover
+                continue
+            if not (pin_prefilter and
+                    _checks_pin_like_tokenclass(tokenclass)):
+                unchecked_tokens.append(db_token)
+                continue
+            # We check the PIN on the database object. The OTP value is
+            # only calculated for tokens with a matching PIN.
+            otplen = db_token.otplen
+            if prepend_pin:
+                pin = passw[0:-otplen]
+            else:
+                pin = passw[otplen:]
+            if db_token.check_pin(pin):
+                candidates.append(db_token)
+        if max_candidates and len(candidates) > max_candidates:
+            log.warning("More than {0:d} tokens in realm {1!s} match the "
+                        "PIN.".format(max_candidates, realm))
+            return False, {"message": "Too many matching tokens in this "
+                                      "realm"}
+
+    if not token_found:
         res = False
         reply_dict["message"] = "There is no active and assigned token in " \
                                 "this realm"
+    elif not candidates and not unchecked_tokens:
+        res = False
+        reply_dict["message"] = "wrong otp pin"
     else:
+        tokenobject_list = [create_tokenclass_object(db_token)
+                            for db_token in candidates + unchecked_tokens]
         res, reply_dict = check_token_list(tokenobject_list, passw,
                                            options=options)
     return res, reply_dict
 
 
+def _checks_pin_like_tokenclass(tokenclass):
+    """
+    Returns True, if the token class splits the password and checks the PIN
+    the same way as the base TokenClass. For such tokens the PIN can be
+    checked on the database object without calculating the OTP value.
+
+    :param tokenclass: The class of the token type
+    :return: bool
+    """
+    for method in ["authenticate", "split_pin_pass", "check_pin"]:
+        if getattr(tokenclass, method).__func__ is not \
+                getattr(TokenClass, method).__func__:
+            return False
+    return True
+
+
 @log_with(log)
 @libpolicy(auth_lastauth)
 def check_serial_pass(serial, passw, options=None):
@@ -1858,6 +2420,7 @@ def check_user_pass(user, passw, options=None):
 
 
 @log_with(log)
+@single_commit
 def check_token_list(tokenobject_list, passw, user=None, options=None):
     """
     this takes a list of token objects and tries to find the matching token
@@ -1869,6 +2432,9 @@ def check_token_list(tokenobject_list, passw, user=None, options=None):
     This function is called by check_serial_pass, check_user_pass and
     check_yubikey_pass.
 
+    All changes of the tokens like counters and tokeninfo are committed in
+    one transaction at the end.
+
     :param tokenobject_list: list of identified tokens
     :param passw: the provided passw (mostly pin+otp)
     :param user: the identified use - as class object
@@ -1885,6 +2451,14 @@ def check_token_list(tokenobject_list, passw, user=None, options=None):
     options = options or {}
     options = dict(options.items() + {'user': user}.items())
 
+    # If this is the response to a challenge, we fetch the serials of the
+    # tokens with a valid challenge for this transaction in one query. Only
+    # these tokens need to verify the response.
+    transaction_id = options.get("transaction_id", options.get("state"))
+    challenge_serials = None
+    if transaction_id is not None:
+        challenge_serials = get_valid_challenge_serials(transaction_id)
+
     # if there has been one token in challenge mode, we only handle challenges
     challenge_response_token_list = []
     challenge_request_token_list = []
@@ -1998,7 +2572,22 @@ def check_token_list(tokenobject_list, passw, user=None, options=None):
 
     elif challenge_response_token_list:
         # A challenge token was found.
-        for tokenobject in challenge_response_token_list:
+        if challenge_serials is not None:
+            # Tokens without a valid challenge for this transaction can not
+            # match the response.
+            candidate_list = [tokenobject for tokenobject in
+                              challenge_response_token_list
+                              if tokenobject.token.serial in
+                              challenge_serials]
+            log.debug("Transaction {0!s}: {1:d} of {2:d} tokens have a valid "
+                      "challenge. Saved {3:d} challenge lookups.".format(
+                          transaction_id, len(candidate_list),
+                          len(challenge_response_token_list),
+                          len(challenge_response_token_list) -
+                          len(candidate_list)))
+        else:
+            candidate_list = challenge_response_token_list
+        for tokenobject in candidate_list:
             if tokenobject.check_challenge_response(passw=passw,
                                                     options=options) >= 0:
                 # OTP matches
@@ -2006,7 +2595,7 @@ def check_token_list(tokenobject_list, passw, user=None, options=None):
                 tokenobject.inc_count_auth()
                 tokenobject.inc_count_auth_success()
                 reply_dict["message"] = "Found matching challenge"
-                reply_dict["serial"] = challenge_response_token_list[0].token.serial
+                reply_dict["serial"] = tokenobject.token.serial
                 tokenobject.challenge_janitor()
                 # Reset the fail counter of the challenge response token
                 tokenobject.reset()
@@ -50,6 +50,7 @@ from privacyidea.api.lib.utils import required
 from privacyidea.lib.config import get_from_config
 from privacyidea.lib.policy import SCOPE
 from privacyidea.lib.log import log_with
+from privacyidea.lib.metrics import timer
 from privacyidea.lib.smsprovider.SMSProvider import (get_sms_provider_class,
                                                      create_sms_instance)
 from json import loads
@@ -381,7 +382,8 @@ class SmsTokenClass(HotpTokenClass):
                 raise Exception("Failed to load sms.providerConfig: {0!r}".format(exc))
 
         log.debug("submitMessage: {0!r}, to phone {1!r}".format(message, phone))
-        ret = sms.submit_message(phone, message)
+        with timer("sms"):
+            ret = sms.submit_message(phone, message)
         return ret, message
 
     @staticmethod
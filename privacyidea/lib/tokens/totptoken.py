@@ -2,6 +2,7 @@
 #
 #  (c) 2015 Cornelius Kölbel - cornelius@privacyidea.org
 #
+#  2016-10-19 Use the hashlib of imported tokens
 #  2016-04-29 Cornelius Kölbel <cornelius.koelbel@netknights.it>
 #             Add get_default_settings to change the parameters before
 #             the token is created
@@ -166,10 +167,10 @@ class TotpTokenClass(HotpTokenClass):
         timeShift = param.get("timeShift",
                               get_from_config("totp.timeShift") or 0)
         # we support various hashlib methods, but only on create
-        # which is effectively set in the update
-        hashlibStr = param.get("totp.hashlib",
-                               get_from_config("totp.hashlib",
-                                               u'sha1'))
+        # which is effectively set in the update. The hashlib of imported
+        # tokens is passed as "hashlib".
+        hashlibStr = param.get("totp.hashlib") or param.get("hashlib") or \
+            get_from_config("totp.hashlib", u'sha1')
 
         self.add_tokeninfo("timeWindow", timeWindow)
         self.add_tokeninfo("timeShift", timeShift)
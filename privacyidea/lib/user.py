@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 #  privacyIDEA is a fork of LinOTP
 #
+#  2016-10-19   Use one thread pool per process for the resolvers
+#  2016-10-19   Use the cached realms
+#  2016-10-19   Search the resolvers of a realm concurrently
 #  2015-11-03   Cornelius Kölbel <cornelius@privacyidea.org>
 #               Add memberfunction "exist"
 #  2015-06-06   Cornelius Kölbel <cornelius@privacyidea.org>
@@ -46,7 +49,14 @@ This code is tested in tests/test_lib_user.py
 '''
 
 import logging
+import sys
+import time
 import traceback
+import six
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
 
 from .error import UserError
 from ..api.lib.utils import (getParam,
@@ -57,14 +67,90 @@ from .resolver import (get_resolver_object,
 
 from .realm import (get_realms,
                     get_default_realm,
-                    get_realm)
+                    get_realm,
+                    get_ordered_resolvers,
+                    get_resolver_realms)
 from .config import get_from_config
+from .metrics import timed, timer
+from .workerpool import get_pool
 
 ENCODING = 'utf-8'
+DEFAULT_RESOLVER_WORKERS = 0
+# The threads, that call the resolvers concurrently. There is only one pool
+# per process, so that the number of threads is bounded.
+RESOLVER_POOL_NAME = "resolver"
 
 log = logging.getLogger(__name__)
 
 
+def _call_resolvers(function, resolvernames):
+    """
+    Call the function for the resolver object of each resolver.
+
+    If there is more than one resolver and PI_RESOLVER_WORKERS in pi.cfg is
+    greater than 1, the resolvers are called concurrently in the thread pool
+    of the process. By default (0) the resolvers are called one after
+    another. PI_RESOLVER_TIMEOUT defines the number of seconds to wait for
+    the concurrent resolvers (default 0: wait for all resolvers).
+
+    The results are returned in the order of the given resolvers. This way
+    the caller can stop as soon as it has got the result it needs.
+
+    The resolver objects are created in the calling thread, the worker
+    threads only run the given function.
+
+    :param function: function, that takes a resolver object as parameter
+    :param resolvernames: list of resolver names
+    :return: generator of tuples (resolvername, result, exc_info). If the
+        resolver failed or timed out, result is None and exc_info holds the
+        exception as returned by sys.exc_info(), so that it can be raised
+        again with six.reraise.
+    """
+    function = timed("resolver")(function)
+    resolver_objects = []
+    for resolvername in resolvernames:
+        y = get_resolver_object(resolvername)
+        if y is None:  # pragma: no cover
+            log.info("Resolver {0!r} not found!".format(resolvername))
+        else:
+            resolver_objects.append((resolvername, y))
+
+    workers = int(current_app.config.get("PI_RESOLVER_WORKERS",
+                                         DEFAULT_RESOLVER_WORKERS))
+    timeout = float(current_app.config.get("PI_RESOLVER_TIMEOUT", 0))
+    if len(resolver_objects) < 2 or workers < 2:
+        for resolvername, y in resolver_objects:
+            try:
+                result = function(y)
+            except Exception:
+                yield resolvername, None, sys.exc_info()
+            else:
+                yield resolvername, result, None
+        return
+
+    pool = get_pool(RESOLVER_POOL_NAME, workers, pool_class=ThreadPool)
+    async_results = [(resolvername, pool.apply_async(function, (y,)))
+                     for resolvername, y in resolver_objects]
+    # All resolvers share the same deadline, since they run concurrently.
+    # We do not wait for resolvers, that timed out. They finish in the
+    # background.
+    deadline = time.time() + timeout
+    for resolvername, async_result in async_results:
+        try:
+            if timeout:
+                result = async_result.get(max(deadline - time.time(), 0))
+            else:
+                result = async_result.get()
+        except TimeoutError:
+            log.warning("The resolver {0!r} did not answer within {1!s} "
+                        "seconds.".format(resolvername, timeout))
+            yield resolvername, None, sys.exc_info()
+        except Exception:
+            yield resolvername, None, sys.exc_info()
+        else:
+            yield resolvername, result, None
+
+
 @log_with(log)
 class User(object):
     """
@@ -142,19 +228,7 @@ class User(object):
         alphabetical order
         :return: list or resolvernames
         """
-        resolver_tuples = []
-        realm_config = get_realms(self.realm)
-        resolvers_in_realm = realm_config.get(self.realm, {})\
-                                         .get("resolver", {})
-        for resolver in resolvers_in_realm:
-            # append a tuple
-            resolver_tuples.append((resolver.get("name"),
-                             resolver.get("priority") or 1000))
-
-        # sort the resolvers by the 2nd entry in the tuple, the priority
-        resolvers = sorted(resolver_tuples, key=lambda resolver: resolver[1])
-        resolvers = [r[0] for r in resolvers]
-        return resolvers
+        return get_ordered_resolvers(self.realm)
     
     def get_resolvers(self):
         """
@@ -174,24 +248,27 @@ class User(object):
             return [self.resolver]
         
         resolvers = []
-        for resolvername in self.get_ordererd_resolvers():
-            # test, if the user is contained in this resolver
-            y = get_resolver_object(resolvername)
-            if y is None:  # pragma: no cover
-                log.info("Resolver {0!r} not found!".format(resolvername))
+        # The resolvers are asked concurrently, but the results are read in
+        # the order of the priority.
+        login = self.login
+        for resolvername, uid, exc_info in _call_resolvers(
+                lambda y: y.getUserId(login), self.get_ordererd_resolvers()):
+            if exc_info is not None:
+                # We must not skip a resolver with a higher priority, that
+                # failed or timed out. Otherwise the login could be resolved
+                # to another user in a resolver with a lower priority.
+                six.reraise(*exc_info)
+            if uid not in ["", None]:
+                log.info("user {0!r} found in resolver {1!r}".format(self.login,
+                                                           resolvername))
+                log.info("userid resolved to {0!r} ".format(uid))
+                self.resolver = resolvername
+                # We do not need to search other resolvers!
+                break
             else:
-                uid = y.getUserId(self.login)
-                if uid not in ["", None]:
-                    log.info("user {0!r} found in resolver {1!r}".format(self.login,
-                                                               resolvername))
-                    log.info("userid resolved to {0!r} ".format(uid))
-                    self.resolver = resolvername
-                    # We do not need to search other resolvers!
-                    break
-                else:
-                    log.debug("user %r not found"
-                              " in resolver %r" % (self.login,
-                                                   resolvername))
+                log.debug("user %r not found"
+                          " in resolver %r" % (self.login,
+                                               resolvername))
         if self.resolver:
             resolvers = [self.resolver]
         return resolvers
@@ -217,7 +294,8 @@ class User(object):
         if y is None:
             raise UserError("The resolver '{0!s}' does not exist!".format(
                             self.resolver))
-        uid = y.getUserId(self.login)
+        with timer("resolver"):
+            uid = y.getUserId(self.login)
         return uid, rtype, self.resolver
 
     def exist(self):
@@ -248,7 +326,8 @@ class User(object):
         """
         (uid, _rtype, _resolver) = self.get_user_identifiers()
         y = get_resolver_object(self.resolver)
-        userInfo = y.getUserInfo(uid)
+        with timer("resolver"):
+            userInfo = y.getUserInfo(uid)
         return userInfo
     
     @log_with(log)
@@ -282,7 +361,6 @@ class User(object):
         :return: realms of the user
         :rtype: list
         """
-        allRealms = get_realms()
         Realms = []
         if self.realm == "" and self.resolver == "":
             defRealm = get_default_realm().lower()
@@ -294,14 +372,10 @@ class User(object):
             # User has not realm!
             # we have got a resolver and will get all realms
             # the resolver belongs to.
-            for key, val in allRealms.items():
-                log.debug("evaluating realm {0!r}: {1!r} ".format(key, val))
-                for reso in val.get('resolver', []):
-                    resoname = reso.get("name")
-                    if resoname == self.resolver:
-                        Realms.append(key.lower())
-                        log.debug("added realm %r to Realms due to "
-                                  "resolver %r" % (key, self.resolver))
+            for key in get_resolver_realms(self.resolver):
+                Realms.append(key.lower())
+                log.debug("added realm %r to Realms due to "
+                          "resolver %r" % (key, self.resolver))
         return Realms
     
     @log_with(log, log_entry=False)
@@ -326,7 +400,9 @@ class User(object):
             if len(res) == 1:
                 y = get_resolver_object(self.resolver)
                 uid, _rtype, _rname = self.get_user_identifiers()
-                if y.checkPass(uid, password):
+                with timer("resolver"):
+                    password_ok = y.checkPass(uid, password)
+                if password_ok:
                     success = "{0!s}@{1!s}".format(self.login, self.realm)
                     log.debug("Successfully authenticated user {0!r}.".format(self))
                 else:
@@ -604,28 +680,29 @@ def get_user_list(param=None, user=None):
             for resolver_entry in res_list.get("resolver"):
                 resolvers.append(resolver_entry.get("name"))
 
-    for resolver_name in set(resolvers):
-        try:
-            log.debug("Check for resolver class: {0!r}".format(resolver_name))
-            y = get_resolver_object(resolver_name)
-            log.debug("with this search dictionary: {0!r} ".format(searchDict))
-            ulist = y.getUserList(searchDict)
-            # Add resolvername to the list
-            for ue in ulist:
-                ue["resolver"] = resolver_name
-                ue["editable"] = y.updateable
-            log.debug("Found this userlist: {0!r}".format(ulist))
-            users.extend(ulist)
-
-        except KeyError as exx:  # pragma: no cover
-            log.error("{0!r}".format((exx)))
-            log.debug("{0!s}".format(traceback.format_exc()))
-            raise exx
-
-        except Exception as exx:  # pragma: no cover
-            log.error("{0!r}".format((exx)))
-            log.debug("{0!s}".format(traceback.format_exc()))
+    def _search_resolver(y):
+        ulist = y.getUserList(searchDict)
+        # Add editable to the list
+        for ue in ulist:
+            ue["editable"] = y.updateable
+        return ulist
+
+    log.debug("Search the resolvers {0!r} with this search dictionary: "
+              "{1!r}".format(resolvers, searchDict))
+    # The resolvers are searched concurrently. If a resolver fails or
+    # times out, we return the users of the other resolvers.
+    for resolver_name, ulist, exc_info in _call_resolvers(
+            _search_resolver, sorted(set(resolvers))):
+        if exc_info is not None:  # pragma: no cover
+            log.error("{0!r}".format(exc_info[1]))
+            if issubclass(exc_info[0], KeyError):
+                six.reraise(*exc_info)
             continue
+        # Add resolvername to the list
+        for ue in ulist:
+            ue["resolver"] = resolver_name
+        log.debug("Found this userlist: {0!r}".format(ulist))
+        users.extend(ulist)
 
     return users
 
@@ -644,7 +721,29 @@ def get_user_info(userid, resolvername):
     userInfo = {}
     if userid:
         y = get_resolver_object(resolvername)
-        userInfo = y.getUserInfo(userid)
+        with timer("resolver"):
+            userInfo = y.getUserInfo(userid)
+    return userInfo
+
+
+@log_with(log)
+def get_multiple_user_info(userids, resolvername):
+    """
+    return the detailed information for several users in one resolver.
+    The resolver is asked for all users at once.
+
+    :param userids: The ids of the users in the resolver
+    :type userids: list
+    :param resolvername: The name of the resolver
+    :return: a dict with the userid as key and the userinformation as value
+    :rtype: dict
+    """
+    userInfo = {}
+    userids = [userid for userid in set(userids) if userid]
+    if userids:
+        y = get_resolver_object(resolvername)
+        if y:
+            userInfo = y.getMultipleUserInfo(userids)
     return userInfo
 
 
@@ -663,7 +762,8 @@ def get_username(userid, resolvername):
     if userid:
         y = get_resolver_object(resolvername)
         if y:
-            username = y.getUsername(userid)
+            with timer("resolver"):
+                username = y.getUsername(userid)
     return username
    
     
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+#  2016-10-19 One pool of workers per process for the OTP search, the
+#             offline hashes and the resolvers
+#
+#  License:  AGPLv3
+#  contact:  http://www.privacyidea.org
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This module keeps the pools of worker processes and threads of a process.
+
+A pool is created with the first call, that needs it, and is reused by all
+following requests of the process, so that the workers are not forked or
+started per request. The pool is created again,
+ * if the number of workers or the initialization arguments changed or
+ * if the process was forked, since the workers belong to the parent.
+
+This module is tested in tests/test_lib_workerpool.py
+"""
+import logging
+import multiprocessing
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+# The pools of this process by name. Each entry is a dict with the pid of
+# the process, that created the pool, the number of workers, the
+# initialization arguments and the pool.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, workers, pool_class=multiprocessing.Pool,
+             initializer=None, initargs=()):
+    """
+    Return the pool with the given name of this process.
+
+    :param name: The name of the pool, e.g. "otpsearch"
+    :param workers: The number of workers
+    :param pool_class: multiprocessing.Pool or multiprocessing.pool.ThreadPool
+    :param initializer: function, that is called in each new worker
+    :param initargs: tuple of the arguments of the initializer. If the
+        arguments change, the pool is created again.
+    :return: pool object
+    """
+    with _pools_lock:
+        entry = _pools.get(name)
+        if entry is not None and entry.get("pid") == os.getpid():
+            if (entry.get("workers") == workers and
+                    entry.get("initargs") == initargs):
+                return entry.get("pool")
+            # The number of workers or the initialization arguments changed
+            pool = entry.get("pool")
+            pool.close()
+            pool.join()
+        # A pool, that was inherited from the parent process, belongs to
+        # the parent, so we simply forget it.
+        log.debug("Creating the pool {0!s} with {1!s} "
+                  "workers.".format(name, workers))
+        pool = pool_class(workers, initializer, initargs)
+        _pools[name] = {"pid": os.getpid(),
+                        "workers": workers,
+                        "initargs": initargs,
+                        "pool": pool}
+        return pool
+
+
+def terminate_pool(name):
+    """
+    Stop the workers of the pool with the given name immediately, e.g. if
+    the jobs of a request timed out and should not block the pool. The next
+    call of get_pool creates a new pool.
+
+    :param name: The name of the pool
+    """
+    with _pools_lock:
+        entry = _pools.pop(name, None)
+        if entry is not None and entry.get("pid") == os.getpid():
+            pool = entry.get("pool")
+            pool.terminate()
+            pool.join()
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 #
+#  2016-10-19 Keep the original error, if the unit of work can not commit
+#  2016-10-19 Add the unit of work, that commits the changes of tokens
+#             and tokeninfos only once
 #  2016-02-19 Cornelius Kölbel <cornelius@privacyidea.org>
 #             Add radiusserver table
 #  2015-08-27 Cornelius Kölbel <cornelius@privacyidea.org>
@@ -25,6 +28,10 @@
 #
 import binascii
 import logging
+import sys
+import traceback
+import six
+from contextlib import contextmanager
 from datetime import datetime
 from datetime import timedelta
 from json import loads, dumps
@@ -38,6 +45,7 @@ from .lib.crypto import (encrypt,
                          get_rand_digit_str)
 
 from sqlalchemy import and_
+from sqlalchemy.exc import SQLAlchemyError
 from .lib.log import log_with
 log = logging.getLogger(__name__)
 
@@ -45,6 +53,71 @@ implicit_returning = True
 
 db = SQLAlchemy()
 
+# The key in the session info, that marks an active unit of work
+UNIT_OF_WORK = "unit_of_work"
+
+
+def unit_of_work_active():
+    """
+    Return True, if the changes of the session are collected in a unit of
+    work.
+    """
+    return db.session.info.get(UNIT_OF_WORK, False)
+
+
+def _commit_or_flush():
+    """
+    Commit the session or only flush it, if a unit of work is active.
+    """
+    if unit_of_work_active():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Within a unit of work the save and delete methods of the database
+    objects do not commit. All changes are committed in one transaction at
+    the end of the block.
+
+    If the block raises an exception, the changes made so far are committed
+    nevertheless, just as they would have been committed without the unit
+    of work. If this commit fails, the transaction is rolled back and the
+    original exception is raised. If the database itself fails, the
+    transaction is rolled back. A nested unit of work is part of the outer
+    one.
+
+    Token.delete, Token.set_realms and TokenRealm.save also only flush
+    within a unit of work. Other functions, that commit the session
+    directly, end the transaction of the unit of work early.
+    """
+    if unit_of_work_active():
+        yield
+        return
+    db.session.info[UNIT_OF_WORK] = True
+    try:
+        yield
+    except SQLAlchemyError:
+        db.session.info.pop(UNIT_OF_WORK, None)
+        db.session.rollback()
+        raise
+    except Exception:
+        exc_info = sys.exc_info()
+        db.session.info.pop(UNIT_OF_WORK, None)
+        try:
+            db.session.commit()
+        except Exception as exx:
+            # The error of the commit must not hide the original error
+            log.error("Could not commit the unit of work: {0!s}".format(exx))
+            log.debug("{0!s}".format(traceback.format_exc()))
+            db.session.rollback()
+        six.reraise(*exc_info)
+    finally:
+        db.session.info.pop(UNIT_OF_WORK, None)
+    db.session.commit()
+
 
 class MethodsMixin(object):
     """
@@ -54,13 +127,18 @@ class MethodsMixin(object):
     
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        if not unit_of_work_active():
+            db.session.commit()
+        elif self.id is None:
+            # We need the id of the new object
+            db.session.flush()
         return self.id
     
     def delete(self):
         ret = self.id
         db.session.delete(self)
-        db.session.commit()
+        if not unit_of_work_active():
+            db.session.commit()
         return ret
 
 
@@ -182,7 +260,7 @@ class Token(MethodsMixin, db.Model):
                   .filter(TokenInfo.token_id == self.id)\
                   .delete()
         db.session.delete(self)
-        db.session.commit()
+        _commit_or_flush()
         return ret
 
     @staticmethod
@@ -234,7 +312,7 @@ class Token(MethodsMixin, db.Model):
             Tr = TokenRealm(token_id=self.id,
                             realmname=realm)
             db.session.add(Tr)
-        db.session.commit()
+        _commit_or_flush()
         
     def get_realms(self):
         """
@@ -587,7 +665,7 @@ class TokenInfo(MethodsMixin, db.Model):
         if ti is None:
             # create a new one
             db.session.add(self)
-            db.session.commit()
+            _commit_or_flush()
             ret = self.id
         else:
             # update
@@ -597,8 +675,8 @@ class TokenInfo(MethodsMixin, db.Model):
                                                      'Descrip'
                                                      'tion': self.Description,
                                                      'Type': self.Type})
+            _commit_or_flush()
             ret = ti.id
-        db.session.commit()
         return ret
 
 
@@ -999,7 +1077,7 @@ class TokenRealm(MethodsMixin, db.Model):
         if tr is None:
             # create a new one
             db.session.add(self)
-            db.session.commit()
+            _commit_or_flush()
 
         ret = self.id
         return ret
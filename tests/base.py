@@ -31,10 +31,14 @@ class MyTestCase(unittest.TestCase):
     realm3 = "realm3"
     serials = ["SE1", "SE2", "SE3"]
     otpkey = "3132333435363738393031323334353637383930"
+    # A test case can use another database than the testing configuration
+    database_uri = None
 
     @classmethod
     def setUpClass(cls):
         cls.app = create_app('testing', "")
+        if cls.database_uri:
+            cls.app.config["SQLALCHEMY_DATABASE_URI"] = cls.database_uri
         cls.app_context = cls.app.app_context()
         cls.app_context.push()
         db.create_all()
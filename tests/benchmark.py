@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the base class of the benchmarks in
+tests/test_benchmark.py and tests/test_benchmark_primitives.py.
+
+The benchmarks are only run, if PI_BENCHMARK is set. They use their own
+database PI_BENCHMARK_DATABASE_URL (default data-benchmark.sqlite), so that
+they can run next to the functional tests, which use data-test.sqlite.
+
+The results of a benchmark are written as JSON to its result file. If the
+baseline file of the benchmark points to the result file of an earlier run,
+the results are compared to it by the last test test_99_compare_baseline.
+"""
+from __future__ import print_function
+import datetime
+import json
+import logging
+import os
+import unittest
+from .base import MyTestCase
+
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_URL = os.environ.get("PI_BENCHMARK_DATABASE_URL") or \
+    'sqlite:///' + os.path.join(basedir, 'data-benchmark.sqlite')
+
+
+@unittest.skipUnless(os.environ.get("PI_BENCHMARK"),
+                     "The benchmark runs only with PI_BENCHMARK=1")
+class BenchmarkTestCase(MyTestCase):
+    """
+    A benchmark stores its results in the dict ``results`` by the name of
+    the scenario or the primitive.
+    """
+    database_uri = DATABASE_URL
+    # The file, to which the results are written
+    result_file = None
+    # The result file of an earlier run
+    baseline_file = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = {}
+        super(BenchmarkTestCase, cls).setUpClass()
+        # The testing configuration logs on debug level, which would take
+        # most of the time of the benchmark.
+        cls.log_level = logging.getLogger("privacyidea").level
+        logging.getLogger("privacyidea").setLevel(logging.WARNING)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.results and cls.result_file:
+            with open(cls.result_file, "w") as f:
+                json.dump({"date": datetime.datetime.now().isoformat(),
+                           "settings": cls.get_settings(),
+                           "results": cls.results},
+                          f, indent=2, sort_keys=True)
+            print("The results are written to {0!s}".format(cls.result_file))
+        logging.getLogger("privacyidea").setLevel(cls.log_level)
+        super(BenchmarkTestCase, cls).tearDownClass()
+
+    @classmethod
+    def get_settings(cls):
+        """
+        :return: dict of the settings of the benchmark, that are written to
+            the result file
+        """
+        return {"database": cls.app.config.get(
+            "SQLALCHEMY_DATABASE_URI").split(":")[0]}
+
+    def format_comparison(self, name, result, old_result):
+        """
+        :return: the line, that compares the result to the baseline
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def is_worse(self, result, old_result):
+        """
+        :return: True, if the result is worse than the baseline, so that the
+            benchmark fails
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def test_99_compare_baseline(self):
+        if not self.baseline_file:
+            return
+        with open(self.baseline_file) as f:
+            baseline = json.load(f).get("results", {})
+        worse = []
+        for name, result in sorted(self.results.items()):
+            old_result = baseline.get(name)
+            if not old_result:
+                continue
+            print("\n" + self.format_comparison(name, result, old_result),
+                  end="")
+            if self.is_worse(result, old_result):
+                worse.append(name)
+        self.assertEqual(worse, [], "Worse than the baseline: "
+                                    "{0!s}".format(worse))
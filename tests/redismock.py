@@ -135,7 +135,7 @@ class RedisMock(object):
     def start(self):
         import mock
 
-        def unbound_on_Redis(hostname):
+        def unbound_on_Redis(*args, **kwargs):
             self.redis_obj = Redis()
             self.redis_obj.set_data(self.data)
             return self.redis_obj
@@ -0,0 +1,50 @@
+"""
+This file contains the tests for the helper functions in api/lib/utils.py
+"""
+from .base import MyTestCase
+import jwt
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from privacyidea.lib.error import AuthError
+from privacyidea.api.lib import utils
+from privacyidea.api.lib.utils import verify_auth_token
+
+
+class UtilsTestCase(MyTestCase):
+
+    def test_01_verify_auth_token(self):
+        secret = current_app.config.get("SECRET_KEY")
+        token = jwt.encode({"role": "admin",
+                            "username": "admin",
+                            "rights": ["enable"],
+                            "exp": datetime.utcnow() + timedelta(hours=1)},
+                           secret)
+        r = verify_auth_token(token, ["admin"])
+        self.assertEqual(r.get("username"), "admin")
+        self.assertTrue((secret, token) in utils._auth_token_cache)
+
+        # The second call returns the cached claims, which can be modified
+        # without changing the cache
+        r.get("rights").append("disable")
+        r = verify_auth_token(token, ["admin"])
+        self.assertEqual(r.get("rights"), ["enable"])
+
+        # The role is also checked for cached tokens
+        self.assertRaises(AuthError, verify_auth_token, token, ["user"])
+
+        # An expired entry is not used
+        exp, claims = utils._auth_token_cache.get((secret, token))
+        utils._auth_token_cache[(secret, token)] = (time.time() - 1,
+                                                    {"role": "admin",
+                                                     "username": "other"})
+        r = verify_auth_token(token, ["admin"])
+        self.assertEqual(r.get("username"), "admin")
+
+        # A token with a wrong signature is not cached
+        token = jwt.encode({"role": "admin",
+                            "exp": datetime.utcnow() + timedelta(hours=1)},
+                           "wrong secret")
+        self.assertRaises(AuthError, verify_auth_token, token)
+        self.assertFalse((secret, token) in utils._auth_token_cache)
+        self.assertRaises(AuthError, verify_auth_token, None)
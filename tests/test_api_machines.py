@@ -285,6 +285,29 @@ class APIMachinesTestCase(MyTestCase):
             sshkey = result["value"].get("ssh")[0].get("sshkey")
             self.assertTrue(sshkey.startswith("ssh-rsa"), sshkey)
 
+    def test_10b_hosts_auth_items(self):
+        # fetch the auth_items of several machines
+        with self.app.test_request_context(
+                '/machine/authitems/ssh?hostnames=gandalf,pippin',
+                method='GET',
+                headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            result = json.loads(res.data).get("result")
+            self.assertEqual(result["status"], True)
+            value = result.get("value")
+            sshkey = value.get("gandalf").get("ssh")[0].get("sshkey")
+            self.assertTrue(sshkey.startswith("ssh-rsa"), sshkey)
+            self.assertEqual(value.get("pippin"), {})
+
+        # the hostnames are required
+        with self.app.test_request_context(
+                '/machine/authitems',
+                method='GET',
+                headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 400, res)
+
     def test_11_auth_items_luks(self):
         # create TOTP/Yubikey token
         token_obj = init_token({"serial": self.serial3, "type": "totp",
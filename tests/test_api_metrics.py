@@ -0,0 +1,84 @@
+"""
+This file contains the tests for the endpoint /system/metrics in
+api/metrics.py
+"""
+import json
+from .base import MyTestCase
+from privacyidea.lib import metrics
+from privacyidea.lib.metrics import init_app
+from privacyidea.lib.token import init_token, remove_token
+
+
+class APIMetricsTestCase(MyTestCase):
+
+    def tearDown(self):
+        metrics._registry = None
+        self.app.config.pop("PI_METRICS_CLIENTS", None)
+
+    def test_01_metrics(self):
+        # The metrics are not collected
+        with self.app.test_request_context('/system/metrics',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 404)
+
+        init_app(self.app)
+        init_token({"serial": "METRICS1", "type": "spass", "pin": "test"})
+        with self.app.test_request_context('/validate/check',
+                                           method='POST',
+                                           data={"serial": "METRICS1",
+                                                 "pass": "test"}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            result = json.loads(res.data).get("result")
+            self.assertTrue(result.get("value"))
+
+        with self.app.test_request_context('/token/',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+
+        # Without authorization the metrics can not be read
+        with self.app.test_request_context('/system/metrics',
+                                           method='GET'):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 401)
+
+        with self.app.test_request_context('/system/metrics',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            self.assertTrue(res.content_type.startswith("text/plain"))
+            text = res.data
+            self.assertTrue('privacyidea_requests_total{endpoint='
+                            '"/validate/check",method="POST",status="200"} 1'
+                            in text, text)
+            self.assertTrue('privacyidea_requests_total{endpoint="/token/",'
+                            'method="GET",status="200"} 1' in text, text)
+            self.assertTrue('privacyidea_request_duration_seconds_count{'
+                            'endpoint="/validate/check",method="POST"} 1'
+                            in text, text)
+            for operation in ["audit", "policy", "hsm"]:
+                self.assertTrue('privacyidea_operation_duration_seconds_'
+                                'count{{operation="{0!s}"}}'.format(operation)
+                                in text, text)
+
+        # The clients in PI_METRICS_CLIENTS do not need to authenticate
+        self.app.config["PI_METRICS_CLIENTS"] = ["10.0.0.0/24"]
+        with self.app.test_request_context('/system/metrics',
+                                           method='GET',
+                                           environ_base={"REMOTE_ADDR":
+                                                             "10.0.0.12"}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+        with self.app.test_request_context('/system/metrics',
+                                           method='GET',
+                                           environ_base={"REMOTE_ADDR":
+                                                             "10.0.1.12"}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 401)
+
+        remove_token("METRICS1")
@@ -9,6 +9,7 @@ from privacyidea.lib.user import User
 from privacyidea.lib.caconnector import save_caconnector
 from urllib import urlencode
 from privacyidea.lib.token import check_serial_pass
+from privacyidea.lib.importotp import parsePSKCdata, parseOATHcsv
 
 PWFILE = "tests/testdata/passwords"
 IMPORTFILE = "tests/testdata/import.oath"
@@ -189,6 +190,33 @@ class APITokenTestCase(MyTestCase):
             self.assertTrue("username" in res.data, res.data)
             self.assertTrue("user_realm" in res.data, res.data)
 
+    def test_02b_export_tokens_csv(self):
+        with self.app.test_request_context('/token/export',
+                                           method='GET',
+                                           query_string=urlencode(
+                                               {"columns": "serial,"
+                                                           "tokentype,"
+                                                           "username",
+                                                "chunksize": 1}),
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            lines = res.data.strip().splitlines()
+            self.assertEqual(lines[0],
+                             "'serial', 'tokentype', 'username', ")
+            self.assertEqual(len(lines), 2)
+            self.assertTrue("'hotp', " in lines[1], lines[1])
+            self.assertFalse("otpkey" in res.data, res.data)
+
+        # unknown columns
+        with self.app.test_request_context('/token/export',
+                                           method='GET',
+                                           query_string=urlencode(
+                                               {"columns": "serial,otpkey"}),
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 400, res)
+
     def test_03_list_tokens_in_one_realm(self):
         for serial in ["S1", "S2", "S3", "S4"]:
              with self.app.test_request_context('/token/init',
@@ -1181,3 +1209,160 @@ class APITokenTestCase(MyTestCase):
             self.assertTrue(ti.startswith(ndate))
 
         delete_policy("firstuse")
+
+    def test_24_bulk_token_actions(self):
+        for serial in ["BULK1", "BULK2"]:
+            init_token({"serial": serial, "type": "spass"},
+                       tokenrealms=[self.realm1])
+        init_token({"serial": "BULK3", "type": "spass"})
+
+        with self.app.test_request_context('/token/bulk/disable',
+                                           method='POST',
+                                           data={"serials": "BULK1,BULK2,"
+                                                            "BULK3,BULK4"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            result = json.loads(res.data).get("result")
+            detail = json.loads(res.data).get("detail")
+            self.assertEqual(result.get("value"), 3)
+            self.assertEqual(detail.get("skipped"), {"BULK4": "not found"})
+        self.assertFalse(get_tokens(serial="BULK1")[0].token.active)
+
+        # unknown action
+        with self.app.test_request_context('/token/bulk/delete',
+                                           method='POST',
+                                           data={"serial": "BULK*"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 400, res)
+
+        # The admin may not enable the tokens in realm1
+        set_policy("bulkadmin", scope=SCOPE.ADMIN, action="enable",
+                   realm="otherrealm")
+        with self.app.test_request_context('/token/bulk/enable',
+                                           method='POST',
+                                           data={"serial": "BULK*"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            result = json.loads(res.data).get("result")
+            detail = json.loads(res.data).get("detail")
+            self.assertEqual(result.get("value"), 1)
+            self.assertEqual(detail.get("skipped"),
+                             {"BULK1": "not allowed",
+                              "BULK2": "not allowed"})
+        delete_policy("bulkadmin")
+
+        # Only one more token may be assigned to the user
+        count = get_tokens(user=User("cornelius", self.realm1), count=True)
+        set_policy("bulkmax", scope=SCOPE.ENROLL,
+                   action="{0!s}={1:d}".format(ACTION.MAXTOKENUSER,
+                                               count + 1))
+        with self.app.test_request_context('/token/bulk/assign',
+                                           method='POST',
+                                           data={"serials": "BULK1,BULK2",
+                                                 "user": "cornelius",
+                                                 "realm": self.realm1},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            detail = json.loads(res.data).get("detail")
+            self.assertEqual(detail.get("changed"), ["BULK1"])
+            self.assertEqual(detail.get("skipped"), {"BULK2": "limit"})
+        delete_policy("bulkmax")
+
+        with self.app.test_request_context('/token/bulk/realm',
+                                           method='POST',
+                                           data={"type": "spass",
+                                                 "tokenrealm": self.realm1,
+                                                 "realms": self.realm2},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            result = json.loads(res.data).get("result")
+            self.assertEqual(result.get("value"), 2)
+
+        for serial in ["BULK1", "BULK2", "BULK3"]:
+            remove_token(serial)
+
+    def test_25_bulk_init_tokens(self):
+        psk = "12345678901234567890123456789012"
+        with self.app.test_request_context('/token/bulk/init',
+                                           method='POST',
+                                           data={"count": 3,
+                                                 "type": "totp",
+                                                 "prefix": "BINIT",
+                                                 "tokenrealms": self.realm1,
+                                                 "timeStep": 60,
+                                                 "chunksize": 2,
+                                                 "psk": psk},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            tokens = parsePSKCdata(res.data, preshared_key_hex=psk)
+        self.assertEqual(len(tokens), 3)
+        for serial, token in tokens.items():
+            self.assertTrue(serial.startswith("BINIT"), serial)
+            self.assertEqual(token.get("type"), "totp")
+            self.assertEqual(token.get("timeStep"), "60")
+            db_token = get_tokens(serial=serial)[0]
+            self.assertEqual(db_token.get_realms(), [self.realm1])
+            self.assertEqual(db_token.token.get_otpkey().getKey(),
+                             token.get("otpkey"))
+
+        with self.app.test_request_context('/token/bulk/init',
+                                           method='POST',
+                                           data={"count": 2,
+                                                 "prefix": "BINIT",
+                                                 "outform": "csv"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            tokens = parseOATHcsv(res.data)
+        self.assertEqual(len(tokens), 2)
+        self.assertEqual(tokens.values()[0].get("type"), "hotp")
+
+        # A PSKC file needs a valid pre shared key, no token is created
+        with self.app.test_request_context('/token/bulk/init',
+                                           method='POST',
+                                           data={"count": 2,
+                                                 "prefix": "BINIT",
+                                                 "psk": "1234"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 400, res)
+        self.assertEqual(len(get_tokens(serial="BINIT*")), 5)
+
+        # The admin may not enroll TOTP tokens
+        set_policy("bulkadmin", scope=SCOPE.ADMIN, action="enrollHOTP")
+        with self.app.test_request_context('/token/bulk/init',
+                                           method='POST',
+                                           data={"count": 2,
+                                                 "type": "totp",
+                                                 "prefix": "BINIT",
+                                                 "psk": psk},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 403, res)
+        delete_policy("bulkadmin")
+
+        # Too many tokens in the realm
+        count = get_tokens(realm=self.realm1, count=True)
+        set_policy("bulkmax", scope=SCOPE.ENROLL,
+                   action="{0!s}={1:d}".format(ACTION.MAXTOKENREALM,
+                                               count + 1))
+        with self.app.test_request_context('/token/bulk/init',
+                                           method='POST',
+                                           data={"count": 2,
+                                                 "prefix": "BINIT",
+                                                 "tokenrealms": self.realm1,
+                                                 "psk": psk},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 403, res)
+        delete_policy("bulkmax")
+        self.assertEqual(len(get_tokens(serial="BINIT*")), 5)
+
+        for token in get_tokens(serial="BINIT*"):
+            remove_token(token.token.serial)
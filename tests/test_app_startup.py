@@ -0,0 +1,55 @@
+"""
+This file tests the startup of the application in privacyidea/app.py
+
+The application is created in a new python process, so that the modules,
+which were already imported by other tests, do not count.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import unittest
+
+log = logging.getLogger(__name__)
+
+# These modules take long to import and use a lot of memory. They are only
+# needed for statistics and token import, so the workers must not import
+# them at startup.
+HEAVY_MODULES = ["matplotlib", "pandas", "numpy", "bs4", "lxml", "gnupg",
+                 "passlib.utils.pbkdf2"]
+
+STARTUP_SCRIPT = """
+import json
+import resource
+import sys
+import time
+start = time.time()
+from privacyidea.app import create_app
+app = create_app("testing", "", silent=True)
+seconds = time.time() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": seconds, "maxrss": rss,
+                  "modules": sorted(sys.modules)}))
+"""
+
+
+class AppStartupTestCase(unittest.TestCase):
+
+    def test_01_no_heavy_imports(self):
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(
+            __file__)))
+        p = subprocess.Popen([sys.executable, "-c", STARTUP_SCRIPT],
+                             cwd=base_dir, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        stdout, stderr = p.communicate()
+        self.assertEqual(p.returncode, 0, stderr)
+        report = json.loads(stdout.strip().splitlines()[-1])
+        log.info("Startup of the application took {0:.3f} seconds, "
+                 "max RSS {1!s} kB, {2!s} modules".format(
+                     report.get("seconds"), report.get("maxrss"),
+                     len(report.get("modules"))))
+
+        heavy = [module for module in HEAVY_MODULES
+                 if module in report.get("modules")]
+        self.assertEqual(heavy, [], "create_app imports {0!s}".format(heavy))
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the end-to-end benchmark of /validate/check, of the token
+list /token/ and of the audit search /audit/.
+
+The benchmark is not run with the functional tests. Run it like this:
+
+    PI_BENCHMARK=1 python -m pytest -s tests/test_benchmark.py
+
+The benchmark creates PI_BENCHMARK_USERS users (default 50) in an LDAP
+resolver and PI_BENCHMARK_TOKENS tokens (default 100) of the types HOTP,
+TOTP, SMS, email, Yubikey and RADIUS. The LDAP server, the RADIUS server and
+the SMTP server are replaced by tests/ldap3mock.py, tests/radiusmock.py and
+tests/smtpmock.py. Each token authenticates PI_BENCHMARK_ROUNDS times
+(default 2, at most 5, since a TOTP value is only valid within the time
+window).
+
+The benchmark needs its own database, since it can not share the database
+data-test.sqlite with the functional tests. It is defined by
+PI_BENCHMARK_DATABASE_URL (default data-benchmark.sqlite). See
+tests/benchmark.py.
+
+For each scenario the throughput, the 50th and the 99th percentile of the
+latency and the number of SQL queries per request are printed and written
+as JSON to the file PI_BENCHMARK_RESULT (default benchmark.json). If
+PI_BENCHMARK_BASELINE points to the result file of an earlier run, the
+results are compared to it. The benchmark fails, if a scenario needs more
+SQL queries per request than in the baseline. The latencies depend on the
+machine and are only printed.
+"""
+from __future__ import print_function
+import binascii
+import json
+import logging
+import math
+import os
+import struct
+import time
+from Crypto.Cipher import AES
+from . import benchmark
+import ldap3mock
+import radiusmock
+import smtpmock
+from privacyidea.lib.audit import getAudit
+from privacyidea.lib.auditmodules.sqlaudit import LogEntry
+from privacyidea.lib.config import set_privacyidea_config
+from privacyidea.lib.realm import set_realm
+from privacyidea.lib.resolver import save_resolver
+from privacyidea.lib.token import init_token
+from privacyidea.lib.tokens.HMAC import HmacOtp
+from privacyidea.lib.user import User
+from privacyidea.lib.utils import modhex_encode, checksum
+from privacyidea.lib.sqlstats import init_app as init_sql_stats
+
+log = logging.getLogger(__name__)
+
+USERS = int(os.environ.get("PI_BENCHMARK_USERS", 50))
+TOKENS = int(os.environ.get("PI_BENCHMARK_TOKENS", 100))
+ROUNDS = min(int(os.environ.get("PI_BENCHMARK_ROUNDS", 2)), 5)
+RESULT_FILE = os.environ.get("PI_BENCHMARK_RESULT", "benchmark.json")
+BASELINE_FILE = os.environ.get("PI_BENCHMARK_BASELINE")
+
+TOKEN_TYPES = ["hotp", "totp", "sms", "email", "yubikey", "radius"]
+REALM = "benchmark"
+RESOLVER = "benchmark-ldap"
+EMAIL = "benchmark@example.com"
+DICT_FILE = "tests/testdata/dictionary"
+OTPKEY = "3132333435363738393031323334353637383930"
+YUBIKEY_AES_KEY = "9163508031b20d2fbb1868954e041729"
+
+
+def _ldap_directory(users):
+    directory = [{"dn": "cn=manager,ou=example,o=test",
+                  "attributes": {"cn": "manager",
+                                 "userPassword": "ldaptest"}}]
+    for i in range(users):
+        name = "user{0:05d}".format(i)
+        directory.append({"dn": "cn={0!s},ou=example,o=test".format(name),
+                          "attributes": {"cn": name,
+                                         "sn": "Benchmark",
+                                         "givenName": name,
+                                         "email": EMAIL,
+                                         "mobile": "0123456789",
+                                         "userPassword": name,
+                                         "oid": str(1000 + i)}})
+    return directory
+
+
+def _otpkey(i):
+    return "{0:040x}".format(int(OTPKEY, 16) + i)
+
+
+def _yubikey_otp(uid, counter):
+    """
+    Create a Yubikey OTP value for the private uid and the counter
+    """
+    msg = binascii.unhexlify(uid)
+    # usage counter, timestamp, session counter and random
+    msg += struct.pack("<H", 1) + "\x00\x00\x00" + struct.pack("B", counter)
+    msg += os.urandom(2)
+    crc = ~checksum(binascii.hexlify(msg)) & 0xffff
+    msg += struct.pack("<H", crc)
+    cipher = AES.new(binascii.unhexlify(YUBIKEY_AES_KEY), AES.MODE_ECB)
+    return modhex_encode(cipher.encrypt(msg))
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def _summary(latencies, queries, successes, seconds):
+    return {"requests": len(latencies),
+            "successes": successes,
+            "throughput": len(latencies) / seconds if seconds else 0,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+            "queries_per_request": float(sum(queries)) / len(queries)}
+
+
+class EndToEndBenchmarkTestCase(benchmark.BenchmarkTestCase):
+
+    result_file = RESULT_FILE
+    baseline_file = BASELINE_FILE
+
+    @classmethod
+    def setUpClass(cls):
+        super(EndToEndBenchmarkTestCase, cls).setUpClass()
+        # The number of queries is returned in the header X-PI-SQL-Queries
+        init_sql_stats(cls.app)
+        cls.tokens = []
+        # The audit table is not dropped with the other tables. The audit
+        # search must not depend on the entries of earlier runs.
+        audit = getAudit(cls.app.config)
+        audit.session.query(LogEntry).delete()
+        audit.session.commit()
+        audit.session.close()
+
+    @classmethod
+    def get_settings(cls):
+        settings = super(EndToEndBenchmarkTestCase, cls).get_settings()
+        settings.update({"users": USERS, "tokens": TOKENS, "rounds": ROUNDS})
+        return settings
+
+    def format_comparison(self, name, result, old_result):
+        return ("{0!s}: p50 {1:.1f} ms (baseline {2:.1f} ms), p99 {3:.1f} ms "
+                "(baseline {4:.1f} ms), {5:.1f} queries/request (baseline "
+                "{6:.1f})".format(name, result.get("p50_ms"),
+                                  old_result.get("p50_ms"),
+                                  result.get("p99_ms"),
+                                  old_result.get("p99_ms"),
+                                  result.get("queries_per_request"),
+                                  old_result.get("queries_per_request")))
+
+    def is_worse(self, result, old_result):
+        # The latencies depend on the machine, the number of queries does not
+        return result.get("queries_per_request") > old_result.get(
+            "queries_per_request") + 0.05
+
+    def _request(self, url, method="GET", data=None, headers=None):
+        """
+        Send a request and return the response, the latency and the number
+        of SQL queries.
+        """
+        with self.app.test_request_context(url, method=method, data=data,
+                                           headers=headers or {}):
+            start = time.time()
+            res = self.app.full_dispatch_request()
+            latency = time.time() - start
+        self.assertTrue(res.status_code == 200, res.data)
+        return (json.loads(res.data), latency,
+                int(res.headers.get("X-PI-SQL-Queries", 0)))
+
+    def _run(self, scenario, requests):
+        """
+        Send the requests of the scenario and store the results.
+
+        :param scenario: The name of the scenario
+        :param requests: list of tuples (url, method, data, headers, check).
+            check is a function, that takes the JSON response and returns
+            True, if the request was successful.
+        """
+        latencies = []
+        queries = []
+        successes = 0
+        start = time.time()
+        for url, method, data, headers, check in requests:
+            response, latency, query_count = self._request(url, method,
+                                                           data, headers)
+            latencies.append(latency)
+            queries.append(query_count)
+            if check(response):
+                successes += 1
+        seconds = time.time() - start
+        result = _summary(latencies, queries, successes, seconds)
+        self.results[scenario] = result
+        print("\n{0!s}: {1:d} requests, {2:d} successful, {3:.1f} requests/s, "
+              "p50 {4:.1f} ms, p99 {5:.1f} ms, {6:.1f} queries/request".format(
+                  scenario, result.get("requests"), result.get("successes"),
+                  result.get("throughput"), result.get("p50_ms"),
+                  result.get("p99_ms"), result.get("queries_per_request")))
+        return result
+
+    @ldap3mock.activate
+    def test_00_setup(self):
+        ldap3mock.setLDAPDirectory(_ldap_directory(USERS))
+        rid = save_resolver({"resolver": RESOLVER,
+                             "type": "ldapresolver",
+                             "LDAPURI": "ldap://localhost",
+                             "LDAPBASE": "o=test",
+                             "BINDDN": "cn=manager,ou=example,o=test",
+                             "BINDPW": "ldaptest",
+                             "LOGINNAMEATTRIBUTE": "cn",
+                             "LDAPSEARCHFILTER": "(cn=*)",
+                             "LDAPFILTER": "(&(cn=%s))",
+                             "USERINFO": '{ "username": "cn", '
+                                         '"mobile" : "mobile", '
+                                         '"email" : "email", '
+                                         '"surname" : "sn", '
+                                         '"givenname" : "givenName" }',
+                             "UIDTYPE": "DN",
+                             "CACHE_TIMEOUT": 120})
+        self.assertTrue(rid > 0, rid)
+        (added, failed) = set_realm(REALM, [RESOLVER])
+        self.assertEqual(len(failed), 0)
+        set_privacyidea_config("email.mailserver", "localhost")
+        set_privacyidea_config("email.mailfrom", "privacyidea@example.com")
+        set_privacyidea_config("radius.dictfile", DICT_FILE)
+
+        start = time.time()
+        for i in range(TOKENS):
+            tokentype = TOKEN_TYPES[i % len(TOKEN_TYPES)]
+            serial = "BENCH{0:06d}".format(i)
+            user = User("user{0:05d}".format(i % USERS), REALM)
+            pin = "pin{0:d}".format(i)
+            param = {"serial": serial, "type": tokentype, "pin": pin}
+            if tokentype == "yubikey":
+                param["otpkey"] = YUBIKEY_AES_KEY
+                param["otplen"] = 44
+            elif tokentype == "radius":
+                param.update({"radius.server": "localhost:1812",
+                              "radius.secret": "testing123",
+                              "radius.user": user.login,
+                              "radius.local_checkpin": True})
+            else:
+                param["otpkey"] = _otpkey(i)
+            if tokentype == "sms":
+                param["phone"] = "0123456789"
+            elif tokentype == "email":
+                param["email"] = EMAIL
+            init_token(param, user=user)
+            self.tokens.append((serial, tokentype, user.login, pin, i))
+        print("\nCreated {0:d} users and {1:d} tokens in {2:.1f} "
+              "seconds".format(USERS, TOKENS, time.time() - start))
+
+    def _get_pass(self, tokentype, pin, i, counter):
+        if tokentype == "yubikey":
+            # The uid of the first OTP is stored as the tokenid
+            uid = "{0:012x}".format(i)
+            prefix = modhex_encode("{0:06d}".format(i))
+            return pin + prefix + _yubikey_otp(uid, counter + 1)
+        elif tokentype == "radius":
+            # The RADIUS server is mocked and accepts any OTP value
+            return pin + "123456"
+        elif tokentype == "totp":
+            counter += int(time.time() / 30)
+        return pin + HmacOtp(digits=6).generate(
+            counter=counter, key=binascii.unhexlify(_otpkey(i)))
+
+    @ldap3mock.activate
+    @radiusmock.activate
+    def test_01_validate_check(self):
+        ldap3mock.setLDAPDirectory(_ldap_directory(USERS))
+        radiusmock.setdata(success=True)
+        requests = []
+        for counter in range(ROUNDS):
+            for serial, tokentype, login, pin, i in self.tokens:
+                requests.append(("/validate/check", "POST",
+                                 {"user": login, "realm": REALM,
+                                  "pass": self._get_pass(tokentype, pin, i,
+                                                         counter)},
+                                 None,
+                                 lambda r: r.get("result").get("value")))
+        result = self._run("validate_check", requests)
+        self.assertEqual(result.get("successes"), result.get("requests"))
+
+    @ldap3mock.activate
+    @smtpmock.activate
+    def test_02_validate_check_challenge(self):
+        ldap3mock.setLDAPDirectory(_ldap_directory(USERS))
+        smtpmock.setdata(response={EMAIL: (200, "OK")})
+        requests = []
+        for serial, tokentype, login, pin, i in self.tokens:
+            if tokentype == "email":
+                requests.append(("/validate/check", "POST",
+                                 {"user": login, "realm": REALM,
+                                  "pass": pin},
+                                 None,
+                                 lambda r: "transaction_id" in r.get(
+                                     "detail", {})))
+        result = self._run("validate_check_challenge", requests)
+        self.assertEqual(result.get("successes"), result.get("requests"))
+
+    @ldap3mock.activate
+    def test_03_token_list(self):
+        ldap3mock.setLDAPDirectory(_ldap_directory(USERS))
+        requests = []
+        pages = int(math.ceil(TOKENS / 15.0))
+        for counter in range(ROUNDS):
+            for page in range(1, pages + 1):
+                requests.append(("/token/?page={0:d}".format(page), "GET",
+                                 None, {"Authorization": self.at},
+                                 lambda r: r.get("result").get("status")))
+            for serial, tokentype, login, pin, i in self.tokens[:USERS]:
+                requests.append(("/token/?user={0!s}&realm={1!s}".format(
+                    login, REALM), "GET", None, {"Authorization": self.at},
+                    lambda r: r.get("result").get("value").get("count")))
+        self._run("token_list", requests)
+
+    def test_04_audit_search(self):
+        requests = []
+        for counter in range(ROUNDS):
+            for page in range(1, 11):
+                requests.append(("/audit/?page={0:d}".format(page), "GET",
+                                 None, {"Authorization": self.at},
+                                 lambda r: r.get("result").get("status")))
+            for serial, tokentype, login, pin, i in self.tokens[:50]:
+                requests.append(("/audit/?serial={0!s}".format(serial),
+                                 "GET", None, {"Authorization": self.at},
+                                 lambda r: r.get("result").get("value").get(
+                                     "count")))
+        self._run("audit_search", requests)
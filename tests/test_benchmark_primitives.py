@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the micro-benchmarks of the OTP, PIN and crypto
+primitives.
+
+The benchmarks are not run with the functional tests. Run them like this:
+
+    PI_BENCHMARK=1 python -m pytest -s tests/test_benchmark_primitives.py
+
+Each primitive is called repeatedly for PI_BENCHMARK_SECONDS seconds
+(default 0.5). The operations per second are printed and written as JSON to
+the file PI_BENCHMARK_PRIMITIVES_RESULT (default
+benchmark-primitives.json).
+
+If PI_BENCHMARK_PRIMITIVES_BASELINE points to the result file of an earlier
+run, the results are compared to it. With PI_BENCHMARK_TOLERANCE (e.g. 0.3)
+the benchmark fails, if a primitive is slower than the baseline by more than
+this fraction. Without it the comparison is only printed, since the numbers
+depend on the machine.
+
+Like the end-to-end benchmark it uses its own database, see
+tests/benchmark.py.
+"""
+from __future__ import print_function
+import binascii
+import logging
+import os
+import struct
+import time
+from Crypto.Cipher import AES
+from . import benchmark
+from privacyidea.lib.crypto import (encrypt, decrypt, encryptPassword,
+                                    decryptPassword, Sign, hash_with_pepper,
+                                    verify_with_pepper, geturandom)
+from privacyidea.lib.token import init_token, get_tokens, remove_token
+from privacyidea.lib.tokens.HMAC import HmacOtp
+from privacyidea.lib.tokens.ocra import OCRA
+from privacyidea.lib.utils import modhex_encode, checksum
+
+log = logging.getLogger(__name__)
+
+SECONDS = float(os.environ.get("PI_BENCHMARK_SECONDS", 0.5))
+RESULT_FILE = os.environ.get("PI_BENCHMARK_PRIMITIVES_RESULT",
+                             "benchmark-primitives.json")
+BASELINE_FILE = os.environ.get("PI_BENCHMARK_PRIMITIVES_BASELINE")
+TOLERANCE = float(os.environ.get("PI_BENCHMARK_TOLERANCE", 0))
+
+OTPKEY = "3132333435363738393031323334353637383930"
+KEY32 = "3132333435363738393031323334353637383930313233343536373839303132"
+YUBIKEY_AES_KEY = "9163508031b20d2fbb1868954e041729"
+YUBIKEY_UID = "0a0b0c0d0e0f"
+HOTP_WINDOWS = [10, 100, 1000]
+# The TOTP window is given in seconds
+TOTP_WINDOWS = [30, 180, 600]
+OCRA_SUITES = ["OCRA-1:HOTP-SHA1-6:QN08",
+               "OCRA-1:HOTP-SHA256-8:C-QN08-PSHA1",
+               "OCRA-1:HOTP-SHA512-8:C-QN08"]
+
+
+def _measure(function):
+    """
+    Call the function for SECONDS seconds and return the operations per
+    second.
+    """
+    count = 0
+    start = time.time()
+    end = start + SECONDS
+    while True:
+        function()
+        count += 1
+        now = time.time()
+        if now >= end:
+            break
+    return count / (now - start)
+
+
+def _yubikey_otp():
+    msg = binascii.unhexlify(YUBIKEY_UID)
+    msg += struct.pack("<H", 1) + "\x00\x00\x00" + struct.pack("B", 1)
+    msg += "\x00\x00"
+    msg += struct.pack("<H", ~checksum(binascii.hexlify(msg)) & 0xffff)
+    cipher = AES.new(binascii.unhexlify(YUBIKEY_AES_KEY), AES.MODE_ECB)
+    return modhex_encode("prefix") + modhex_encode(cipher.encrypt(msg))
+
+
+class PrimitivesBenchmarkTestCase(benchmark.BenchmarkTestCase):
+
+    result_file = RESULT_FILE
+    baseline_file = BASELINE_FILE
+
+    @classmethod
+    def get_settings(cls):
+        settings = super(PrimitivesBenchmarkTestCase, cls).get_settings()
+        settings["seconds"] = SECONDS
+        return settings
+
+    def format_comparison(self, name, result, old_result):
+        return ("{0!s}: {1:.1f} ops/s (baseline {2:.1f} ops/s, "
+                "{3:+.0%})".format(name, result, old_result,
+                                   result / old_result - 1))
+
+    def is_worse(self, result, old_result):
+        # Without a tolerance the comparison is only printed
+        return bool(TOLERANCE) and result < old_result * (1 - TOLERANCE)
+
+    def _benchmark(self, name, function):
+        ops = _measure(function)
+        self.results[name] = ops
+        print("\n{0!s}: {1:.1f} ops/s".format(name, ops), end="")
+        return ops
+
+    def test_01_hmacotp(self):
+        key = binascii.unhexlify(OTPKEY)
+        self._benchmark("HmacOtp.generate",
+                        lambda: HmacOtp(digits=6).generate(counter=1,
+                                                           key=key))
+        token = init_token({"serial": "BENCHHOTP", "otpkey": OTPKEY})
+        secret = token.token.get_otpkey()
+        # The key is decrypted by the security module for each OTP value
+        self._benchmark("HmacOtp.generate[encrypted key]",
+                        lambda: HmacOtp(secret, digits=6).generate(
+                            counter=1))
+        for window in HOTP_WINDOWS:
+            # A wrong OTP value checks the whole window
+            self._benchmark("HmacOtp.checkOtp[window={0:d}]".format(window),
+                            lambda: HmacOtp(secret, 0, 6).checkOtp(
+                                "000000", window))
+        remove_token("BENCHHOTP")
+
+    def test_02_totp(self):
+        for window in TOTP_WINDOWS:
+            init_token({"serial": "BENCHTOTP", "type": "totp",
+                        "otpkey": OTPKEY, "timeWindow": window})
+            token = get_tokens(serial="BENCHTOTP")[0]
+            self._benchmark("TotpTokenClass.check_otp[window={0:d}s]".format(
+                window), lambda: token.check_otp("000000"))
+            remove_token("BENCHTOTP")
+
+    def test_03_yubikey(self):
+        init_token({"serial": "BENCHYUBI", "type": "yubikey",
+                    "otpkey": YUBIKEY_AES_KEY, "otplen": 44})
+        token = get_tokens(serial="BENCHYUBI")[0]
+        otp = _yubikey_otp()
+        self.assertTrue(token.check_otp(otp) > 0)
+        # The OTP value is decrypted and verified, but the counter is too
+        # low after the first call.
+        self._benchmark("YubikeyTokenClass.check_otp",
+                        lambda: token.check_otp(otp))
+        remove_token("BENCHYUBI")
+
+    def test_04_ocra(self):
+        key = binascii.unhexlify(KEY32)
+        for ocrasuite in OCRA_SUITES:
+            ocra = OCRA(ocrasuite, key)
+            self._benchmark("OCRA.get_response[{0!s}]".format(ocrasuite),
+                            lambda: ocra.get_response("12345678", pin="1234",
+                                                      counter=1))
+
+    def test_05_check_pin(self):
+        token = init_token({"serial": "BENCHPIN", "otpkey": OTPKEY,
+                            "pin": "test"})
+        self._benchmark("Token.check_pin[hashed]",
+                        lambda: token.token.check_pin("test"))
+        token.token.set_pin("test", hashed=False)
+        self.assertTrue(token.token.check_pin("test"))
+        self._benchmark("Token.check_pin[encrypted]",
+                        lambda: token.token.check_pin("test"))
+        remove_token("BENCHPIN")
+
+    def test_06_security_module(self):
+        data = geturandom(32)
+        iv = geturandom(16)
+        crypted = encrypt(data, iv)
+        self._benchmark("encrypt", lambda: encrypt(data, iv))
+        self._benchmark("decrypt", lambda: decrypt(crypted, iv))
+        crypted_password = encryptPassword("password")
+        self._benchmark("encryptPassword",
+                        lambda: encryptPassword("password"))
+        self._benchmark("decryptPassword",
+                        lambda: decryptPassword(crypted_password))
+
+    def test_07_sign(self):
+        sign_object = Sign("tests/testdata/private.pem",
+                           "tests/testdata/public.pem")
+        message = "x" * 1000
+        signature = sign_object.sign(message)
+        self._benchmark("Sign.sign", lambda: sign_object.sign(message))
+        self._benchmark("Sign.verify",
+                        lambda: sign_object.verify(message, signature))
+
+    def test_08_pepper(self):
+        password_hash = hash_with_pepper("password")
+        self._benchmark("hash_with_pepper",
+                        lambda: hash_with_pepper("password"))
+        self._benchmark("verify_with_pepper",
+                        lambda: verify_with_pepper(password_hash,
+                                                   "password"))
@@ -11,8 +11,10 @@ from privacyidea.models import (Token,
                                 CAConnector, CAConnectorConfig, SMTPServer,
                                 PasswordReset, EventHandlerOption,
                                 EventHandler, SMSGatewayOption, SMSGateway,
-                                EventHandlerCondition)
+                                EventHandlerCondition, TokenInfo, db,
+                                unit_of_work, unit_of_work_active)
 from .base import MyTestCase
+from sqlalchemy import event
 from datetime import datetime
 from datetime import timedelta
 
@@ -585,3 +587,62 @@ class TokenModelTestCase(MyTestCase):
 
         # Delete gateway
         gw.delete()
+
+    def test_21_unit_of_work(self):
+        commits = []
+
+        def count_commit(session):
+            commits.append(session)
+
+        session = db.session()
+        event.listen(session, "after_commit", count_commit)
+        try:
+            with unit_of_work():
+                self.assertTrue(unit_of_work_active())
+                t1 = Token("serialUOW")
+                # The new token gets its id without a commit
+                self.assertTrue(t1.save())
+                t1.set_info({"key1": "value1"})
+                t1.set_info({"key1": "value2"})
+                t1.count = 5
+                t1.save()
+                # nested units of work are part of the outer one
+                with unit_of_work():
+                    t1.failcount = 3
+                    t1.save()
+                self.assertEqual(commits, [])
+            self.assertFalse(unit_of_work_active())
+            self.assertEqual(len(commits), 1)
+
+            # On an exception the changes made so far are committed
+            def fail():
+                with unit_of_work():
+                    t1.count = 6
+                    t1.save()
+                    TokenInfo.query.filter_by(token_id=t1.id).first().delete()
+                    raise Exception("fail")
+            self.assertRaises(Exception, fail)
+            self.assertEqual(len(commits), 2)
+        finally:
+            event.remove(session, "after_commit", count_commit)
+
+        db.session.expire_all()
+        t2 = Token.query.filter_by(serial="serialUOW").first()
+        self.assertEqual(t2.count, 6)
+        self.assertEqual(t2.failcount, 3)
+        self.assertEqual(t2.get_info(), {})
+
+        # If the commit fails, the original exception is raised
+        def fail_commit():
+            with unit_of_work():
+                db.session.add(Token("serialUOW"))
+                raise ValueError("original")
+        self.assertRaises(ValueError, fail_commit)
+        self.assertFalse(unit_of_work_active())
+        self.assertEqual(Token.query.filter_by(serial="serialUOW").count(), 1)
+
+        # Deleting a token only flushes within a unit of work
+        with unit_of_work():
+            t2.delete()
+            self.assertEqual(Token.query.filter_by(
+                serial="serialUOW").count(), 0)
@@ -10,7 +10,9 @@ from privacyidea.lib.applications.ssh import (MachineApplication as
 from privacyidea.lib.applications.luks import (MachineApplication as
                                                LUKSApplication)
 from privacyidea.lib.applications.offline import (MachineApplication as
-                                                  OfflineApplication)
+                                                  OfflineApplication,
+                                                  hash_otp_values, POOL_NAME)
+from privacyidea.lib import workerpool
 from privacyidea.lib.applications import (get_auth_item,
                                           is_application_allow_bulk_call,
                                           get_application_types)
@@ -124,6 +126,44 @@ class OfflineApplicationTestCase(MyTestCase):
         tok = get_tokens(serial=serial)[0]
         self.assertEqual(tok.token.count, 101)
 
+        # The counter is set to the end of the first range, so the next
+        # calls issue the same OTP values. Their hashes are cached.
+        auth_item = OfflineApplication.get_authentication_item("hotp", serial)
+        auth_item2 = OfflineApplication.get_authentication_item("hotp",
+                                                                serial)
+        self.assertEqual(auth_item2.get("response"),
+                         auth_item.get("response"))
+        self.assertEqual(get_tokens(serial=serial)[0].token.count, 101)
+        # Another PIN creates new hashes
+        auth_item2 = OfflineApplication.get_authentication_item(
+            "hotp", serial, challenge="pin" + "755224")
+        self.assertNotEqual(auth_item2.get("response").get(0),
+                            auth_item.get("response").get(0))
+
+        # calculate the hashes in worker processes
+        hashes = hash_otp_values({0: "755224", 1: "287082"}, otppin="pin",
+                                 rounds=1000, workers=2, serial=serial,
+                                 counter=0)
+        self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin755224",
+                                                          hashes.get(0)))
+        self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin287082",
+                                                          hashes.get(1)))
+        pool = workerpool._pools.get(POOL_NAME).get("pool")
+        pids = [process.pid for process in pool._pool]
+        # The second call neither calculates the hashes again nor forks
+        # new worker processes
+        self.assertEqual(hash_otp_values({0: "755224", 1: "287082"},
+                                         otppin="pin", rounds=1000,
+                                         workers=2, serial=serial,
+                                         counter=0), hashes)
+        hashes2 = hash_otp_values({0: "969429", 1: "338314"}, otppin="pin",
+                                  rounds=1000, workers=2, serial=serial,
+                                  counter=3)
+        self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin338314",
+                                                          hashes2.get(1)))
+        self.assertTrue(workerpool._pools.get(POOL_NAME).get("pool") is pool)
+        self.assertEqual([process.pid for process in pool._pool], pids)
+
     def test_03_get_auth_item_unsupported(self):
         # unsupported token type
         auth_item = OfflineApplication.get_authentication_item("unsupported",
@@ -5,7 +5,8 @@ This tests the token functions on an interface level
 """
 from .base import MyTestCase
 from privacyidea.lib.error import (TokenAdminError, ParameterError)
-from privacyidea.lib.challenge import get_challenges
+from privacyidea.lib.challenge import (get_challenges,
+                                       get_valid_challenge_serials)
 from privacyidea.lib.policy import (set_policy, delete_policy, SCOPE,
                                     ACTION)
 from privacyidea.lib.token import init_token
@@ -40,6 +41,11 @@ class ChallengeTestCase(MyTestCase):
         chals = get_challenges(serial="CHAL2")
         self.assertEqual(len(chals), 0)
 
+        # the serials of the valid challenges of the transaction
+        self.assertEqual(get_valid_challenge_serials(transaction_id),
+                         {"CHAL1"})
+        self.assertEqual(get_valid_challenge_serials("123456"), set())
+
         delete_policy("chalresp")
 
 
@@ -18,8 +18,12 @@ from privacyidea.lib.config import (get_resolver_list,
                                     get_token_class_dict,
                                     get_token_types,
                                     get_token_classes, get_token_prefix,
-                                    get_machine_resolver_class_dict
+                                    get_machine_resolver_class_dict,
+                                    get_token_class, token_registry,
+                                    ClassRegistry, _is_token_class,
+                                    _get_token_type
                                     )
+from privacyidea.lib.tokenclass import TokenClass
 from privacyidea.lib.resolvers.PasswdIdResolver import IdResolver as PWResolver
 from privacyidea.lib.tokens.hotptoken import HotpTokenClass
 from privacyidea.lib.tokens.totptoken import TotpTokenClass
@@ -27,6 +31,15 @@ from flask import current_app
 import importlib
 
 
+class CustomTokenClass(TokenClass):
+    """
+    A custom token type to test the registration of token modules
+    """
+    @staticmethod
+    def get_class_type():
+        return "Custom"
+
+
 class ConfigTestCase(MyTestCase):
     """
     Test the config on the database level
@@ -228,3 +241,42 @@ class ConfigTestCase(MyTestCase):
         self.assertTrue("secretInfo1" not in a)
         a = get_from_config("secretInfo1", role="public")
         self.assertEqual(a, None)
+
+    def test_07_class_registry(self):
+        # The token classes are looked up only once
+        self.assertTrue(get_token_class("TOTP") is TotpTokenClass)
+        self.assertTrue(get_token_class("hmac") is HotpTokenClass)
+        self.assertEqual(get_token_class("unknown"), None)
+        self.assertTrue(token_registry.get_class("totp") is TotpTokenClass)
+
+        calls = []
+
+        def get_modules():
+            calls.append(1)
+            return [importlib.import_module(
+                "privacyidea.lib.tokens.hotptoken")]
+
+        registry = ClassRegistry(get_modules, _is_token_class,
+                                 _get_token_type)
+        self.assertTrue(registry.get_class("hotp") is HotpTokenClass)
+        self.assertEqual(registry.get_class("totp"), None)
+        (classes, types) = registry.get_class_dicts()
+        self.assertEqual(types, {"privacyidea.lib.tokens.hotptoken."
+                                 "HotpTokenClass": "hotp"})
+        self.assertEqual(len(calls), 1)
+
+        # register a custom token module
+        registry.register_module(__name__)
+        registry.register_module(__name__)
+        self.assertTrue(registry.get_class("Custom") is CustomTokenClass)
+        self.assertEqual(registry.get_class("custom"), None)
+        self.assertTrue(registry.get_class("custom", ignore_case=True)
+                        is CustomTokenClass)
+        self.assertEqual(len(calls), 1)
+
+        # After a reset the modules are searched again, the registered
+        # modules are kept
+        registry.reset()
+        self.assertTrue(registry.get_class("Custom") is CustomTokenClass)
+        self.assertTrue(registry.get_class("hotp") is HotpTokenClass)
+        self.assertEqual(len(calls), 2)
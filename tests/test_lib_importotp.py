@@ -7,7 +7,9 @@ This test file tests the lib.importotp
 from .base import MyTestCase
 from privacyidea.lib.importotp import (parseOATHcsv, parseYubicoCSV,
                                        parseSafeNetXML, ImportException,
-                                       parsePSKCdata, GPGImport)
+                                       parsePSKCdata, GPGImport,
+                                       export_pskc, export_oath_csv)
+from privacyidea.lib.error import ParameterError
 import binascii
 
 
@@ -545,6 +547,79 @@ class ImportOTPTestCase(MyTestCase):
         self.assertEqual(tokens["987654321"].get("description"),
                          "TokenVendorAcme")
 
+    def test_06_export_pskc(self):
+        encryption_key_hex = "12345678901234567890123456789012"
+        tokens = [{"serial": "HOTP0001", "type": "hotp",
+                   "otpkey": "3132333435363738393031323334353637383930",
+                   "otplen": 8, "counter": 0},
+                  {"serial": "TOTP<1>", "type": "totp",
+                   "otpkey": "31323334353637383930313233343536373839303132",
+                   "otplen": 6, "timeStep": 60}]
+        self.assertRaises(ParameterError, export_pskc, tokens, "1234")
+        self.assertRaises(ParameterError, list,
+                          export_pskc([{"serial": "S1", "type": "spass"}],
+                                      encryption_key_hex))
+        xml = u"".join(export_pskc(tokens, encryption_key_hex))
+        # The secrets are encrypted
+        self.assertFalse(tokens[0].get("otpkey") in xml)
+        self.assertFalse("MTIzNDU2Nzg5MDEyMzQ1Njc4OTA=" in xml)
+
+        imported = parsePSKCdata(xml, preshared_key_hex=encryption_key_hex)
+        self.assertEqual(len(imported), 2)
+        self.assertEqual(imported["HOTP0001"].get("type"), "hotp")
+        self.assertEqual(imported["HOTP0001"].get("otplen"), "8")
+        self.assertEqual(imported["HOTP0001"].get("counter"), "0")
+        self.assertEqual(imported["HOTP0001"].get("otpkey"),
+                         tokens[0].get("otpkey"))
+        self.assertEqual(imported["TOTP<1>"].get("type"), "totp")
+        self.assertEqual(imported["TOTP<1>"].get("timeStep"), "60")
+        self.assertEqual(imported["TOTP<1>"].get("otpkey"),
+                         tokens[1].get("otpkey"))
+        self.assertEqual(imported["TOTP<1>"].get("hashlib"), "sha1")
+
+        # The hashlib is exported as the suite
+        tokens[1]["hashlib"] = "sha256"
+        xml = u"".join(export_pskc(tokens, encryption_key_hex))
+        self.assertTrue(u"<Suite>HMAC-SHA256</Suite>" in xml)
+        imported = parsePSKCdata(xml, preshared_key_hex=encryption_key_hex)
+        self.assertEqual(imported["TOTP<1>"].get("hashlib"), "sha256")
+        tokens[1]["hashlib"] = "md5"
+        self.assertRaises(ParameterError, list,
+                          export_pskc(tokens, encryption_key_hex))
+
+    def test_07_export_oath_csv(self):
+        tokens = [{"serial": "HOTP0001", "type": "hotp",
+                   "otpkey": "3132333435363738393031323334353637383930",
+                   "otplen": 8},
+                  {"serial": "TOTP0001", "type": "totp",
+                   "otpkey": "3132333435363738393031323334353637383930",
+                   "otplen": 6, "timeStep": 60}]
+        imported = parseOATHcsv(u"".join(export_oath_csv(tokens)))
+        self.assertEqual(imported["HOTP0001"].get("type"), "hotp")
+        self.assertEqual(imported["HOTP0001"].get("otplen"), 8)
+        self.assertEqual(imported["TOTP0001"].get("type"), "totp")
+        self.assertEqual(imported["TOTP0001"].get("timeStep"), 60)
+        self.assertEqual(imported["TOTP0001"].get("otpkey"),
+                         tokens[1].get("otpkey"))
+        self.assertEqual(imported["HOTP0001"].get("hashlib"), "sha1")
+
+        # The hashlib is exported, if it is not sha1
+        tokens = [{"serial": "HOTP0002", "type": "hotp",
+                   "otpkey": "31323334353637383930313233343536373839303132"
+                             "3334353637383930313233343536373839",
+                   "otplen": 6, "hashlib": "sha512"},
+                  {"serial": "TOTP0002", "type": "totp",
+                   "otpkey": "3132333435363738393031323334353637383930313"
+                             "2333435363738393031323334",
+                   "otplen": 6, "timeStep": 30, "hashlib": "sha256"}]
+        csv = u"".join(export_oath_csv(tokens))
+        self.assertTrue(u"HOTP0002, {0!s}, hotp, 6, 30, sha512\n".format(
+            tokens[0].get("otpkey")) in csv)
+        imported = parseOATHcsv(csv)
+        self.assertEqual(imported["HOTP0002"].get("hashlib"), "sha512")
+        self.assertEqual(imported["TOTP0002"].get("hashlib"), "sha256")
+        self.assertEqual(imported["TOTP0002"].get("timeStep"), 30)
+
 
 class GPGTestCase(MyTestCase):
 
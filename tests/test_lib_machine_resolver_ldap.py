@@ -6,6 +6,8 @@ lib/machines/ldap.py
 HOSTSFILE = "tests/testdata/hosts"
 from .base import MyTestCase
 from privacyidea.lib.machines.ldap import LdapMachineResolver
+from privacyidea.lib.machines import ldap as ldap_machines
+import copy
 from privacyidea.lib.machines.base import MachineResolverError
 import ldap3mock
 import netaddr
@@ -136,3 +138,41 @@ class LdapMachineTestCase(MyTestCase):
         self.assertTrue(success)
         self.assertEqual(desc, "Your LDAP config seems to be OK, 3 "
                                "machine objects found.")
+
+    @ldap3mock.activate
+    def test_08_pool_and_cache(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory)
+        LdapMachineResolver.clear_cache()
+        mreso = LdapMachineResolver("cacheResolver", config=MYCONFIG)
+        config_key = mreso._config_key
+        machine_id = mreso.get_machine_id(hostname="machine2.example.test")
+        self.assertEqual(machine_id, "cn=machine2,ou=example,o=test")
+        # The connection was put back to the pool and is used again
+        self.assertEqual(len(ldap_machines._connection_pool[config_key]), 1)
+        mreso.get_machines(hostname="machine", substring=True)
+        self.assertEqual(len(ldap_machines._connection_pool[config_key]), 1)
+
+        # The hostname changes in LDAP, but the lookup is read from the cache
+        directory = copy.deepcopy(LDAPDirectory)
+        directory[2]["attributes"]["dNSHostName"] = "machine4.example.test"
+        ldap3mock.setLDAPDirectory(directory)
+        mreso = LdapMachineResolver("cacheResolver", config=MYCONFIG)
+        machine_id = mreso.get_machine_id(hostname="machine2.example.test")
+        self.assertEqual(machine_id, "cn=machine2,ou=example,o=test")
+
+        # another configuration does not use the cache
+        config = MYCONFIG.copy()
+        config["CACHE_TIMEOUT"] = 0
+        mreso_nocache = LdapMachineResolver("cacheResolver", config=config)
+        self.assertNotEqual(mreso_nocache._config_key, config_key)
+        machine_id = mreso_nocache.get_machine_id(
+            hostname="machine2.example.test")
+        self.assertEqual(machine_id, None)
+
+        # invalidate the cache of the resolver
+        LdapMachineResolver.clear_cache("cacheResolver")
+        self.assertFalse(config_key in ldap_machines._connection_pool)
+        machine_id = mreso.get_machine_id(hostname="machine2.example.test")
+        self.assertEqual(machine_id, None)
+        machine_id = mreso.get_machine_id(hostname="machine4.example.test")
+        self.assertEqual(machine_id, "cn=machine2,ou=example,o=test")
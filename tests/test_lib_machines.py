@@ -10,9 +10,12 @@ lib.machines.hosts
 HOSTSFILE = "tests/testdata/hosts"
 from .base import MyTestCase
 from privacyidea.lib.machines import BaseMachineResolver
-from privacyidea.lib.machines.hosts import HostsMachineResolver
+from privacyidea.lib.machines.hosts import (HostsMachineResolver,
+                                           get_hosts_index)
 from privacyidea.lib.machines.base import Machine, MachineResolverError
 import netaddr
+import os
+import time
 from privacyidea.lib.machineresolver import (get_resolver_list, save_resolver,
                                      delete_resolver, get_resolver_config,
                                      get_resolver_object, pretestresolver)
@@ -226,3 +229,38 @@ class HostsMachineTestCase(MyTestCase):
         self.assertRaises(MachineResolverError,
                           self.mreso.load_config,
                           {"name": "nothing"})
+
+    def test_06_hosts_index(self):
+        hostsfile = "tests/testdata/hosts.tmp"
+        f = open(hostsfile, "w")
+        f.write("192.168.0.1 gandalf whitewizard\n"
+                "192.168.0.2 pippin\n")
+        f.close()
+        try:
+            index = get_hosts_index(hostsfile)
+            self.assertEqual(index.by_hostname.get("pippin"), [1])
+            self.assertEqual(index.substring_candidates(["wiz"]), set([0]))
+            # The same index is used, as long as the file does not change
+            self.assertTrue(get_hosts_index(hostsfile) is index)
+            mreso = HostsMachineResolver("tmpResolver",
+                                         config={"filename": hostsfile})
+            self.assertEqual(len(mreso.get_machines(any="wizard")), 1)
+            self.assertEqual(len(mreso.get_machines(hostname="ppi",
+                                                    substring=True)), 1)
+            self.assertEqual(mreso.get_machine_id(hostname="pippin",
+                                                  ip="192.168.0.2"),
+                             "192.168.0.2")
+            self.assertEqual(mreso.get_machine_id(hostname="pippin",
+                                                  ip="192.168.0.1"), None)
+
+            # change the file
+            f = open(hostsfile, "a")
+            f.write("192.168.1.10 borodin\n")
+            f.close()
+            os.utime(hostsfile, (time.time() + 10, time.time() + 10))
+            self.assertFalse(get_hosts_index(hostsfile) is index)
+            self.assertEqual(len(mreso.get_machines()), 3)
+            self.assertEqual(mreso.get_machine_id(hostname="borodin"),
+                             "192.168.1.10")
+        finally:
+            os.remove(hostsfile)
@@ -6,7 +6,8 @@ HOSTSFILE = "tests/testdata/hosts"
 from .base import MyTestCase
 from privacyidea.lib.machine import (attach_token, detach_token, add_option,
                                      delete_option, list_machine_tokens,
-                                     list_token_machines, get_auth_items)
+                                     list_token_machines, get_auth_items,
+                                     get_hosts_auth_items)
 from privacyidea.lib.token import init_token, get_tokens
 from privacyidea.lib.machineresolver import save_resolver
 
@@ -140,3 +141,27 @@ class MachineTokenTestCase(MyTestCase):
         sshkey_auth_items = ai.get("ssh")
         # None or an empty list
         self.assertFalse(sshkey_auth_items)
+
+        # fetch the auth_items of several hosts at once
+        init_token({"serial": "OFFLINE_BULK", "type": "hotp",
+                    "otpkey": "3132333435363738393031323334353637383930"})
+        attach_token(hostname="pippin", serial="OFFLINE_BULK",
+                     application="offline", options={"user": "testuser"})
+        ai = get_hosts_auth_items(["gandalf", "pippin", "borodin"])
+        self.assertEqual(set(ai.keys()), {"gandalf", "pippin", "borodin"})
+        self.assertTrue(ai.get("gandalf").get("ssh")[0].get(
+            "sshkey").startswith("ssh-rsa"))
+        self.assertEqual(len(ai.get("pippin").get("offline")[0].get(
+            "response")), 100)
+        self.assertEqual(ai.get("borodin"), {})
+        # Unknown hosts and aliases of the same machine
+        ai = get_hosts_auth_items(["gandalf", "whitewizard", "unknown"],
+                                  application="ssh")
+        self.assertEqual(ai.get("unknown"), {})
+        self.assertEqual(len(ai.get("gandalf").get("ssh")), 1)
+        self.assertEqual(ai.get("whitewizard"), ai.get("gandalf"))
+        # The offline application does not allow bulk calls
+        ai = get_hosts_auth_items(["gandalf", "pippin"], bulk_call=True)
+        self.assertEqual(len(ai.get("gandalf").get("ssh")), 1)
+        self.assertEqual(ai.get("pippin"), {})
+        detach_token("OFFLINE_BULK", "offline", hostname="pippin")
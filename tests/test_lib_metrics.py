@@ -0,0 +1,171 @@
+"""
+This file contains the tests for lib/metrics.py
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from privacyidea.lib import metrics
+from privacyidea.lib.metrics import (MetricsRegistry, REQUESTS_TOTAL,
+                                     REQUEST_SECONDS, OPERATION_SECONDS,
+                                     timed, timer)
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        metrics._registry = None
+
+    def test_01_counter_and_histogram(self):
+        registry = MetricsRegistry()
+        registry.inc(REQUESTS_TOTAL, endpoint="/validate/check",
+                     method="POST", status=200)
+        registry.inc(REQUESTS_TOTAL, endpoint="/validate/check",
+                     method="POST", status=200)
+        registry.observe(REQUEST_SECONDS, 0.003, endpoint="/validate/check",
+                         method="POST")
+        registry.observe(REQUEST_SECONDS, 0.2, endpoint="/validate/check",
+                         method="POST")
+        registry.observe(REQUEST_SECONDS, 20, endpoint="/validate/check",
+                         method="POST")
+        text = registry.exposition()
+        self.assertTrue("# TYPE privacyidea_requests_total counter" in text)
+        self.assertTrue('privacyidea_requests_total{endpoint="/validate/'
+                        'check",method="POST",status="200"} 2' in text, text)
+        self.assertTrue("# TYPE privacyidea_request_duration_seconds "
+                        "histogram" in text)
+        # The buckets are cumulated
+        self.assertTrue('privacyidea_request_duration_seconds_bucket{'
+                        'endpoint="/validate/check",method="POST",'
+                        'le="0.005"} 1' in text, text)
+        self.assertTrue('privacyidea_request_duration_seconds_bucket{'
+                        'endpoint="/validate/check",method="POST",'
+                        'le="0.25"} 2' in text, text)
+        self.assertTrue('privacyidea_request_duration_seconds_bucket{'
+                        'endpoint="/validate/check",method="POST",'
+                        'le="10.0"} 2' in text, text)
+        self.assertTrue('privacyidea_request_duration_seconds_bucket{'
+                        'endpoint="/validate/check",method="POST",'
+                        'le="+Inf"} 3' in text, text)
+        self.assertTrue('privacyidea_request_duration_seconds_sum{'
+                        'endpoint="/validate/check",method="POST"} 20.203'
+                        in text, text)
+        self.assertTrue('privacyidea_request_duration_seconds_count{'
+                        'endpoint="/validate/check",method="POST"} 3' in text,
+                        text)
+
+        # label values are escaped
+        registry.inc(REQUESTS_TOTAL, endpoint='/a"b\\c')
+        self.assertTrue('privacyidea_requests_total{endpoint="/a\\"b\\\\c"} 1'
+                        in registry.exposition())
+
+    def test_02_several_processes(self):
+        worker1 = MetricsRegistry(directory=self.directory, write_interval=60)
+        worker2 = MetricsRegistry(directory=self.directory, write_interval=60)
+        worker1.inc(REQUESTS_TOTAL, endpoint="/auth", method="POST",
+                    status=200)
+        worker1.observe(OPERATION_SECONDS, 0.01, operation="policy")
+        worker2.inc(REQUESTS_TOTAL, endpoint="/auth", method="POST",
+                    status=200)
+        worker2.observe(OPERATION_SECONDS, 0.5, operation="policy")
+        worker1.write()
+        worker2.write()
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+        counters, histograms = worker1.collect()
+        self.assertEqual(counters.get((REQUESTS_TOTAL, (
+            ("endpoint", "/auth"), ("method", "POST"), ("status", 200)))), 2)
+        histogram = histograms.get((OPERATION_SECONDS,
+                                    (("operation", "policy"),)))
+        self.assertEqual(histogram[-1], 2)
+        self.assertAlmostEqual(histogram[-2], 0.51)
+
+        # The file of worker2 is only written after the interval. But
+        # worker2 always reads its own metrics from memory.
+        worker2.inc(REQUESTS_TOTAL, endpoint="/auth", method="POST",
+                    status=200)
+        worker2.write()
+        counters, _histograms = worker1.collect()
+        self.assertEqual(counters.get((REQUESTS_TOTAL, (
+            ("endpoint", "/auth"), ("method", "POST"), ("status", 200)))), 2)
+        counters, _histograms = worker2.collect()
+        self.assertEqual(counters.get((REQUESTS_TOTAL, (
+            ("endpoint", "/auth"), ("method", "POST"), ("status", 200)))), 3)
+        worker2.write(force=True)
+        counters, _histograms = worker1.collect()
+        self.assertEqual(counters.get((REQUESTS_TOTAL, (
+            ("endpoint", "/auth"), ("method", "POST"), ("status", 200)))), 3)
+
+        # Broken files are skipped
+        with open(os.path.join(self.directory, "metrics-1-broken.json"),
+                  "w") as f:
+            f.write("{")
+        counters, _histograms = worker1.collect()
+        self.assertEqual(len(counters), 1)
+
+    def test_02b_stale_files(self):
+        worker = MetricsRegistry(directory=self.directory, write_interval=1)
+        worker.inc(REQUESTS_TOTAL, endpoint="/auth", method="POST",
+                   status=200)
+        worker.write()
+        data = json.dumps(worker.get_data())
+        # A finished process
+        process = subprocess.Popen(["true"])
+        process.wait()
+        old = time.time() - 60
+        for pid, mtime in [(process.pid, old), (process.pid, time.time()),
+                           (os.getpid(), old)]:
+            filename = os.path.join(self.directory, "metrics-{0!s}-{1!s}"
+                                                    ".json".format(pid,
+                                                                   mtime))
+            with open(filename, "w") as f:
+                f.write(data)
+            os.utime(filename, (mtime, mtime))
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+        # The old file of the finished process is removed. The recent file
+        # and the file of the running process are read.
+        counters, _histograms = worker.collect()
+        self.assertEqual(counters.get((REQUESTS_TOTAL, (
+            ("endpoint", "/auth"), ("method", "POST"), ("status", 200)))), 3)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+        # The worker removes its own file, when it exits
+        worker.remove_file()
+        self.assertFalse(os.path.exists(worker.filename))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_03_timed(self):
+
+        @timed("hsm")
+        def hsm_operation(value):
+            return 1 / value
+
+        # The metrics are not collected
+        self.assertEqual(hsm_operation(1), 1)
+        with timer("sms"):
+            pass
+
+        metrics._registry = MetricsRegistry()
+        self.assertEqual(hsm_operation(1), 1)
+        # failed operations are also measured
+        self.assertRaises(ZeroDivisionError, hsm_operation, 0)
+        with timer("sms"):
+            pass
+        try:
+            with timer("sms"):
+                raise ValueError()
+        except ValueError:
+            pass
+        _counters, histograms = metrics._registry.collect()
+        self.assertEqual(histograms.get((OPERATION_SECONDS,
+                                         (("operation", "hsm"),)))[-1], 2)
+        self.assertEqual(histograms.get((OPERATION_SECONDS,
+                                         (("operation", "sms"),)))[-1], 2)
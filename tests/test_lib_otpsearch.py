@@ -0,0 +1,76 @@
+"""
+This file contains the tests for lib/otpsearch.py
+"""
+from .base import MyTestCase
+from privacyidea.lib import workerpool
+from privacyidea.lib.otpsearch import OTPSearch, POOL_NAME
+from privacyidea.lib.token import init_token, remove_token, get_tokens
+from privacyidea.lib.error import TokenAdminError
+
+OTPKEY = "3132333435363738393031323334353637383930"
+OTPKEY2 = "010fe88d31948c0c2e3258a4b0f7b11956a258ef"
+
+
+class OTPSearchTestCase(MyTestCase):
+
+    def test_01_search_local(self):
+        for i in range(0, 7):
+            init_token({"serial": "OS{0!s}".format(i),
+                        "otpkey": OTPKEY2.replace("0", str(i + 1))})
+        init_token({"serial": "OSPW", "type": "spass"})
+        init_token({"serial": "OSHOTP", "otpkey": OTPKEY})
+
+        # 287082 is the second OTP value of OTPKEY
+        search = OTPSearch("287082", window=10, workers=0, chunk_size=3)
+        self.assertEqual(search.get_serial(), "OSHOTP")
+        self.assertTrue(search.complete)
+        self.assertEqual(search.searched, 9)
+        # The counter was increased, the OTP value can not be found again
+        self.assertEqual(get_tokens(serial="OSHOTP")[0].token.count, 2)
+        search = OTPSearch("287082", window=10, workers=0, chunk_size=3)
+        self.assertEqual(search.get_serial(), None)
+
+        # restrict the search
+        search = OTPSearch("969429", window=10, workers=0, serial="OS?",
+                           tokentype="hotp")
+        self.assertEqual(search.get_serial(), None)
+        search = OTPSearch("969429", window=10, workers=0, assigned=False)
+        self.assertEqual(search.get_serial(), "OSHOTP")
+
+    def test_02_search_pool(self):
+        search = OTPSearch("338314", window=10, workers=2, chunk_size=2)
+        self.assertEqual(search.get_serial(), "OSHOTP")
+        self.assertTrue(search.complete)
+        self.assertEqual(search.searched, 9)
+        self.assertEqual(get_tokens(serial="OSHOTP")[0].token.count, 5)
+        # The next search reuses the worker processes
+        pool = workerpool._pools.get(POOL_NAME).get("pool")
+        search = OTPSearch("287082", window=10, workers=2, chunk_size=2)
+        self.assertEqual(search.get_serial(), None)
+        self.assertTrue(workerpool._pools.get(POOL_NAME).get("pool") is pool)
+
+        # a second token creates the same OTP values
+        init_token({"serial": "OSHOTP2", "otpkey": OTPKEY})
+        search = OTPSearch("287922", window=10, workers=2, chunk_size=2)
+        self.assertRaises(TokenAdminError, search.get_serial)
+        search = OTPSearch("287922", window=10, workers=0, chunk_size=2)
+        self.assertRaises(TokenAdminError, search.get_serial)
+        remove_token("OSHOTP2")
+
+    def test_03_time_budget(self):
+        search = OTPSearch("254676", window=10, workers=0, chunk_size=2,
+                           timeout=0.000001)
+        self.assertEqual(search.get_serial(), None)
+        self.assertFalse(search.complete)
+        self.assertTrue(search.searched < 9)
+
+    def test_04_totp(self):
+        init_token({"serial": "OSTOTP", "type": "totp", "otpkey": OTPKEY})
+        token = get_tokens(serial="OSTOTP")[0]
+        _r, _pin, otp, _passw = token.get_otp()
+        search = OTPSearch(otp, window=10, workers=0, tokentype="totp")
+        self.assertEqual(search.get_serial(), "OSTOTP")
+        # The OTP value was used and can not be found again
+        search = OTPSearch(otp, window=10, workers=2, tokentype="totp")
+        self.assertEqual(search.get_serial(), None)
+        self.assertTrue(search.complete)
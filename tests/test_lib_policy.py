@@ -10,6 +10,7 @@ from privacyidea.lib.policy import (set_policy, delete_policy,
                                     get_static_policy_definitions,
                                     PolicyClass, SCOPE, enable_policy,
                                     PolicyError, ACTION)
+from privacyidea.lib import policy
 import datetime
 
 
@@ -533,3 +534,45 @@ class PolicyTestCase(MyTestCase):
         else:
             self.assertEqual(len(policies), 0)
         delete_policy("time1")
+
+    def test_19_cached_rights(self):
+        set_policy(name="tokenEnroll", scope=SCOPE.ADMIN,
+                   action="enrollHOTP, enable")
+        P = PolicyClass()
+        version = P.version
+        rights = P.ui_get_rights(SCOPE.ADMIN, "realm1", "admin")
+        self.assertEqual(sorted(rights), ["enable", "enrollHOTP"])
+        self.assertTrue((version, "rights", SCOPE.ADMIN, "realm1", "admin",
+                         None) in policy._rights_cache)
+        # The cached rights can be modified without changing the cache
+        rights.append("disable")
+        P = PolicyClass()
+        self.assertEqual(P.version, version)
+        self.assertEqual(sorted(P.ui_get_rights(SCOPE.ADMIN, "realm1",
+                                                "admin")),
+                         ["enable", "enrollHOTP"])
+        tt = P.ui_get_enroll_tokentypes(None, {"role": SCOPE.ADMIN,
+                                               "realm": "realm1",
+                                               "username": "admin"})
+        self.assertEqual(tt.keys(), ["hotp"])
+
+        # A changed policy changes the version
+        set_policy(name="tokenEnroll", scope=SCOPE.ADMIN,
+                   action="enrollTOTP")
+        P = PolicyClass()
+        self.assertNotEqual(P.version, version)
+        self.assertEqual(P.ui_get_rights(SCOPE.ADMIN, "realm1", "admin"),
+                         ["enrollTOTP"])
+        tt = P.ui_get_enroll_tokentypes(None, {"role": SCOPE.ADMIN,
+                                               "realm": "realm1",
+                                               "username": "admin"})
+        self.assertEqual(tt.keys(), ["totp"])
+
+        # The rights are not cached, if a policy is restricted to a time
+        set_policy(name="tokenEnroll", scope=SCOPE.ADMIN,
+                   action="enrollTOTP", time="Mon-Sun: 0-23:59")
+        P = PolicyClass()
+        self.assertEqual(P._rights_cache_key("rights"), None)
+        self.assertEqual(P.ui_get_rights(SCOPE.ADMIN, "realm1", "admin"),
+                         ["enrollTOTP"])
+        delete_policy("tokenEnroll")
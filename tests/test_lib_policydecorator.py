@@ -127,6 +127,20 @@ class LibPolicyTestCase(MyTestCase):
                           "test", options=options,
                           user=User("cornelius", realm="r1"))
         self.assertTrue(r)
+
+        # The policy and both userstore checks are remembered in the request
+        self.assertEqual(len(g.otppin_cache.get("policy")), 1)
+        self.assertEqual(sorted(g.otppin_cache.get("userstore").values()),
+                         [False, True])
+        # The password is not stored in clear text
+        self.assertFalse("test" in str(g.otppin_cache.get("userstore")))
+        # Checking the PIN again does not ask the userstore again
+        g.otppin_cache["userstore"] = dict(
+            (k, not v) for k, v in g.otppin_cache["userstore"].items())
+        r = auth_otppin(self.fake_check_otp, None,
+                        "test", options=options,
+                        user=User("cornelius", realm="r1"))
+        self.assertFalse(r)
         delete_policy("pol1")
 
     def test_03_otppin_for_serial(self):
@@ -14,7 +14,11 @@ from privacyidea.lib.realm import (set_realm,
                                    get_default_realm,
                                    realm_is_defined,
                                    set_default_realm,
-                                   delete_realm)
+                                   delete_realm,
+                                   get_ordered_resolvers,
+                                   get_resolver_realms,
+                                   REALM_TIMESTAMP_KEY)
+from privacyidea.models import Config, Realm, db
 
 
 class ResolverTestCase(MyTestCase):
@@ -82,6 +86,49 @@ class ResolverTestCase(MyTestCase):
         realm = get_default_realm()
         self.assertTrue(realm is None, realm)
 
+    def test_04_realm_topology(self):
+        (added, failed) = set_realm(self.realm1,
+                                    [self.resolvername1,
+                                     self.resolvername2],
+                                    priority={self.resolvername1: 20,
+                                              self.resolvername2: 10})
+        self.assertEqual(get_ordered_resolvers(self.realm1),
+                         [self.resolvername2, self.resolvername1])
+        self.assertEqual(get_ordered_resolvers("unknown"), [])
+        self.assertEqual(sorted(get_resolver_realms(self.resolvername2)),
+                         ["realm1", "realm2"])
+        self.assertEqual(get_resolver_realms(self.resolvername1), ["realm1"])
+
+        # The returned realms can be modified without changing the cache
+        realms = get_realms()
+        realms.get(self.realm1)["resolver"] = []
+        self.assertEqual(len(get_realms().get(self.realm1).get("resolver")),
+                         2)
+
+        # The realms are changed in another process. This is noticed by the
+        # realm timestamp
+        Realm.query.filter_by(name="realm2").update({"default": True})
+        Config.query.filter_by(Key=REALM_TIMESTAMP_KEY).update(
+            {"Value": u"changed"})
+        db.session.commit()
+        # The timestamp is only checked once per request
+        self.assertEqual(get_default_realm(), None)
+        from flask import g
+        g.realm_topology = None
+        self.assertEqual(get_default_realm(), "realm2")
+        set_default_realm()
+
+        # Without a timestamp, e.g. after a restore of the database, the
+        # realms are not cached
+        Config.query.filter_by(Key=REALM_TIMESTAMP_KEY).delete()
+        db.session.commit()
+        g.realm_topology = None
+        self.assertEqual(get_default_realm(), None)
+        Realm.query.filter_by(name="realm2").update({"default": True})
+        db.session.commit()
+        self.assertEqual(get_default_realm(), "realm2")
+        set_default_realm()
+
     def test_10_delete_realm(self):
         delete_realm(self.realm1)
         delete_realm("realm2")
@@ -23,8 +23,11 @@ from privacyidea.lib.resolver import (save_resolver,
                                       delete_resolver,
                                       get_resolver_config,
                                       get_resolver_list,
-                                      get_resolver_object, pretestresolver)
-from privacyidea.models import ResolverConfig
+                                      get_resolver_object, pretestresolver,
+                                      get_resolver_type,
+                                      RESOLVER_TIMESTAMP_KEY)
+from privacyidea.models import ResolverConfig, Resolver, Config, db
+from flask import g
 
 LDAPDirectory = [{"dn": "cn=alice,ou=example,o=test",
                  "attributes": {'cn': 'alice',
@@ -144,6 +147,11 @@ class SQLResolverTestCase(MyTestCase):
         uinfo = y.getUserInfo(user_id)
         self.assertTrue(uinfo.get("username") == "cornelius", uinfo)
 
+        uinfos = y.getMultipleUserInfo([user_id, "1", "9999"])
+        self.assertEqual(len(uinfos), 2)
+        self.assertEqual(uinfos.get(user_id).get("username"), "cornelius")
+        self.assertEqual(uinfos.get("1").get("username"), "user1")
+
         ret = y.getUserList({"username": "cornelius"})
         self.assertTrue(len(ret) == 1, ret)
 
@@ -682,6 +690,11 @@ class LDAPResolverTestCase(MyTestCase):
         uinfo = y.getUserInfo("3")
         self.assertTrue(uinfo.get("username") == "bob", uinfo)
 
+        uinfos = y.getMultipleUserInfo(["2", "3", "99"])
+        self.assertEqual(len(uinfos), 2)
+        self.assertEqual(uinfos.get("3").get("username"), "bob")
+        self.assertEqual(uinfos.get("2").get("username"), "alice")
+
         ret = y.getUserList({"username": "bob"})
         self.assertTrue(len(ret) == 1, ret)
 
@@ -1129,6 +1142,9 @@ class LDAPResolverTestCase(MyTestCase):
         self.assertEqual(user_info.get("surname"), "Marley")
         self.assertEqual(user_info.get("givenname"), "Robert")
 
+        user_infos = y.getMultipleUserInfo([user_id])
+        self.assertEqual(user_infos.get(user_id).get("username"), "bob")
+
     @ldap3mock.activate
     def test_22_caching_two_ldaps(self):
         # This test checks, if the cached values are seperated for two
@@ -1308,6 +1324,64 @@ class ResolverTestCase(MyTestCase):
         reso_obj = get_resolver_object("unknown")
         self.assertTrue(reso_obj is None, reso_obj)
 
+    def test_06_resolver_cache(self):
+        self.assertEqual(get_resolver_type(self.resolvername1),
+                         "passwdresolver")
+        self.assertEqual(get_resolver_type("unknown"), None)
+        # The returned resolvers can be modified without changing the cache
+        reso_list = get_resolver_list()
+        reso_list.get(self.resolvername1)["data"]["fileName"] = "/tmp/x"
+        reso_config = get_resolver_config(self.resolvername1)
+        self.assertEqual(reso_config.get("fileName"), "/etc/passwd")
+        reso_config["fileName"] = "/tmp/x"
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), "/etc/passwd")
+
+        # The resolver is changed in another process. This is noticed by the
+        # resolver timestamp
+        ResolverConfig.query.filter_by(Key="fileName",
+                                       Value="/etc/passwd").update(
+            {"Value": PWFILE})
+        Config.query.filter_by(Key=RESOLVER_TIMESTAMP_KEY).update(
+            {"Value": u"changed"})
+        db.session.commit()
+        # The timestamp is only checked once per request
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), "/etc/passwd")
+        g.resolver_definitions = None
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), PWFILE)
+
+        # Saving the resolver drops the cache
+        save_resolver({"resolver": self.resolvername1,
+                       "type": "passwdresolver",
+                       "fileName": "/etc/passwd"})
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), "/etc/passwd")
+
+        # Without a timestamp, e.g. after a restore of the database, the
+        # resolvers are not cached
+        Config.query.filter_by(Key=RESOLVER_TIMESTAMP_KEY).delete()
+        db.session.commit()
+        g.resolver_definitions = None
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), "/etc/passwd")
+        ResolverConfig.query.filter_by(Key="fileName",
+                                       Value="/etc/passwd").update(
+            {"Value": PWFILE})
+        db.session.commit()
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), PWFILE)
+        # save_resolver updates the resolver, that is in the database
+        resolver_id = Resolver.query.filter_by(
+            name=self.resolvername1).first().id
+        self.assertEqual(save_resolver({"resolver": self.resolvername1,
+                                        "type": "passwdresolver",
+                                        "fileName": "/etc/passwd"}),
+                         resolver_id)
+        self.assertEqual(get_resolver_config(self.resolvername1).get(
+            "fileName"), "/etc/passwd")
+
     def test_10_delete_resolver(self):
         # get the list of the resolvers
         reso_list = get_resolver_list()
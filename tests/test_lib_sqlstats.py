@@ -0,0 +1,64 @@
+"""
+This file contains the tests for lib/sqlstats.py
+"""
+from .base import MyTestCase
+from flask import g
+from privacyidea.lib.sqlstats import (SQLStats, init_app, add_to_audit,
+                                      get_request_stats)
+from privacyidea.lib.audit import getAudit
+
+
+class SQLStatsTestCase(MyTestCase):
+
+    def test_01_sqlstats(self):
+        stats = SQLStats()
+        stats.add("privacyidea", 0.25)
+        stats.add("audit", 0.5)
+        stats.add("privacyidea", 0.25)
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.engines.get("privacyidea"), (2, 0.5))
+        self.assertEqual("{0!s}".format(stats),
+                         "3 SQL queries in 1.000 seconds (audit: 1, "
+                         "privacyidea: 2)")
+        self.assertFalse(stats.exceeds())
+        self.assertFalse(stats.exceeds(max_queries=3, max_time=1.5))
+        self.assertTrue(stats.exceeds(max_queries=2))
+        self.assertTrue(stats.exceeds(max_time=0.9))
+
+    def test_02_add_to_audit(self):
+        audit_object = getAudit(self.app.config)
+        with self.app.test_request_context('/validate/check',
+                                           method='POST'):
+            g.sql_stats = SQLStats()
+            g.sql_stats.add("privacyidea", 0.5)
+            g.sql_stats_max_queries = 2
+            g.sql_stats_max_time = 0
+            audit_object.log({"info": "wrong otp pin"})
+            # The threshold is not exceeded
+            add_to_audit(audit_object)
+            self.assertEqual(audit_object.audit_data.get("info"),
+                             "wrong otp pin")
+
+            g.sql_stats.add("audit", 0.5)
+            g.sql_stats.add("audit", 0.5)
+            add_to_audit(audit_object)
+            self.assertEqual(audit_object.audit_data.get("info"),
+                             "wrong otp pin 3 SQL queries in 1.500 seconds "
+                             "(audit: 2, privacyidea: 1)")
+        # outside of a request nothing is counted
+        self.assertEqual(get_request_stats(), None)
+
+    def test_03_request_headers(self):
+        self.app.config["PI_SQL_STATS_MAX_QUERIES"] = 1
+        init_app(self.app)
+        with self.app.test_request_context('/token/',
+                                           method='GET',
+                                           headers={'Authorization':
+                                                        self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            self.assertTrue(int(res.headers.get("X-PI-SQL-Queries")) > 1)
+            self.assertTrue(float(res.headers.get("X-PI-SQL-Time")) > 0)
+            stats = get_request_stats()
+            self.assertTrue(stats.engines.get("privacyidea")[0] > 0)
+            self.assertTrue(stats.engines.get("audit")[0] > 0)
@@ -50,11 +50,16 @@ from privacyidea.lib.token import (create_tokenclass_object,
                                    check_user_pass,
                                    get_dynamic_policy_definitions,
                                    get_tokens_paginate,
+                                   get_tokens_export,
                                    set_validity_period_end,
-                                   set_validity_period_start)
+                                   set_validity_period_start,
+                                   revoke_token, bulk_token_action,
+                                   gen_serials, bulk_init_tokens)
 
 from privacyidea.lib.error import (TokenAdminError, ParameterError,
                                    privacyIDEAError)
+from privacyidea.lib.importotp import (export_pskc, export_oath_csv,
+                                       parsePSKCdata, parseOATHcsv)
 
 
 class TokenTestCase(MyTestCase):
@@ -888,6 +893,33 @@ class TokenTestCase(MyTestCase):
         self.assertTrue(len(tokens.get("tokens")) == 1,
                         len(tokens.get("tokens")))
 
+    def test_41b_get_tokens_export(self):
+        rows = list(get_tokens_export(chunk_size=4))
+        self.assertEqual(len(rows), 15)
+        # all tokens are exported exactly once
+        self.assertEqual(len(set([r.get("serial") for r in rows])), 15)
+
+        rows = list(get_tokens_export(user=User("cornelius", "realm1"),
+                                      columns=["serial", "username",
+                                               "user_realm"],
+                                      chunk_size=1))
+        self.assertEqual(len(rows), 2)
+        for row in rows:
+            self.assertEqual(set(row.keys()),
+                             {"serial", "username", "user_realm"})
+            self.assertEqual(row.get("username"), "cornelius")
+            self.assertEqual(row.get("user_realm"), "realm1")
+
+        rows = list(get_tokens_export(serial="S1", columns=["serial",
+                                                            "realms"]))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0].get("serial"), "S1")
+        self.assertEqual(rows[0].get("realms"), [self.realm1])
+
+        # unknown columns are refused
+        self.assertRaises(ParameterError, list,
+                          get_tokens_export(columns=["serial", "otpkey"]))
+
     def test_42_sort_tokens(self):
         # return pagination
         tokendata = get_tokens_paginate(sortby=Token.serial, page=1, psize=5)
@@ -1039,6 +1071,41 @@ class TokenTestCase(MyTestCase):
         # so we get "wrong otp pin"
         self.assertEqual(r[1].get("message"), "matching 1 tokens")
 
+        # The failcounter of the tokens with a wrong PIN is not increased
+        failcount = get_tokens(serial="assigned")[0].token.failcount
+        r = check_realm_pass(self.realm1, "wrongpin" + "287082")
+        self.assertEqual(r, (False, {"message": "wrong otp pin"}))
+        self.assertEqual(get_tokens(serial="assigned")[0].token.failcount,
+                         failcount)
+
+        # Too many tokens match the PIN
+        init_token({"serial": "assigned2",
+                    "otpkey": self.otpkey[:-2] + "31",
+                    "pin": "assigned"}, User("cornelius", self.realm1))
+        self.app.config["PI_REALMPASS_MAX_CANDIDATES"] = 1
+        r = check_realm_pass(self.realm1, "assigned" + "359152")
+        self.assertEqual(r[0], False)
+        self.assertEqual(r[1].get("message"),
+                         "Too many matching tokens in this realm")
+        self.app.config.pop("PI_REALMPASS_MAX_CANDIDATES")
+        r = check_realm_pass(self.realm1, "assigned" + "359152")
+        self.assertEqual(r[0], True)
+        self.assertEqual(r[1].get("serial"), "assigned")
+        remove_token("assigned2")
+
+        # Tokens, whose PIN is not checked in advance, are not counted
+        self.app.config["PI_REALMPASS_MAX_CANDIDATES"] = 1
+        for i in range(3):
+            init_token({"serial": "realmspass{0!s}".format(i),
+                        "type": "spass", "pin": "spass"},
+                       User("cornelius", self.realm1))
+        r = check_realm_pass(self.realm1, "assigned" + "969429")
+        self.assertEqual(r[0], True)
+        self.assertEqual(r[1].get("serial"), "assigned")
+        self.app.config.pop("PI_REALMPASS_MAX_CANDIDATES")
+        for i in range(3):
+            remove_token("realmspass{0!s}".format(i))
+
     def test_46_init_with_validity_period(self):
         token = init_token({"type": "hotp",
                             "genkey": 1,
@@ -1064,6 +1131,133 @@ class TokenTestCase(MyTestCase):
         self.assertEqual(r[1].get('message'), "wrong otp value")
 
 
+    def test_48_bulk_token_action(self):
+        serials = ["BULK{0:d}".format(i) for i in range(5)]
+        for serial in serials:
+            init_token({"serial": serial, "otpkey": self.otpkey})
+        revoke_token("BULK4")
+
+        # Missing token filter or unknown action
+        self.assertRaises(ParameterError, bulk_token_action, "disable")
+        self.assertRaises(ParameterError, bulk_token_action, "delete",
+                          serials=serials)
+
+        r = bulk_token_action("disable", serials=serials + ["unknown"],
+                              chunk_size=2)
+        self.assertEqual(r.get("count"), 4)
+        self.assertEqual(r.get("skipped"), {"BULK4": "locked",
+                                            "unknown": "not found"})
+        self.assertFalse(is_token_active("BULK0"))
+        # The disabled tokens are not changed again
+        r = bulk_token_action("disable", serial="BULK*")
+        self.assertEqual(r.get("count"), 0)
+
+        r = bulk_token_action("enable", serial="BULK*", chunk_size=3)
+        self.assertEqual(sorted(r.get("changed")), serials[:4])
+        self.assertTrue(is_token_active("BULK0"))
+
+        # set the realms, the tokens of realm1 are not allowed
+        r = bulk_token_action("realm", serials=serials,
+                              realms=[self.realm1, "unknown"])
+        self.assertEqual(r.get("count"), 5)
+        self.assertEqual(get_realms_of_token("BULK2"), [self.realm1])
+        r = bulk_token_action("reset", serial="BULK*",
+                              check_realm=lambda realm: realm != self.realm1)
+        self.assertEqual(r.get("count"), 0)
+        self.assertEqual(r.get("skipped").get("BULK0"), "not allowed")
+
+        # assign the tokens
+        user = User("cornelius", self.realm1)
+        token = get_tokens(serial="BULK1")[0]
+        token.token.failcount = 5
+        token.save()
+        r = bulk_token_action("assign", serials=serials[:3], user=user,
+                              limit=2)
+        self.assertEqual(r.get("changed"), ["BULK0", "BULK1"])
+        self.assertEqual(r.get("skipped"), {"BULK2": "limit"})
+        token = get_tokens(serial="BULK1")[0]
+        self.assertEqual(token.token.failcount, 0)
+        self.assertEqual(token.user, user)
+        r = bulk_token_action("assign", serials=serials[:3], user=user)
+        self.assertEqual(r.get("skipped"), {"BULK0": "assigned",
+                                            "BULK1": "assigned"})
+        self.assertEqual(get_tokens(user=user, serial="BULK*", count=True),
+                         3)
+
+        r = bulk_token_action("revoke", serials=serials)
+        self.assertEqual(r.get("count"), 5)
+        token = get_tokens(serial="BULK0")[0]
+        self.assertTrue(token.is_revoked())
+        self.assertTrue(token.is_locked())
+        for serial in serials:
+            remove_token(serial)
+
+    def test_49_bulk_init_tokens(self):
+        serials = gen_serials(5, "hotp", prefix="GEN", chunk_size=2)
+        self.assertEqual(len(serials), 5)
+        self.assertEqual(len(set(serials)), 5)
+        self.assertTrue(serials[0].startswith("GEN"))
+
+        self.assertRaises(ParameterError, bulk_init_tokens, 1, "spass")
+        self.assertRaises(ParameterError, bulk_init_tokens, 0)
+        self.assertRaises(ParameterError, bulk_init_tokens, 1,
+                          hashlib="md5")
+
+        tokens = bulk_init_tokens(5, "totp", prefix="BINIT",
+                                  realms=[self.realm1, "unknown"],
+                                  hashlib="sha256", otplen=8, timestep=60,
+                                  chunk_size=2)
+        self.assertEqual(len(tokens), 5)
+        self.assertEqual(len(tokens[0].get("otpkey")), 64)
+        self.assertEqual(tokens[0].get("timeStep"), 60)
+        token_list = get_tokens(serial="BINIT*")
+        self.assertEqual(len(token_list), 5)
+        token = get_tokens(serial=tokens[0].get("serial"))[0]
+        self.assertEqual(token.type, "totp")
+        self.assertEqual(token.token.otplen, 8)
+        self.assertEqual(token.get_realms(), [self.realm1])
+        self.assertEqual(token.get_tokeninfo("hashlib"), "sha256")
+        self.assertEqual(token.get_tokeninfo("timeStep"), "60")
+        self.assertFalse(token.token.user_id)
+        # The generated key is stored in the token
+        self.assertEqual(token.token.get_otpkey().getKey(),
+                         tokens[0].get("otpkey"))
+        self.assertEqual(len(get_tokens(serial="BINIT*", assigned=False)), 5)
+
+        # The exported sha256 token calculates the same OTP values, after it
+        # is imported again.
+        now = datetime.datetime(2016, 10, 19, 12, 0, 0)
+        otp = token.get_otp(current_time=now)[2]
+        serial = tokens[0].get("serial")
+        psk = "12345678901234567890123456789012"
+        for imported in [parsePSKCdata(u"".join(export_pskc(tokens[:1], psk)),
+                                       preshared_key_hex=psk),
+                         parseOATHcsv(u"".join(export_oath_csv(tokens[:1])))]:
+            remove_token(serial)
+            self.assertEqual(imported[serial].get("hashlib"), "sha256")
+            init_token({"serial": serial,
+                        "type": imported[serial].get("type"),
+                        "otpkey": imported[serial].get("otpkey"),
+                        "otplen": imported[serial].get("otplen"),
+                        "timeStep": imported[serial].get("timeStep"),
+                        "hashlib": imported[serial].get("hashlib")})
+            token = get_tokens(serial=serial)[0]
+            self.assertEqual(token.get_tokeninfo("hashlib"), "sha256")
+            self.assertEqual(token.get_otp(current_time=now)[2], otp)
+
+        tokens = bulk_init_tokens(3)
+        token = get_tokens(serial=tokens[0].get("serial"))[0]
+        self.assertEqual(token.type, "hotp")
+        self.assertEqual(token.get_tokeninfo("hashlib"), "sha1")
+        self.assertEqual(tokens[0].get("counter"), 0)
+        self.assertEqual(len(tokens[0].get("otpkey")), 40)
+        for token in get_tokens(serial="BINIT*"):
+            remove_token(token.token.serial)
+        for token in tokens:
+            remove_token(token.get("serial"))
+        self.assertEqual(get_tokens(serial=tokens[1].get("serial")), [])
+
+
 class TokenFailCounterTestCase(MyTestCase):
     """
     Test the lib.token on an interface level
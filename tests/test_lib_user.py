@@ -14,7 +14,12 @@ from privacyidea.lib.user import (User, create_user,
                                   get_user_info,
                                   get_user_list,
                                   split_user,
-                                  get_user_from_param)
+                                  get_user_from_param,
+                                  _call_resolvers)
+from privacyidea.lib.resolvers.PasswdIdResolver import IdResolver as \
+    PasswdResolver
+from multiprocessing import TimeoutError
+import time
 
 
 class UserTestCase(MyTestCase):
@@ -337,4 +342,56 @@ class UserTestCase(MyTestCase):
         self.assertEqual(r[2], "reso3")
         self.assertEqual(r[3], "resolver1")
 
+        # The resolvers are asked concurrently, but the resolver with the
+        # highest priority wins
+        self.assertEqual(root.get_resolvers(), ["reso4"])
+
         delete_realm("sort_realm")
+
+    def test_17_call_resolvers(self):
+        def slow_user_id(y):
+            if y.fileName == PWFILE:
+                # The first resolver is slow
+                time.sleep(2)
+            return y.getUserId("cornelius")
+
+        # The resolvers are called concurrently
+        self.app.config["PI_RESOLVER_WORKERS"] = 4
+        resolvers = ["resolver1", "reso3"]
+        results = list(_call_resolvers(slow_user_id, resolvers))
+        self.assertEqual([r[0] for r in results], resolvers)
+        self.assertEqual(results[0], ("resolver1", "1009", None))
+        self.assertEqual(results[1], ("reso3", "1000", None))
+
+        # The slow resolver does not answer in time
+        self.app.config["PI_RESOLVER_TIMEOUT"] = 0.5
+        results = list(_call_resolvers(slow_user_id, resolvers))
+        self.assertEqual(results[0][0], "resolver1")
+        self.assertTrue(isinstance(results[0][2][1], TimeoutError))
+        self.assertEqual(results[1], ("reso3", "1000", None))
+
+        # A resolver with a higher priority, that does not answer in time,
+        # is not skipped
+        set_realm("timeout_realm", ["resolver1", "reso3"],
+                  priority={"resolver1": 1, "reso3": 2})
+        get_user_id = PasswdResolver.__dict__["getUserId"]
+
+        def slow_get_user_id(y, login):
+            if y.fileName == PWFILE:
+                time.sleep(2)
+            return get_user_id(y, login)
+
+        PasswdResolver.getUserId = slow_get_user_id
+        try:
+            self.assertRaises(TimeoutError, User, "cornelius",
+                              "timeout_realm")
+        finally:
+            PasswdResolver.getUserId = get_user_id
+        delete_realm("timeout_realm")
+
+        # The resolvers are called one after another
+        self.app.config["PI_RESOLVER_WORKERS"] = 0
+        results = list(_call_resolvers(slow_user_id, resolvers))
+        self.assertEqual(results[0], ("resolver1", "1009", None))
+        self.app.config.pop("PI_RESOLVER_TIMEOUT")
+        self.app.config.pop("PI_RESOLVER_WORKERS")
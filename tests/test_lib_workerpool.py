@@ -0,0 +1,67 @@
+"""
+This file contains the tests for lib/workerpool.py
+"""
+import os
+import unittest
+from multiprocessing.pool import ThreadPool
+from privacyidea.lib import workerpool
+from privacyidea.lib.workerpool import get_pool, terminate_pool
+
+_initialized = []
+
+
+def _init_worker(value):
+    _initialized.append(value)
+
+
+def _get_pid(_arg):
+    return os.getpid()
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        terminate_pool("test")
+
+    def test_01_reuse_pool(self):
+        pool = get_pool("test", 2, pool_class=ThreadPool)
+        self.assertTrue(get_pool("test", 2, pool_class=ThreadPool) is pool)
+        self.assertEqual(pool.map(abs, [-1, -2]), [1, 2])
+
+        # A changed number of workers creates a new pool
+        pool2 = get_pool("test", 3, pool_class=ThreadPool)
+        self.assertFalse(pool2 is pool)
+        self.assertTrue(get_pool("test", 3, pool_class=ThreadPool) is pool2)
+
+        # The pool was inherited from another process
+        workerpool._pools.get("test")["pid"] = -1
+        pool3 = get_pool("test", 3, pool_class=ThreadPool)
+        self.assertFalse(pool3 is pool2)
+        pool2.close()
+        pool2.join()
+
+        terminate_pool("test")
+        self.assertFalse("test" in workerpool._pools)
+        self.assertFalse(get_pool("test", 3, pool_class=ThreadPool) is pool3)
+
+    def test_02_initializer(self):
+        del _initialized[:]
+        pool = get_pool("test", 2, pool_class=ThreadPool,
+                        initializer=_init_worker, initargs=("a",))
+        self.assertEqual(_initialized, ["a", "a"])
+        self.assertTrue(get_pool("test", 2, pool_class=ThreadPool,
+                                 initializer=_init_worker,
+                                 initargs=("a",)) is pool)
+        # Other arguments create a new pool
+        get_pool("test", 2, pool_class=ThreadPool, initializer=_init_worker,
+                 initargs=("b",))
+        self.assertEqual(_initialized, ["a", "a", "b", "b"])
+
+    def test_03_processes(self):
+        pool = get_pool("test", 2)
+        pids = set(pool.map(_get_pid, range(10)))
+        self.assertFalse(os.getpid() in pids)
+        # The second call uses the same worker processes
+        self.assertTrue(get_pool("test", 2) is pool)
+        self.assertTrue(set(pool.map(_get_pid, range(10))).issubset(
+            set(p.pid for p in pool._pool)))
@@ -2,13 +2,17 @@
 This test tests the authmodules/Apache2/privacyidea_apache.py
 """
 from .base import MyTestCase
+from authmodules.apache2 import privacyidea_apache
 from authmodules.apache2.privacyidea_apache import (OK, UNAUTHORIZED,
                                                     check_password,
-                                                    ROUNDS, SALT_SIZE)
+                                                    ROUNDS, SALT_SIZE,
+                                                    _get_config)
 import responses
 import json
 import redismock
 import passlib.hash
+import os
+import time
 
 
 SUCCESS_BODY = {"detail": {"message": "matching 1 tokens",
@@ -38,6 +42,9 @@ class ApacheTestCase(MyTestCase):
                                                 rounds=ROUNDS,
                                                 salt_size=SALT_SIZE)
 
+    def setUp(self):
+        privacyidea_apache._local_cache.clear()
+
     @redismock.activate
     @responses.activate
     def test_01_success(self):
@@ -71,3 +78,65 @@ class ApacheTestCase(MyTestCase):
         r = check_password({}, "cornelius", "test100002")
         self.assertEqual(r, UNAUTHORIZED)
 
+    @redismock.activate
+    @responses.activate
+    def test_04_local_cache(self):
+        redismock.set_data({})
+        responses.add(responses.POST,
+                      "https://localhost/validate/check",
+                      body=json.dumps(SUCCESS_BODY),
+                      content_type="application/json")
+        r = check_password({}, "cornelius", "test100001")
+        self.assertEqual(r, OK)
+        self.assertEqual(len(responses.calls), 1)
+
+        # The credentials are verified in the process, neither redis nor
+        # privacyIDEA are asked.
+        redismock.set_data({})
+        r = check_password({}, "cornelius", "test100001")
+        self.assertEqual(r, OK)
+        self.assertEqual(len(responses.calls), 1)
+
+        # A wrong password is not accepted from the local cache
+        responses.reset()
+        responses.add(responses.POST,
+                      "https://localhost/validate/check",
+                      body=json.dumps(FAIL_BODY),
+                      content_type="application/json")
+        r = check_password({}, "cornelius", "test100002")
+        self.assertEqual(r, UNAUTHORIZED)
+
+        # The local cache expires
+        key, (expires, digest) = privacyidea_apache._local_cache.items()[0]
+        privacyidea_apache._local_cache[key] = (time.time() - 1, digest)
+        r = check_password({}, "cornelius", "test100001")
+        self.assertEqual(r, UNAUTHORIZED)
+
+    def test_05_config_cache(self):
+        config_file = "tests/testdata/apache.conf.tmp"
+        default_config_file = privacyidea_apache.CONFIG_FILE
+        privacyidea_apache.CONFIG_FILE = config_file
+        try:
+            f = open(config_file, "w")
+            f.write("[DEFAULT]\nredis = redis1\nprivacyidea = "
+                    "https://pi1\nsslverify = False\n")
+            f.close()
+            self.assertEqual(_get_config(), ("https://pi1", "redis1", False))
+            self.assertEqual(privacyidea_apache._config_cache.get("stamp")[0],
+                             config_file)
+
+            # The file is not read again, as long as it is not modified
+            privacyidea_apache._config_cache["config"] = ("https://cached",
+                                                          "redis1", False)
+            self.assertEqual(_get_config(), ("https://cached", "redis1",
+                                             False))
+
+            f = open(config_file, "w")
+            f.write("[DEFAULT]\nredis = redis2\nprivacyidea = "
+                    "https://pi2\nsslverify = False\n")
+            f.close()
+            os.utime(config_file, (time.time() + 10, time.time() + 10))
+            self.assertEqual(_get_config(), ("https://pi2", "redis2", False))
+        finally:
+            privacyidea_apache.CONFIG_FILE = default_config_file
+            os.remove(config_file)